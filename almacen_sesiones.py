@@ -0,0 +1,222 @@
+from datetime import datetime
+import copy
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+# ------------------ CONFIG ------------------
+# CHATBOT_SESSION_BACKEND: mongo | memoria | sqlite
+BACKEND_POR_DEFECTO = os.getenv("CHATBOT_SESSION_BACKEND", "mongo")
+RUTA_SQLITE = os.getenv("CHATBOT_SQLITE_PATH", "sesiones.db")
+
+
+class AlmacenSesiones:
+    """Interfaz común de los almacenes de conversación.
+
+    Los documentos tienen la forma de `Conversacion.a_documento()`:
+    {"_id", "estado", "memoria", "recientes", "ts"}.
+    """
+
+    def cargar(self, cliente_id: str) -> dict | None:
+        raise NotImplementedError
+
+    def guardar(self, conversacion):
+        """Persiste los cambios pendientes de una `Conversacion` en una sola operación."""
+        raise NotImplementedError
+
+    def obtener_estado(self, cliente_id: str) -> dict:
+        doc = self.cargar(cliente_id)
+        return doc.get("estado", {}) if doc else {}
+
+    def actualizar_estado(self, cliente_id: str, nuevo_estado: dict):
+        raise NotImplementedError
+
+    def eliminar(self, cliente_id: str):
+        raise NotImplementedError
+
+    def cerrar(self):
+        pass
+
+
+def _documento_vacio(cliente_id: str) -> dict:
+    return {"_id": cliente_id, "estado": {}, "memoria": {}, "recientes": []}
+
+
+def _aplicar_operacion(doc: dict, operacion: dict):
+    """Aplica sobre `doc` el update de `Conversacion.operacion_guardado()` ($set con rutas y $push)."""
+    for ruta, valor in operacion.get("$set", {}).items():
+        destino = doc
+        *padres, campo = ruta.split(".")
+        for padre in padres:
+            destino = destino.setdefault(padre, {})
+        destino[campo] = copy.deepcopy(valor)
+    for campo, push in operacion.get("$push", {}).items():
+        lista = doc.setdefault(campo, []) + copy.deepcopy(push["$each"])
+        doc[campo] = lista[push["$slice"]:] if "$slice" in push else lista
+
+
+# ------------------ MONGO ------------------
+class AlmacenMongo(AlmacenSesiones):
+    def __init__(self, coleccion):
+        self.coleccion = coleccion
+
+    def cargar(self, cliente_id):
+        return self.coleccion.find_one({"_id": cliente_id})
+
+    def guardar(self, conversacion):
+        if conversacion._reiniciada:
+            self.coleccion.replace_one({"_id": conversacion.cliente_id}, conversacion.a_documento(), upsert=True)
+        else:
+            self.coleccion.update_one({"_id": conversacion.cliente_id}, conversacion.operacion_guardado(), upsert=True)
+
+    def obtener_estado(self, cliente_id):
+        doc = self.coleccion.find_one({"_id": cliente_id}, {"estado": 1})
+        return doc.get("estado", {}) if doc else {}
+
+    def actualizar_estado(self, cliente_id, nuevo_estado):
+        self.coleccion.update_one(
+            {"_id": cliente_id},
+            {"$set": {f"estado.{k}": v for k, v in nuevo_estado.items()}},
+            upsert=True
+        )
+
+    def eliminar(self, cliente_id):
+        self.coleccion.delete_one({"_id": cliente_id})
+
+
+# ------------------ MEMORIA ------------------
+class AlmacenMemoria(AlmacenSesiones):
+    """Almacén en proceso, útil para pruebas y despliegues de un solo worker."""
+
+    def __init__(self):
+        self._docs = {}
+        self._lock = threading.Lock()
+
+    def cargar(self, cliente_id):
+        with self._lock:
+            doc = self._docs.get(cliente_id)
+            return copy.deepcopy(doc) if doc else None
+
+    def guardar(self, conversacion):
+        # Como en Mongo: solo se aplican los cambios pendientes, así no se pisa lo que
+        # otro escribió con actualizar_estado después de cargar la conversación
+        if conversacion._reiniciada:
+            doc = copy.deepcopy(conversacion.a_documento())
+            with self._lock:
+                self._docs[conversacion.cliente_id] = doc
+            return
+        operacion = conversacion.operacion_guardado()
+        with self._lock:
+            _aplicar_operacion(self._docs.setdefault(conversacion.cliente_id, _documento_vacio(conversacion.cliente_id)),
+                               operacion)
+
+    def actualizar_estado(self, cliente_id, nuevo_estado):
+        with self._lock:
+            doc = self._docs.setdefault(cliente_id, _documento_vacio(cliente_id))
+            doc["estado"].update(copy.deepcopy(nuevo_estado))
+            doc["ts"] = datetime.now()
+
+    def eliminar(self, cliente_id):
+        with self._lock:
+            self._docs.pop(cliente_id, None)
+
+
+# ------------------ SQLITE ------------------
+def _codificar(valor):
+    if isinstance(valor, datetime):
+        return {"$date": valor.isoformat()}
+    raise TypeError(f"Tipo no serializable: {type(valor)}")
+
+
+def _decodificar(obj):
+    if len(obj) == 1 and "$date" in obj:
+        return datetime.fromisoformat(obj["$date"])
+    return obj
+
+
+class AlmacenSQLite(AlmacenSesiones):
+    """Almacén embebido en SQLite (modo WAL): un renglón JSON por cliente."""
+
+    def __init__(self, ruta: str = RUTA_SQLITE):
+        self.ruta = ruta
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(ruta, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS conversaciones ("
+            "cliente_id TEXT PRIMARY KEY, doc TEXT NOT NULL, ts TEXT NOT NULL)"
+        )
+
+    def cargar(self, cliente_id):
+        with self._lock:
+            fila = self._conn.execute(
+                "SELECT doc FROM conversaciones WHERE cliente_id = ?", (cliente_id,)
+            ).fetchone()
+        return json.loads(fila[0], object_hook=_decodificar) if fila else None
+
+    def _escribir(self, cliente_id, doc):
+        self._conn.execute(
+            "INSERT INTO conversaciones (cliente_id, doc, ts) VALUES (?, ?, ?) "
+            "ON CONFLICT(cliente_id) DO UPDATE SET doc = excluded.doc, ts = excluded.ts",
+            (cliente_id, json.dumps(doc, default=_codificar, ensure_ascii=False), datetime.now().isoformat())
+        )
+
+    def _modificar(self, cliente_id, funcion):
+        """Lee, modifica y reescribe el renglón dentro de una transacción."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                fila = self._conn.execute(
+                    "SELECT doc FROM conversaciones WHERE cliente_id = ?", (cliente_id,)
+                ).fetchone()
+                doc = json.loads(fila[0], object_hook=_decodificar) if fila else _documento_vacio(cliente_id)
+                funcion(doc)
+                self._escribir(cliente_id, doc)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def guardar(self, conversacion):
+        if conversacion._reiniciada:
+            with self._lock:
+                self._escribir(conversacion.cliente_id, conversacion.a_documento())
+            return
+        operacion = conversacion.operacion_guardado()
+        self._modificar(conversacion.cliente_id, lambda doc: _aplicar_operacion(doc, operacion))
+
+    def actualizar_estado(self, cliente_id, nuevo_estado):
+        def aplicar(doc):
+            doc["estado"].update(nuevo_estado)
+            doc["ts"] = datetime.now()
+        self._modificar(cliente_id, aplicar)
+
+    def eliminar(self, cliente_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM conversaciones WHERE cliente_id = ?", (cliente_id,))
+
+    def cerrar(self):
+        with self._lock:
+            self._conn.close()
+
+
+def crear_almacen(backend: str | None = None, coleccion=None) -> AlmacenSesiones:
+    """Crea el almacén configurado; `coleccion` es obligatoria para el backend mongo."""
+    backend = (backend or BACKEND_POR_DEFECTO).lower()
+    if backend == "mongo":
+        if coleccion is None:
+            raise ValueError("El backend mongo requiere la colección de conversaciones")
+        almacen = AlmacenMongo(coleccion)
+    elif backend == "memoria":
+        almacen = AlmacenMemoria()
+    elif backend == "sqlite":
+        almacen = AlmacenSQLite(RUTA_SQLITE)
+    else:
+        raise ValueError(f"Backend de sesiones desconocido: {backend}")
+    logger.info(f"Almacén de sesiones: {backend}")
+    return almacen
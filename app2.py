@@ -3,6 +3,8 @@ from pymongo import MongoClient
 import ollama
 from datetime import datetime, timedelta
 
+from resumen import operacion_turno, refrescar_contexto, resumen_para_chat, resumen_vacio
+
 # --- Configuración MongoDB ---
 client = MongoClient("mongodb://localhost:27017/")
 db = client["chatbotdb"]
@@ -105,9 +107,8 @@ def guardar_mensaje(cliente_id, rol, contenido, asistente=None):
     if asistente:
         doc["asistente"] = asistente
     historial_col.insert_one(doc)
-
-def obtener_historial(cliente_id):
-    return list(historial_col.find({"cliente_id": cliente_id}))
+    # Resumen incremental junto al estado: contadores y últimos turnos sin releer el historial
+    estado_col.update_one({"cliente_id": cliente_id}, operacion_turno(rol, contenido), upsert=True)
 
 def actualizar_estado(cliente_id, nuevo_estado):
     estado_col.update_one(
@@ -199,8 +200,10 @@ def pedir_contacto(cliente_id, asistente):
             print("Disculpa, el número que ingresaste no parece válido. Por favor, ingresa un número de teléfono válido (ej. +1234567890).")
 
 def generar_respuesta_ollama(cliente_id, asesor, area):
-    historial = obtener_historial(cliente_id)
-    mensajes = [{"role": h["rol"], "content": h["contenido"]} for h in historial]
+    estado = obtener_estado(cliente_id)
+    resumen = {**resumen_vacio(), **estado.get("resumen", {})}
+    refrescar_contexto(resumen, {k: v for k, v in estado.items() if k != "resumen"}, {})
+    mensajes = resumen_para_chat(resumen)
     system_prompt = {
         "role": "system",
         "content": f"Eres {asesor}, un asesor experto en el área de {area} de una agencia automotriz. Responde de manera profesional, útil y amigable. Usa el nombre del cliente si lo sabes."
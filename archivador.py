@@ -0,0 +1,345 @@
+"""Archiva en frío documentos antiguos de historial/bitácora en archivos comprimidos por mes.
+
+Lee los documentos anteriores a la fecha de corte por lotes de cursor, los escribe en
+particiones mensuales (JSONL comprimido con zstd o Parquet) y solo después de que el
+lote está en disco lo borra de MongoDB.
+
+Cada lote es un bloque independiente del archivo (un frame zstd o un row group de
+Parquet). Al cerrar la partición se escribe junto a ella `<archivo>.clientes.json`:
+cliente -> bloques donde aparece, para que leer la conversación de un cliente solo
+descomprima esos bloques. Sin índice (partición a medias) se lee completa.
+
+Uso:
+  python archivador.py --coleccion historial --antes 2025-01-01 [--formato jsonl|parquet]
+                       [--dir archivo] [--lote 1000] [--mongo URI] [--db chatbotdb] [--dry-run]
+"""
+from pymongo import MongoClient
+from bson import json_util
+from datetime import datetime, timezone
+import argparse
+import glob
+import io
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Dependencias opcionales: solo se necesitan para el formato elegido
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pc = pq = None
+
+DIR_ARCHIVO = os.getenv("CHATBOT_DIR_ARCHIVO", "archivo")
+COLECCION_INDICE_BUSQUEDA = "indice_busqueda"       # ver busqueda.indice_de
+SUFIJO_INDICE = ".clientes.json"
+
+# Campo de fecha que define la partición, campo de cliente del índice y columnas fijas del formato Parquet
+COLECCIONES = {
+    "historial": {"fecha": "fecha", "cliente": "cliente_id", "columnas": ["cliente_id", "role", "mensaje"]},
+    "historial_buckets": {"fecha": "fin", "cliente": "cliente_id", "columnas": ["cliente_id", "dia", "n"]},
+    "bitacora": {"fecha": "fecha_completa", "cliente": "client_id",
+                 "columnas": ["event", "client_id", "advisor_phone", "assignment_id"]},
+}
+
+
+def _indexar(indice: dict, docs: list, campo_cliente: str, bloque):
+    for cliente in {d.get(campo_cliente) for d in docs}:
+        if cliente is not None:
+            indice.setdefault(str(cliente), []).append(bloque)
+
+
+def _guardar_indice(ruta: str, indice: dict):
+    # Reemplazo atómico: un índice a medias haría saltar bloques
+    temporal = f"{ruta}{SUFIJO_INDICE}.tmp"
+    with open(temporal, "w", encoding="utf-8") as fh:
+        json.dump(indice, fh)
+    os.replace(temporal, f"{ruta}{SUFIJO_INDICE}")
+
+
+# ------------------ ESCRITORES ------------------
+class EscritorJSONL:
+    extension = "jsonl.zst"
+
+    def __init__(self, ruta: str, campo_cliente: str):
+        if zstandard is None:
+            raise RuntimeError("El formato jsonl requiere el paquete 'zstandard'")
+        self.ruta = ruta
+        self.campo_cliente = campo_cliente
+        self.indice = {}
+        self._fh = open(ruta, "wb")
+        self._zst = zstandard.ZstdCompressor(level=10).stream_writer(self._fh, closefd=False)
+
+    def escribir(self, docs: list):
+        inicio = self._fh.tell()
+        for doc in docs:
+            self._zst.write(json_util.dumps(doc, ensure_ascii=False).encode() + b"\n")
+        # Cierra el frame para que lo escrito sea legible aunque el proceso muera después
+        self._zst.flush(zstandard.FLUSH_FRAME)
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+        # Bloque = [inicio, fin) en bytes del frame
+        _indexar(self.indice, docs, self.campo_cliente, [inicio, self._fh.tell()])
+
+    def cerrar(self):
+        self._zst.close()
+        self._fh.close()
+        _guardar_indice(self.ruta, self.indice)
+
+
+class EscritorParquet:
+    extension = "parquet"
+
+    def __init__(self, ruta: str, columnas: list, campo_fecha: str, campo_cliente: str):
+        if pq is None:
+            raise RuntimeError("El formato parquet requiere el paquete 'pyarrow'")
+        self.ruta = ruta
+        self.campo_cliente = campo_cliente
+        self.indice = {}
+        self._grupos = 0
+        self.columnas = columnas
+        self.campo_fecha = campo_fecha
+        self.esquema = pa.schema(
+            [("_id", pa.string()), (campo_fecha, pa.timestamp("ms"))]
+            + [(c, pa.string()) for c in columnas]
+            + [("extra", pa.string())]
+        )
+        self._writer = pq.ParquetWriter(ruta, self.esquema, compression="zstd")
+
+    def escribir(self, docs: list):
+        fijas = {"_id", self.campo_fecha, *self.columnas}
+        filas = {
+            "_id": [str(d["_id"]) for d in docs],
+            self.campo_fecha: [d.get(self.campo_fecha) for d in docs],
+            "extra": [json_util.dumps({k: v for k, v in d.items() if k not in fijas}, ensure_ascii=False) for d in docs],
+        }
+        for c in self.columnas:
+            filas[c] = [None if d.get(c) is None else str(d.get(c)) for d in docs]
+        # Un row group por lote (bloque = su número); ordenado por cliente para que las
+        # estadísticas min/max del row group también sirvan para filtrar
+        tabla = pa.table(filas, schema=self.esquema)
+        if self.campo_cliente in self.columnas:
+            tabla = tabla.sort_by(self.campo_cliente)
+        self._writer.write_table(tabla, row_group_size=max(len(docs), 1))
+        _indexar(self.indice, docs, self.campo_cliente, self._grupos)
+        self._grupos += 1
+
+    def cerrar(self):
+        self._writer.close()
+        _guardar_indice(self.ruta, self.indice)
+
+
+def crear_escritor(formato: str, ruta_base: str, coleccion: str):
+    config = COLECCIONES[coleccion]
+    if formato == "parquet":
+        return EscritorParquet(f"{ruta_base}.{EscritorParquet.extension}", config["columnas"], config["fecha"],
+                               config["cliente"])
+    return EscritorJSONL(f"{ruta_base}.{EscritorJSONL.extension}", config["cliente"])
+
+
+# ------------------ ARCHIVADO ------------------
+def tamano_coleccion(db, nombre: str) -> tuple:
+    stats = db.command("collStats", nombre)
+    return stats.get("size", 0), stats.get("storageSize", 0)
+
+
+def archivar(db, coleccion: str, antes: datetime, formato: str = "jsonl", directorio: str = DIR_ARCHIVO,
+             lote: int = 1000, dry_run: bool = False) -> dict:
+    campo = COLECCIONES[coleccion]["fecha"]
+    col = db[coleccion]
+    sello = datetime.now().strftime("%Y%m%dT%H%M%S")
+    escritores = {}
+    archivados = 0
+    tam_antes = tamano_coleccion(db, coleccion)
+    inicio = time.perf_counter()
+
+    cursor = col.find({campo: {"$lt": antes}}).batch_size(lote)
+    try:
+        docs = []
+        for doc in cursor:
+            docs.append(doc)
+            if len(docs) >= lote:
+                archivados += _escribir_lote(db, col, coleccion, campo, docs, escritores, formato, directorio, sello, dry_run)
+                docs = []
+        if docs:
+            archivados += _escribir_lote(db, col, coleccion, campo, docs, escritores, formato, directorio, sello, dry_run)
+    finally:
+        for escritor in escritores.values():
+            escritor.cerrar()
+
+    segundos = time.perf_counter() - inicio
+    tam_despues = tamano_coleccion(db, coleccion)
+    return {
+        "coleccion": coleccion,
+        "archivados": archivados,
+        "segundos": segundos,
+        "docs_por_segundo": archivados / segundos if segundos else 0,
+        "bytes_datos_liberados": tam_antes[0] - tam_despues[0],
+        # WiredTiger solo devuelve el espacio en disco al sistema tras `compact`
+        "bytes_disco_liberados": tam_antes[1] - tam_despues[1],
+        "particiones": sorted(escritores),
+    }
+
+
+def _escribir_lote(db, col, coleccion, campo, docs, escritores, formato, directorio, sello, dry_run) -> int:
+    por_mes = {}
+    for doc in docs:
+        por_mes.setdefault(doc[campo].strftime("%Y-%m"), []).append(doc)
+    for mes, grupo in por_mes.items():
+        if dry_run:
+            escritores.setdefault(mes, _EscritorNulo())
+            continue
+        if mes not in escritores:
+            carpeta = os.path.join(directorio, coleccion, mes)
+            os.makedirs(carpeta, exist_ok=True)
+            escritores[mes] = crear_escritor(formato, os.path.join(carpeta, f"part-{sello}"), coleccion)
+        escritores[mes].escribir(grupo)
+    if not dry_run:
+        col.delete_many({"_id": {"$in": [d["_id"] for d in docs]}})
+        _desindexar(db, coleccion, docs)
+    return len(docs)
+
+
+def _desindexar(db, coleccion: str, docs: list):
+    """Quita del índice de búsqueda los mensajes archivados: ya no se pueden abrir desde historial."""
+    if coleccion == "historial":
+        ids = [d["_id"] for d in docs]
+    elif coleccion == "historial_buckets":
+        ids = [m["_id"] for d in docs for m in d.get("mensajes", [])]
+    else:
+        return
+    if ids:
+        db[COLECCION_INDICE_BUSQUEDA].delete_many({"_id": {"$in": ids}})
+
+
+class _EscritorNulo:
+    def cerrar(self):
+        pass
+
+
+# ------------------ LECTURA BAJO DEMANDA ------------------
+def _utc_ingenua(fecha: datetime | None) -> datetime | None:
+    """Fechas comparables con las guardadas: MongoDB trata las ingenuas como UTC."""
+    if fecha is None or fecha.tzinfo is None:
+        return fecha
+    return fecha.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _meses(desde: datetime | None, hasta: datetime | None, carpetas: list) -> list:
+    elegidos = []
+    for carpeta in carpetas:
+        mes = os.path.basename(carpeta)
+        if desde and mes < desde.strftime("%Y-%m"):
+            continue
+        if hasta and mes > hasta.strftime("%Y-%m"):
+            continue
+        elegidos.append(carpeta)
+    return sorted(elegidos)
+
+
+def _particiones(carpeta: str) -> list:
+    extensiones = (EscritorJSONL.extension, EscritorParquet.extension)
+    return sorted(r for r in glob.glob(os.path.join(carpeta, "part-*")) if r.endswith(extensiones))
+
+
+def _leer_indice(ruta: str) -> dict | None:
+    try:
+        with open(f"{ruta}{SUFIJO_INDICE}", encoding="utf-8") as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return None
+
+
+def _filas_parquet(tabla) -> list:
+    docs = []
+    for fila in tabla.to_pylist():
+        extra = json_util.loads(fila.pop("extra") or "{}")
+        docs.append({**{k: v for k, v in fila.items() if v is not None}, **extra})
+    return docs
+
+
+def _leer_particion(ruta: str, cliente: str | None = None, campo_cliente: str = "cliente_id") -> list:
+    """Documentos de la partición; con `cliente`, solo los bloques donde aparece según el índice."""
+    indice = _leer_indice(ruta) if cliente is not None else None
+    bloques = indice.get(cliente, []) if indice is not None else None
+    if bloques == []:
+        return []
+    if ruta.endswith(".parquet"):
+        if pq is None:
+            raise RuntimeError("Leer archivos parquet requiere el paquete 'pyarrow'")
+        if cliente is None:
+            return _filas_parquet(pq.read_table(ruta))
+        if bloques is None:
+            # Sin índice: filtro empujado al lector (poda row groups por estadísticas)
+            return _filas_parquet(pq.read_table(ruta, filters=[(campo_cliente, "==", cliente)]))
+        tabla = pq.ParquetFile(ruta).read_row_groups(bloques)
+        return _filas_parquet(tabla.filter(pc.equal(tabla[campo_cliente], cliente)))
+    if zstandard is None:
+        raise RuntimeError("Leer archivos jsonl.zst requiere el paquete 'zstandard'")
+    with open(ruta, "rb") as fh:
+        if bloques is None:
+            lector = io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(fh, read_across_frames=True),
+                                      encoding="utf-8")
+            lineas = list(lector)
+        else:
+            lineas = []
+            for inicio, fin in bloques:
+                fh.seek(inicio)
+                lineas.extend(zstandard.ZstdDecompressor().decompressobj().decompress(fh.read(fin - inicio))
+                              .decode("utf-8").splitlines())
+    docs = [json_util.loads(linea) for linea in lineas if linea.strip()]
+    if cliente is not None:
+        docs = [d for d in docs if d.get(campo_cliente) == cliente]
+    return docs
+
+
+def cargar_conversacion_archivada(cliente_id: str, desde: datetime | None = None, hasta: datetime | None = None,
+                                  directorio: str = DIR_ARCHIVO) -> list:
+    """Mensajes archivados de un cliente en orden cronológico (layouts documento y bucket)."""
+    desde, hasta = _utc_ingenua(desde), _utc_ingenua(hasta)
+    mensajes = []
+    for coleccion in ("historial", "historial_buckets"):
+        carpetas = glob.glob(os.path.join(directorio, coleccion, "*"))
+        for carpeta in _meses(desde, hasta, carpetas):
+            for ruta in _particiones(carpeta):
+                for doc in _leer_particion(ruta, cliente_id, COLECCIONES[coleccion]["cliente"]):
+                    for m in (doc.get("mensajes", []) if coleccion == "historial_buckets" else [doc]):
+                        fecha = m["fecha"] if isinstance(m["fecha"], datetime) else datetime.fromisoformat(str(m["fecha"]))
+                        fecha = _utc_ingenua(fecha)
+                        if (desde and fecha < desde) or (hasta and fecha > hasta):
+                            continue
+                        mensajes.append({"role": m.get("role"), "mensaje": m.get("mensaje"), "fecha": fecha})
+    mensajes.sort(key=lambda m: m["fecha"])
+    return mensajes
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--coleccion", choices=sorted(COLECCIONES), required=True)
+    parser.add_argument("--antes", required=True, help="Fecha de corte YYYY-MM-DD (se archiva lo anterior)")
+    parser.add_argument("--formato", choices=["jsonl", "parquet"], default="jsonl")
+    parser.add_argument("--dir", default=DIR_ARCHIVO)
+    parser.add_argument("--lote", type=int, default=1000)
+    parser.add_argument("--mongo", default="mongodb://localhost:27017/")
+    parser.add_argument("--db", default="chatbotdb")
+    parser.add_argument("--dry-run", action="store_true", help="Cuenta lo que se archivaría sin escribir ni borrar")
+    args = parser.parse_args()
+
+    client = MongoClient(args.mongo, serverSelectionTimeoutMS=5000)
+    reporte = archivar(client[args.db], args.coleccion, datetime.fromisoformat(args.antes),
+                       args.formato, args.dir, args.lote, args.dry_run)
+    logger.info(
+        f"{reporte['coleccion']}: {reporte['archivados']} documentos en {reporte['segundos']:.1f} s "
+        f"({reporte['docs_por_segundo']:.0f} docs/s), datos liberados {reporte['bytes_datos_liberados'] / 1e6:.2f} MB, "
+        f"disco liberado {reporte['bytes_disco_liberados'] / 1e6:.2f} MB, particiones {reporte['particiones']}"
+    )
+    print(json.dumps(reporte, default=str))
@@ -0,0 +1,340 @@
+"""Motor de asignación de asesores con estrategias intercambiables.
+
+Antes cada servidor tomaba el primer activo no consultado (`next(...)` lineal),
+`asesores[0]` o `random.choice` sobre la colección completa: la carga se cargaba
+hacia los primeros del padrón y cada elección leía toda la colección. Aquí las
+estrategias trabajan sobre estructuras en memoria que se reconstruyen solo cuando
+el padrón (padron_asesores.PadronAsesores) se recarga:
+
+- round_robin: anillo (deque) que rota en cada elección.
+- menos_cargado: montículo por asignaciones abiertas, con entradas perezosas.
+- area: un sub-grupo por (área, tipo de auto) —Ventas/Servicios/Refacciones,
+  nuevo/usado— cada uno con su propia estrategia; si el grupo exacto no tiene a
+  nadie libre se cae al área y después al padrón completo.
+
+Elegir cuesta O(1) amortizado (O(k log n) con k asesores excluidos). La carga vive
+en memoria de cada proceso; `fijar_cargas` la resincroniza desde las asignaciones
+abiertas en MongoDB.
+
+Cada asesor declara `capacidad` (leads simultáneos; ASESOR_CAPACIDAD por defecto,
+0 = sin límite). Los que están llenos se saltan, y si nadie tiene cupo `elegir`
+devuelve None sin recorrer el padrón (el lead espera en cola_leads).
+
+Con `presencia` (presencia.Presencia) se elige primero entre los asesores
+presentes y solo si ninguno está libre se cae a los ausentes. Con `turnos`
+(turnos.Turnos) los asesores con calendario que están fuera de turno no se eligen.
+"""
+from collections import deque
+import heapq
+import itertools
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# ------------------ CONFIG ------------------
+ESTRATEGIA = os.getenv("ASIGNACION_ESTRATEGIA", "round_robin")      # round_robin | menos_cargado | area
+ESTRATEGIA_GRUPO = os.getenv("ASIGNACION_ESTRATEGIA_GRUPO", "menos_cargado")   # dentro de cada grupo de `area`
+AREA_POR_DEFECTO = "Ventas"
+TIPOS_AUTO = ("nuevo", "usado")
+CAPACIDAD = int(os.getenv("ASESOR_CAPACIDAD", "3"))               # leads abiertos por asesor; 0 = sin límite
+
+
+class Estrategia:
+    """Interfaz común: las estrategias trabajan con teléfonos; el motor resuelve el resto."""
+
+    def sincronizar(self, asesores):
+        raise NotImplementedError
+
+    def elegir(self, excluir, **contexto) -> str | None:
+        raise NotImplementedError
+
+    def abrir(self, telefono: str):
+        pass
+
+    def liberar(self, telefono: str):
+        pass
+
+    def fijar_cargas(self, cargas: dict):
+        pass
+
+
+class RoundRobin(Estrategia):
+    def __init__(self):
+        self._anillo = deque()
+
+    def sincronizar(self, asesores):
+        telefonos = [a["telefono"] for a in asesores]
+        siguiente = self._anillo[0] if self._anillo else None
+        self._anillo = deque(telefonos)
+        # Conserva el turno si el siguiente asesor sigue activo
+        if siguiente in telefonos:
+            self._anillo.rotate(-telefonos.index(siguiente))
+
+    def elegir(self, excluir, **contexto) -> str | None:
+        for _ in range(len(self._anillo)):
+            telefono = self._anillo[0]
+            self._anillo.rotate(-1)
+            if telefono not in excluir:
+                return telefono
+        return None
+
+
+class MenosCargado(Estrategia):
+    """Montículo (carga, secuencia, teléfono); una entrada solo vale si su secuencia es la vigente.
+
+    A igual carga gana quien lleva más tiempo sin cambios, así que reparte en turno.
+    """
+
+    def __init__(self):
+        self._cargas = {}
+        self._vigente = {}
+        self._heap = []
+        self._secuencia = itertools.count()
+
+    def _empujar(self, telefono: str):
+        secuencia = next(self._secuencia)
+        self._vigente[telefono] = secuencia
+        heapq.heappush(self._heap, (self._cargas[telefono], secuencia, telefono))
+
+    def _reconstruir(self):
+        self._heap = []
+        self._vigente = {}
+        for telefono in self._cargas:
+            secuencia = next(self._secuencia)
+            self._vigente[telefono] = secuencia
+            self._heap.append((self._cargas[telefono], secuencia, telefono))
+        heapq.heapify(self._heap)
+
+    def sincronizar(self, asesores):
+        self._cargas = {a["telefono"]: self._cargas.get(a["telefono"], 0) for a in asesores}
+        self._reconstruir()
+
+    def fijar_cargas(self, cargas: dict):
+        self._cargas = {t: cargas.get(t, 0) for t in self._cargas}
+        self._reconstruir()
+
+    def elegir(self, excluir, **contexto) -> str | None:
+        apartados = []
+        elegido = None
+        while self._heap:
+            entrada = heapq.heappop(self._heap)
+            telefono = entrada[2]
+            if self._vigente.get(telefono) != entrada[1]:
+                continue    # entrada vieja: la carga cambió o el asesor salió del padrón
+            if telefono in excluir:
+                apartados.append(entrada)
+                continue
+            elegido = entrada
+            break
+        for entrada in apartados:
+            heapq.heappush(self._heap, entrada)
+        if elegido is None:
+            return None
+        heapq.heappush(self._heap, elegido)
+        return elegido[2]
+
+    def abrir(self, telefono: str):
+        if telefono in self._cargas:
+            self._cargas[telefono] += 1
+            self._empujar(telefono)
+
+    def liberar(self, telefono: str):
+        if self._cargas.get(telefono, 0) > 0:
+            self._cargas[telefono] -= 1
+            self._empujar(telefono)
+        # Compacta si las entradas viejas dominan el montículo
+        if len(self._heap) > 4 * len(self._cargas) + 64:
+            self._reconstruir()
+
+    def carga(self, telefono: str) -> int:
+        return self._cargas.get(telefono, 0)
+
+
+class PorArea(Estrategia):
+    """Un grupo por (área, tipo de auto), por área y uno general, cada uno con su estrategia."""
+
+    def __init__(self, fabrica=MenosCargado):
+        self.fabrica = fabrica
+        self._grupos = {}
+        self._claves_de = {}
+
+    @staticmethod
+    def _claves(asesor: dict) -> list:
+        area = asesor.get("area") or AREA_POR_DEFECTO
+        tipos = asesor.get("tipos") or TIPOS_AUTO
+        return [(area, tipo) for tipo in tipos] + [(area, None), (None, None)]
+
+    def sincronizar(self, asesores):
+        miembros = {}
+        self._claves_de = {}
+        for asesor in asesores:
+            claves = self._claves(asesor)
+            self._claves_de[asesor["telefono"]] = claves
+            for clave in claves:
+                miembros.setdefault(clave, []).append(asesor)
+        grupos = {}
+        for clave, lista in miembros.items():
+            grupos[clave] = self._grupos.get(clave) or self.fabrica()
+            grupos[clave].sincronizar(lista)
+        self._grupos = grupos
+
+    def fijar_cargas(self, cargas: dict):
+        for grupo in self._grupos.values():
+            grupo.fijar_cargas(cargas)
+
+    def elegir(self, excluir, area: str | None = None, tipo_auto: str | None = None, **contexto) -> str | None:
+        area = area or AREA_POR_DEFECTO
+        for clave in ((area, tipo_auto), (area, None), (None, None)):
+            grupo = self._grupos.get(clave)
+            telefono = grupo.elegir(excluir) if grupo else None
+            if telefono:
+                return telefono
+        return None
+
+    def abrir(self, telefono: str):
+        for clave in self._claves_de.get(telefono, ()):
+            self._grupos[clave].abrir(telefono)
+
+    def liberar(self, telefono: str):
+        for clave in self._claves_de.get(telefono, ()):
+            self._grupos[clave].liberar(telefono)
+
+
+ESTRATEGIAS = {"round_robin": RoundRobin, "menos_cargado": MenosCargado}
+
+
+def crear_estrategia(nombre: str = ESTRATEGIA) -> Estrategia:
+    if nombre == "area":
+        return PorArea(ESTRATEGIAS[ESTRATEGIA_GRUPO])
+    if nombre not in ESTRATEGIAS:
+        raise ValueError(f"Estrategia de asignación desconocida: {nombre}")
+    return ESTRATEGIAS[nombre]()
+
+
+# ------------------ MOTOR ------------------
+class _Excluidos:
+    """Consultados + un predicado (llenos, fuera de turno, ausentes) para saltar ambos en una sola pasada."""
+    __slots__ = ("consultados", "lleno")
+
+    def __init__(self, consultados, lleno):
+        self.consultados = consultados
+        self.lleno = lleno
+
+    def __contains__(self, telefono) -> bool:
+        return telefono in self.consultados or self.lleno(telefono)
+
+
+class MotorAsignacion:
+    """Elige asesores del padrón con la estrategia configurada y lleva sus asignaciones abiertas.
+
+    `elegir` ya cuenta la asignación como abierta; quien la cierre (rechazo, timeout,
+    lead completado) debe llamar a `liberar` con el mismo teléfono.
+    """
+
+    def __init__(self, padron, estrategia: Estrategia | str | None = None, capacidad: int = CAPACIDAD,
+                 presencia=None, turnos=None):
+        self.padron = padron
+        self.presencia = presencia
+        self.turnos = turnos
+        self.estrategia = crear_estrategia(estrategia or ESTRATEGIA) if not isinstance(estrategia, Estrategia) else estrategia
+        self.capacidad = capacidad
+        self._lock = threading.Lock()
+        self._recargas = None
+        self._capacidades = {}
+        self._cargas = {}
+        self._con_cupo = 0
+        self.elecciones = 0
+
+    def _lleno(self, telefono: str) -> bool:
+        capacidad = self._capacidades.get(telefono, 0)
+        return capacidad > 0 and self._cargas.get(telefono, 0) >= capacidad
+
+    def _recontar(self):
+        self._con_cupo = sum(1 for t in self._capacidades if not self._lleno(t))
+
+    def _sincronizar(self):
+        asesores = self.padron.instantanea()
+        if self.padron.recargas != self._recargas:
+            self.estrategia.sincronizar(asesores)
+            self._capacidades = {a["telefono"]: a.get("capacidad", self.capacidad) for a in asesores}
+            self._cargas = {t: self._cargas.get(t, 0) for t in self._capacidades}
+            self._recontar()
+            self._recargas = self.padron.recargas
+
+    def _ajustar(self, telefono: str, delta: int):
+        if telefono not in self._cargas:
+            return
+        antes = self._lleno(telefono)
+        self._cargas[telefono] = max(0, self._cargas[telefono] + delta)
+        self._con_cupo += int(antes) - int(self._lleno(telefono))
+
+    def hay_cupo(self) -> bool:
+        with self._lock:
+            self._sincronizar()
+            return self._con_cupo > 0
+
+    def elegir(self, excluir=(), **contexto) -> dict | None:
+        """Asesor activo con cupo fuera de `excluir` según la estrategia; contexto: area, tipo_auto."""
+        with self._lock:
+            self._sincronizar()
+            if self._con_cupo == 0:
+                return None
+            excluidos = excluir if isinstance(excluir, (set, frozenset)) else set(excluir)
+            if self._con_cupo < len(self._capacidades):
+                excluidos = _Excluidos(excluidos, self._lleno)
+            fuera_de_turno = self.turnos.filtro_fuera_de_turno() if self.turnos is not None else None
+            if fuera_de_turno is not None:
+                excluidos = _Excluidos(excluidos, fuera_de_turno)
+            telefono = None
+            ausente = self.presencia.filtro_ausentes() if self.presencia is not None else None
+            if ausente is not None:
+                telefono = self.estrategia.elegir(_Excluidos(excluidos, ausente), **contexto)
+            if telefono is None:
+                telefono = self.estrategia.elegir(excluidos, **contexto)
+            if telefono is None:
+                return None
+            self.estrategia.abrir(telefono)
+            self._ajustar(telefono, 1)
+            self.elecciones += 1
+        return self.padron.buscar(telefono)
+
+    def elegir_en_ronda(self, consultados: list, **contexto) -> tuple:
+        """`elegir` sin repetir a los ya consultados; agotada la ronda, empieza otra.
+
+        La ronda nueva solo salta al último consultado (no se le pregunta otra vez
+        de inmediato) salvo que sea el único disponible. Devuelve (asesor o None,
+        consultados incluyendo al elegido).
+        """
+        elegido = self.elegir(consultados, **contexto)
+        if elegido is None and consultados:
+            consultados = consultados[-1:]
+            elegido = self.elegir(consultados, **contexto)
+            if elegido is None:
+                consultados = []
+                elegido = self.elegir(consultados, **contexto)
+        if elegido is None:
+            return None, list(consultados)
+        return elegido, list(consultados) + [elegido["telefono"]]
+
+    def liberar(self, telefono: str):
+        with self._lock:
+            self.estrategia.liberar(telefono)
+            self._ajustar(telefono, -1)
+
+    def fijar_cargas(self, cargas: dict):
+        """Reemplaza las cargas en memoria por las contadas en la base (teléfono -> abiertas)."""
+        with self._lock:
+            self._sincronizar()
+            self.estrategia.fijar_cargas(cargas)
+            self._cargas = {t: cargas.get(t, 0) for t in self._capacidades}
+            self._recontar()
+
+
+def cargas_abiertas(col, filtro: dict, campo_telefono: str) -> dict:
+    """Cuenta asignaciones abiertas por asesor con una agregación."""
+    return {doc["_id"]: doc["n"] for doc in col.aggregate([
+        {"$match": filtro},
+        {"$group": {"_id": f"${campo_telefono}", "n": {"$sum": 1}}}
+    ]) if doc["_id"]}
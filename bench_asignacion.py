@@ -0,0 +1,152 @@
+"""Simulación del motor de asignación: equidad y latencia de elección.
+
+Genera --asesores asesores (áreas Ventas/Servicios/Refacciones y tipos nuevo/usado
+repartidos al azar, cada uno con su probabilidad de aceptar) y --leads clientes que
+llegan con su área y tipo de auto. Cada lead pregunta hasta --intentos asesores
+(excluyendo los ya consultados); una aceptación queda abierta un tiempo exponencial.
+
+Compara las estrategias de asignacion.py contra las elecciones anteriores:
+`primero` (primer activo no consultado, como send_to_next_advisor) y `aleatorio`
+(random.choice sobre la lista leída, como server.py/app1.py). Reporta latencia por
+elección (p50/p99), índice de Jain sobre preguntas por asesor, carga abierta máxima
+y qué fracción de leads terminó con un asesor de otra área.
+
+Con --capacidad N cada asesor acepta como máximo N leads abiertos (0 = sin límite).
+
+Uso: python bench_asignacion.py [--asesores 500] [--leads 50000] [--intentos 3] [--semilla 7] [--capacidad 0]
+"""
+import argparse
+import heapq
+import random
+import statistics
+import time
+
+from asignacion import Estrategia, MotorAsignacion, crear_estrategia, AREA_POR_DEFECTO
+
+AREAS = {"Ventas": 0.6, "Servicios": 0.25, "Refacciones": 0.15}
+
+
+class PadronFijo:
+    """Lo mínimo de PadronAsesores que usa el motor, sin MongoDB."""
+
+    def __init__(self, asesores: list):
+        self._lista = tuple(asesores)
+        self._por_telefono = {a["telefono"]: a for a in asesores}
+        self.recargas = 1
+
+    def instantanea(self) -> tuple:
+        return self._lista
+
+    def buscar(self, telefono):
+        return self._por_telefono.get(telefono)
+
+
+class Primero(Estrategia):
+    def sincronizar(self, asesores):
+        self._lista = list(asesores)
+
+    def elegir(self, excluir, **contexto):
+        asesor = next((a for a in self._lista if a["telefono"] not in excluir), None)
+        return asesor["telefono"] if asesor else None
+
+
+class Aleatorio(Estrategia):
+    def sincronizar(self, asesores):
+        self._lista = list(asesores)
+
+    def elegir(self, excluir, **contexto):
+        # Copia la lista en cada elección, como el find() completo de los servidores viejos
+        candidatos = [a for a in list(self._lista) if a["telefono"] not in excluir]
+        return random.choice(candidatos)["telefono"] if candidatos else None
+
+
+def generar_asesores(n: int, rng: random.Random) -> list:
+    asesores = []
+    for i in range(n):
+        area = rng.choices(list(AREAS), weights=list(AREAS.values()))[0]
+        tipos = rng.choice([["nuevo"], ["usado"], ["nuevo", "usado"]])
+        asesores.append({"telefono": f"52166790{i:05d}", "nombre": f"Asesor {i}", "area": area, "tipos": tipos,
+                         "acepta": rng.uniform(0.3, 0.95)})
+    return asesores
+
+
+def simular(asesores: list, estrategia, leads: int, intentos: int, semilla: int, capacidad: int = 0) -> dict:
+    rng = random.Random(semilla)
+    random.seed(semilla)
+    padron = PadronFijo(asesores)
+    motor = MotorAsignacion(padron, estrategia, capacidad=capacidad)
+    preguntas = {a["telefono"]: 0 for a in asesores}
+    abiertas = {a["telefono"]: 0 for a in asesores}
+    cierres = []            # (instante, teléfono)
+    latencias = []
+    carga_maxima = 0
+    otra_area = 0
+    sin_asesor = 0
+    ahora = 0.0
+    for _ in range(leads):
+        ahora += rng.expovariate(1.0)               # un lead por unidad de tiempo en promedio
+        while cierres and cierres[0][0] <= ahora:
+            _, telefono = heapq.heappop(cierres)
+            abiertas[telefono] -= 1
+            motor.liberar(telefono)
+        area = rng.choices(list(AREAS), weights=list(AREAS.values()))[0]
+        tipo = rng.choice(["nuevo", "usado"])
+        consultados = []
+        for _ in range(intentos):
+            inicio = time.perf_counter_ns()
+            asesor = motor.elegir(consultados, area=area, tipo_auto=tipo)
+            latencias.append(time.perf_counter_ns() - inicio)
+            if asesor is None:
+                break
+            telefono = asesor["telefono"]
+            preguntas[telefono] += 1
+            consultados.append(telefono)
+            if rng.random() < asesor["acepta"]:
+                abiertas[telefono] += 1
+                carga_maxima = max(carga_maxima, abiertas[telefono])
+                heapq.heappush(cierres, (ahora + rng.expovariate(1 / 120), telefono))
+                if asesor.get("area", AREA_POR_DEFECTO) != area:
+                    otra_area += 1
+                break
+            motor.liberar(telefono)
+        else:
+            sin_asesor += 1
+    valores = list(preguntas.values())
+    jain = sum(valores) ** 2 / (len(valores) * sum(v * v for v in valores)) if any(valores) else 0.0
+    latencias.sort()
+    return {
+        "p50_us": latencias[len(latencias) // 2] / 1000,
+        "p99_us": latencias[int(len(latencias) * 0.99)] / 1000,
+        "jain": jain,
+        "max_preguntas": max(valores),
+        "desv_preguntas": statistics.pstdev(valores),
+        "carga_maxima": carga_maxima,
+        "otra_area": otra_area / leads,
+        "sin_asesor": sin_asesor,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--asesores", type=int, default=500)
+    parser.add_argument("--leads", type=int, default=50000)
+    parser.add_argument("--intentos", type=int, default=3)
+    parser.add_argument("--semilla", type=int, default=7)
+    parser.add_argument("--capacidad", type=int, default=0)
+    args = parser.parse_args()
+
+    asesores = generar_asesores(args.asesores, random.Random(args.semilla))
+    estrategias = {
+        "primero": Primero,
+        "aleatorio": Aleatorio,
+        "round_robin": lambda: crear_estrategia("round_robin"),
+        "menos_cargado": lambda: crear_estrategia("menos_cargado"),
+        "area": lambda: crear_estrategia("area"),
+    }
+    print(f"{args.asesores} asesores, {args.leads} leads, hasta {args.intentos} intentos por lead")
+    print(f"{'estrategia':<14} {'p50 µs':>8} {'p99 µs':>8} {'Jain':>6} {'máx preg':>9} {'desv':>7} "
+          f"{'carga máx':>9} {'otra área':>9}")
+    for nombre, fabrica in estrategias.items():
+        r = simular(asesores, fabrica(), args.leads, args.intentos, args.semilla, args.capacidad)
+        print(f"{nombre:<14} {r['p50_us']:8.2f} {r['p99_us']:8.2f} {r['jain']:6.3f} {r['max_preguntas']:9d} "
+              f"{r['desv_preguntas']:7.1f} {r['carga_maxima']:9d} {r['otra_area']:9.1%}")
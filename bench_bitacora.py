@@ -0,0 +1,141 @@
+"""Costo de la bitácora en el camino de la petición.
+
+Compara `insert_one` síncrono por evento contra `BitacoraBuffer.registrar`.
+Sin --mongo solo mide el encolado contra un destino que descarta los lotes.
+Con --comparar-almacen compara además la colección `bitacora` original contra la
+serie de tiempo de bitacora_serie: tamaño en disco y una agregación por asesor y día.
+
+Uso: python bench_bitacora.py [--eventos 20000] [--mongo mongodb://localhost:27017/] [--comparar-almacen]
+"""
+from datetime import datetime, timedelta
+import argparse
+import random
+import statistics
+import time
+
+from bitacora import BitacoraBuffer
+
+
+class DestinoNulo:
+    def insert_many(self, docs, ordered=True):
+        pass
+
+
+def evento(i: int) -> dict:
+    return {
+        "event": "asked_availability",
+        "client_id": f"52166700{i % 500:05d}@s.whatsapp.net",
+        "advisor_phone": "5216671234567",
+        "advisor_name": "Ana",
+        "message": "Hola Ana, ¿estás disponible para atender a un cliente ahora?",
+        "assignment_id": f"{i:024x}",
+        "fecha_completa": datetime.utcnow()
+    }
+
+
+def evento_historico(i: int, inicio: datetime) -> dict:
+    """Pregunta de disponibilidad seguida de respuesta o timeout, como en servern3-3."""
+    asesor = f"52166700{i % 40:05d}"
+    pregunta = inicio + timedelta(minutes=i)
+    base = {"client_id": f"52166700{i % 3000:05d}@s.whatsapp.net", "advisor_phone": asesor,
+            "advisor_name": f"Asesor {i % 40}", "assignment_id": f"{i:024x}"}
+    if i % 2 == 0:
+        return {**base, "event": "asked_availability", "ask_time": pregunta, "fecha_completa": pregunta,
+                "message": f"Hola Asesor {i % 40}, ¿estás disponible para atender a un cliente ahora?"}
+    respuesta = pregunta + timedelta(seconds=random.randint(5, 400))
+    if i % 5 == 1:
+        return {**base, "event": "advisor_timeout", "timeout_time": respuesta, "original_ask_time": pregunta,
+                "fecha_completa": respuesta}
+    return {**base, "event": "advisor_availability_response", "response": random.choice(["yes", "no"]),
+            "response_time": respuesta, "original_ask_time": pregunta, "fecha_completa": respuesta}
+
+
+def comparar_almacen(db, eventos: int):
+    from bitacora_serie import ColeccionSerieTiempo, COLECCION_SERIE, COLECCION_TEXTOS, CODIGOS_EVENTO
+
+    for nombre in ("bitacora_documento", COLECCION_SERIE, COLECCION_TEXTOS):
+        db.drop_collection(nombre)
+    documento = db["bitacora_documento"]
+    serie = ColeccionSerieTiempo(db)
+    inicio = datetime(2025, 1, 1)
+    registros = [evento_historico(i, inicio) for i in range(eventos)]
+    for i in range(0, eventos, 1000):
+        lote = registros[i:i + 1000]
+        documento.insert_many([dict(r) for r in lote], ordered=False)
+        serie.insert_many(lote)
+
+    for nombre in ("bitacora_documento", COLECCION_SERIE, COLECCION_TEXTOS):
+        stats = db.command("collStats", nombre)
+        print(f"{nombre:<20} docs={stats.get('count', 0):>8}  datos={stats.get('size', 0) / 1e6:7.2f} MB  "
+              f"disco={stats.get('storageSize', 0) / 1e6:7.2f} MB")
+
+    agregaciones = {
+        "bitacora_documento": [
+            {"$match": {"event": {"$in": ["advisor_availability_response", "advisor_timeout"]}}},
+            {"$group": {
+                "_id": {"a": "$advisor_phone", "dia": {"$dateTrunc": {"date": "$fecha_completa", "unit": "day"}}},
+                "timeouts": {"$sum": {"$cond": [{"$eq": ["$event", "advisor_timeout"]}, 1, 0]}},
+                "respuestas": {"$sum": {"$cond": [{"$eq": ["$event", "advisor_availability_response"]}, 1, 0]}},
+                "latencia_ms": {"$avg": {"$subtract": [{"$ifNull": ["$response_time", "$timeout_time"]}, "$original_ask_time"]}}
+            }}
+        ],
+        COLECCION_SERIE: [
+            {"$match": {"e": {"$in": [CODIGOS_EVENTO["advisor_availability_response"], CODIGOS_EVENTO["advisor_timeout"]]}}},
+            {"$group": {
+                "_id": {"a": "$m.a", "dia": {"$dateTrunc": {"date": "$t", "unit": "day"}}},
+                "timeouts": {"$sum": {"$cond": [{"$eq": ["$e", CODIGOS_EVENTO["advisor_timeout"]]}, 1, 0]}},
+                "respuestas": {"$sum": {"$cond": [{"$eq": ["$e", CODIGOS_EVENTO["advisor_availability_response"]]}, 1, 0]}},
+                "latencia_ms": {"$avg": "$lat"}
+            }}
+        ],
+    }
+    for nombre, pipeline in agregaciones.items():
+        tiempos = []
+        for _ in range(5):
+            t0 = time.perf_counter()
+            grupos = len(list(db[nombre].aggregate(pipeline)))
+            tiempos.append((time.perf_counter() - t0) * 1000)
+        print(f"agregación {nombre:<20} grupos={grupos:>6}  p50={statistics.median(tiempos):8.1f} ms")
+
+    for nombre in ("bitacora_documento", COLECCION_SERIE, COLECCION_TEXTOS):
+        db.drop_collection(nombre)
+
+
+def medir(nombre: str, registrar, eventos: int):
+    tiempos = []
+    for i in range(eventos):
+        registro = evento(i)
+        inicio = time.perf_counter()
+        registrar(registro)
+        tiempos.append((time.perf_counter() - inicio) * 1e6)
+    tiempos.sort()
+    print(f"{nombre:<22} p50={statistics.median(tiempos):9.1f} µs  p99={tiempos[int(len(tiempos) * 0.99) - 1]:9.1f} µs")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--eventos", type=int, default=20000)
+    parser.add_argument("--mongo", default=None)
+    parser.add_argument("--comparar-almacen", action="store_true", help="Requiere --mongo (MongoDB 5.0+)")
+    args = parser.parse_args()
+
+    buffer = BitacoraBuffer(DestinoNulo())
+    buffer.iniciar()
+    medir("buffer (destino nulo)", buffer.registrar, args.eventos)
+    buffer.cerrar()
+
+    if args.mongo:
+        from pymongo import MongoClient
+        col = MongoClient(args.mongo, serverSelectionTimeoutMS=5000)["chatbot_bench"]["bitacora"]
+        col.drop()
+        medir("insert_one síncrono", col.insert_one, args.eventos)
+        col.drop()
+        buffer = BitacoraBuffer(col)
+        buffer.iniciar()
+        medir("buffer (mongo)", buffer.registrar, args.eventos)
+        inicio = time.perf_counter()
+        buffer.cerrar()
+        print(f"vaciado final: {(time.perf_counter() - inicio) * 1000:.1f} ms, escritos={col.count_documents({})}")
+        col.drop()
+        if args.comparar_almacen:
+            comparar_almacen(col.database, args.eventos)
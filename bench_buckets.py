@@ -0,0 +1,63 @@
+"""Compara el layout de historial por documento contra el de buckets.
+
+Mide inserción (mensajes/s), lectura de los últimos mensajes (lecturas/s) y
+tamaño en disco de datos e índices (collStats) de cada layout.
+
+Uso: python bench_buckets.py [--mongo mongodb://localhost:27017/] [--clientes 200] [--mensajes 500]
+"""
+from pymongo import MongoClient
+from datetime import datetime, timedelta
+import argparse
+import time
+
+import historial
+from historial import asegurar_indices_historial, buckets_de, guardar_mensaje_historial, ultimos_mensajes
+
+
+def tamanos(db, nombre: str) -> tuple:
+    stats = db.command("collStats", nombre)
+    return stats.get("size", 0), stats.get("storageSize", 0), stats.get("totalIndexSize", 0)
+
+
+def correr(db, layout: str, clientes: int, mensajes: int, lecturas: int):
+    historial.HISTORIAL_LAYOUT = layout
+    historial_col = db["historial"]
+    historial_col.drop()
+    buckets_de(historial_col).drop()
+    asegurar_indices_historial(historial_col)
+
+    base = datetime.now() - timedelta(days=7)
+    ids = [f"52166700{c:05d}@s.whatsapp.net" for c in range(clientes)]
+    inicio = time.perf_counter()
+    for i in range(mensajes):
+        fecha = base + timedelta(minutes=i)
+        for cliente_id in ids:
+            guardar_mensaje_historial(historial_col, cliente_id, f"mensaje {i} sobre jetta 2019", "user", fecha)
+    segundos_insercion = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    for i in range(lecturas):
+        ultimos_mensajes(historial_col, ids[i % clientes])
+    segundos_lectura = time.perf_counter() - inicio
+
+    nombre = "historial" if layout == "documento" else "historial_buckets"
+    datos, disco, indices = tamanos(db, nombre)
+    total = clientes * mensajes
+    print(f"{layout:<10} inserción={total / segundos_insercion:9.0f} msg/s  "
+          f"lectura={lecturas / segundos_lectura:8.0f} lect/s  "
+          f"datos={datos / 1e6:8.2f} MB  disco={disco / 1e6:8.2f} MB  índices={indices / 1e6:8.2f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--mongo", default="mongodb://localhost:27017/")
+    parser.add_argument("--clientes", type=int, default=200)
+    parser.add_argument("--mensajes", type=int, default=500)
+    parser.add_argument("--lecturas", type=int, default=5000)
+    args = parser.parse_args()
+
+    client = MongoClient(args.mongo, serverSelectionTimeoutMS=5000)
+    for layout in ("documento", "bucket"):
+        db = client[f"chatbot_bench_{layout}"]
+        correr(db, layout, args.clientes, args.mensajes, args.lecturas)
+        client.drop_database(db.name)
@@ -0,0 +1,76 @@
+"""Latencia de lectura del historial para clientes con 1k+ mensajes.
+
+Compara el escaneo completo que hacían los webhooks (`list(find({"cliente_id": ...}))`)
+contra `ultimos_mensajes` y contra la paginación por cursor del dashboard.
+
+Uso: python bench_historial.py [--mongo mongodb://localhost:27017/] [--mensajes 1000 5000] [--clientes 20]
+"""
+from pymongo import MongoClient
+from datetime import datetime, timedelta
+import argparse
+import statistics
+import time
+
+from historial import asegurar_indices_historial, ultimos_mensajes, pagina_historial, MENSAJES_PROMPT
+
+
+def sembrar(col, clientes: int, mensajes: int):
+    col.drop()
+    base = datetime.now() - timedelta(days=30)
+    for c in range(clientes):
+        cliente_id = f"52166700{c:05d}@s.whatsapp.net"
+        docs = [{
+            "cliente_id": cliente_id,
+            "mensaje": f"mensaje {i} sobre jetta nuevo y opciones de crédito",
+            "role": "user" if i % 2 == 0 else "assistant",
+            "fecha": base + timedelta(seconds=i * 30)
+        } for i in range(mensajes)]
+        col.insert_many(docs, ordered=False)
+
+
+def cronometrar(funcion, repeticiones: int) -> list:
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return tiempos
+
+
+def reportar(nombre: str, tiempos: list):
+    tiempos = sorted(tiempos)
+    p95 = tiempos[max(int(len(tiempos) * 0.95) - 1, 0)]
+    print(f"  {nombre:<28} p50={statistics.median(tiempos):8.2f} ms  p95={p95:8.2f} ms")
+
+
+def recorrer_paginas(col, cliente_id: str):
+    cursor = None
+    while True:
+        _, cursor = pagina_historial(col, cliente_id, cursor)
+        if not cursor:
+            break
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--mongo", default="mongodb://localhost:27017/")
+    parser.add_argument("--mensajes", type=int, nargs="+", default=[1000, 5000])
+    parser.add_argument("--clientes", type=int, default=20)
+    parser.add_argument("--repeticiones", type=int, default=50)
+    args = parser.parse_args()
+
+    client = MongoClient(args.mongo, serverSelectionTimeoutMS=5000)
+    col = client["chatbot_bench"]["historial"]
+    cliente_id = "5216670000000@s.whatsapp.net"
+
+    for mensajes in args.mensajes:
+        print(f"\n{args.clientes} clientes x {mensajes} mensajes")
+        sembrar(col, args.clientes, mensajes)
+        reportar("find completo (sin índice)", cronometrar(lambda: list(col.find({"cliente_id": cliente_id})), args.repeticiones))
+        asegurar_indices_historial(col)
+        reportar("find completo (con índice)", cronometrar(lambda: list(col.find({"cliente_id": cliente_id})), args.repeticiones))
+        reportar(f"ultimos_mensajes(n={MENSAJES_PROMPT})", cronometrar(lambda: ultimos_mensajes(col, cliente_id), args.repeticiones))
+        reportar("pagina_historial (1a página)", cronometrar(lambda: pagina_historial(col, cliente_id), args.repeticiones))
+        reportar("recorrer todas las páginas", cronometrar(lambda: recorrer_paginas(col, cliente_id), max(args.repeticiones // 10, 1)))
+
+    col.drop()
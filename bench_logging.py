@@ -0,0 +1,94 @@
+"""Costo por turno del logging en el camino de la petición.
+
+Simula los logs de un turno de servern3-3 (sesión, caché, prompt de ~4 KB, bitácora,
+respuesta) y compara:
+  - f-strings a INFO con FileHandler síncrono (como estaba antes)
+  - log_estructurado a INFO (sesión/prompt/caché quedan en DEBUG y no se formatean)
+  - log_estructurado a DEBUG (todo se escribe, formateado en el hilo del listener)
+
+Uso: python bench_logging.py [--turnos 5000]
+"""
+import argparse
+import logging
+import os
+import statistics
+import tempfile
+import time
+from datetime import datetime
+
+import log_estructurado
+from log_estructurado import configurar_logging, detener_logging, log_evento
+
+logger = logging.getLogger("bench")
+
+SESION = {
+    "cliente_id": "5216671234567@s.whatsapp.net", "nombre": "Ana", "tipo_auto": "nuevo",
+    "modelo": "Jetta", "assigned_advisors": ["5216670000001", "5216670000002"], "ts": datetime.utcnow()
+}
+CACHE = {"_id": "autos_nuevos", "data": [f"Modelo {i}" for i in range(60)], "ts": datetime.utcnow()}
+PROMPT = "Eres Alex, asistente de ventas. " * 130
+REGISTRO = {"event": "asked_availability", "client_id": SESION["cliente_id"], "advisor_phone": "5216670000001"}
+
+
+def turno_fstrings(cliente_id: str):
+    logger.info(f"Sesión recuperada para {cliente_id}: {SESION}")
+    logger.info(f"Cache encontrado para autos_nuevos: {CACHE}")
+    logger.info(f"Enviando prompt a Ollama: {PROMPT}")
+    logger.info(f"Bitácora guardada: {REGISTRO}")
+    logger.info(f"Respuesta del webhook: texto=Hola Ana, botones=[]")
+
+
+def turno_estructurado(cliente_id: str):
+    log_evento(logger, "sesion_recuperada", logging.DEBUG, cliente_id=cliente_id, sesion=SESION)
+    log_evento(logger, "cache_consultado", logging.DEBUG, clave="autos_nuevos", encontrado=True, modelos=len(CACHE["data"]))
+    log_evento(logger, "prompt_ollama", logging.DEBUG, largo=len(PROMPT), mensaje="quiero un jetta")
+    log_evento(logger, "bitacora_encolada", logging.DEBUG, event=REGISTRO["event"])
+    log_evento(logger, "respuesta_webhook", cliente_id=cliente_id, texto="Hola Ana", botones=0)
+
+
+def medir(nombre: str, turno, turnos: int, ruta: str, cerrar):
+    tiempos = []
+    for i in range(turnos):
+        inicio = time.perf_counter()
+        turno(f"52166700{i % 500:05d}@s.whatsapp.net")
+        tiempos.append((time.perf_counter() - inicio) * 1e6)
+    inicio = time.perf_counter()
+    cerrar()
+    vaciado = (time.perf_counter() - inicio) * 1000
+    tiempos.sort()
+    print(f"{nombre:<32} p50={statistics.median(tiempos):8.1f} µs  p99={tiempos[int(len(tiempos) * 0.99) - 1]:8.1f} µs  "
+          f"archivo={os.path.getsize(ruta) / 1e6:6.2f} MB  vaciado={vaciado:6.1f} ms")
+
+
+def configurar_sincrono(ruta: str):
+    raiz = logging.getLogger()
+    for handler in list(raiz.handlers):
+        raiz.removeHandler(handler)
+    handler = logging.FileHandler(ruta, encoding="utf-8")
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    raiz.addHandler(handler)
+    raiz.setLevel(logging.INFO)
+    return handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turnos", type=int, default=5000)
+    args = parser.parse_args()
+    log_estructurado.MUESTREO.clear()
+
+    with tempfile.TemporaryDirectory() as carpeta:
+        ruta = os.path.join(carpeta, "sincrono.log")
+        handler = configurar_sincrono(ruta)
+        medir("f-strings INFO síncrono", turno_fstrings, args.turnos, ruta, handler.close)
+        logging.getLogger().removeHandler(handler)
+
+        for nivel in ("INFO", "DEBUG"):
+            ruta = os.path.join(carpeta, f"estructurado_{nivel}.log")
+            configurar_logging(nivel=nivel, archivo=ruta)
+            medir(f"estructurado {nivel} (cola)", turno_estructurado, args.turnos, ruta, detener_logging)
+
+        log_estructurado.MUESTREO.update({"sesion_recuperada": 0.01, "prompt_ollama": 0.01})
+        ruta = os.path.join(carpeta, "estructurado_muestreo.log")
+        configurar_logging(nivel="DEBUG", archivo=ruta)
+        medir("estructurado DEBUG 1% muestreo", turno_estructurado, args.turnos, ruta, detener_logging)
@@ -0,0 +1,85 @@
+"""Rendimiento del despachador del outbox contra el gateway simulado.
+
+Inserta --mensajes documentos en una colección `sends` de prueba repartidos entre
+--jids destinatarios y mide cuánto tardan 1, 4 y 8 procesos trabajadores (reclamo con
+lease) en entregarlos todos a gateway_mock (HTTP real, latencia y fallos configurables).
+Al final verifica que ningún mensaje llegó dos veces al gateway. Con --coalescer
+duplicados|unir reporta cuántas llamadas al gateway se ahorraron.
+
+Uso: python bench_outbox.py --mongo mongodb://localhost:27017/ [--mensajes 5000] [--jids 500]
+                            [--trabajadores 1,4,8] [--latencia 0.01] [--tasa-fallos 0.0]
+                            [--coalescer no|duplicados|unir]
+"""
+from datetime import datetime, timedelta
+import argparse
+import multiprocessing
+import time
+
+from pymongo import MongoClient
+
+from gateway_mock import iniciar_en_hilo
+from outbox import Despachador, Limitador, TransporteHTTP
+
+
+def sembrar(col, mensajes: int, jids: int):
+    col.drop()
+    ahora = datetime.utcnow()
+    col.insert_many([
+        {"jid": f"52166700{i % jids:05d}@s.whatsapp.net", "message": f"Mensaje {i}", "sent": False,
+         "sent_time": ahora + timedelta(microseconds=i)}
+        for i in range(mensajes)
+    ])
+
+
+def trabajador(mongo: str, url: str, detener, coalescer: str):
+    # Cada proceso abre su propio cliente: MongoClient no sobrevive a un fork
+    col = MongoClient(mongo, serverSelectionTimeoutMS=5000)["chatbot_bench"]["sends"]
+    # Límites altos: se mide el reclamo y la entrega, no la política de envío
+    despachador = Despachador(col, TransporteHTTP(url), Limitador(tasa_global=1e6, tasa_jid=1e6, rafaga_jid=1000),
+                              tam_lote=50, intervalo=0.05, coalescer=coalescer)
+    while not detener.is_set():
+        if despachador.procesar_lote() == 0:
+            time.sleep(0.05)
+
+
+def medir(mongo: str, col, url: str, mensajes: int, n: int, coalescer: str) -> float:
+    contexto = multiprocessing.get_context("spawn")
+    detener = contexto.Event()
+    procesos = [contexto.Process(target=trabajador, args=(mongo, url, detener, coalescer)) for _ in range(n)]
+    inicio = time.perf_counter()
+    for p in procesos:
+        p.start()
+    while col.count_documents({"sent": True}) < mensajes:
+        time.sleep(0.05)
+    segundos = time.perf_counter() - inicio
+    detener.set()
+    for p in procesos:
+        p.join()
+    return segundos
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo", required=True)
+    parser.add_argument("--mensajes", type=int, default=5000)
+    parser.add_argument("--jids", type=int, default=500)
+    parser.add_argument("--trabajadores", default="1,4,8")
+    parser.add_argument("--latencia", type=float, default=0.01)
+    parser.add_argument("--tasa-fallos", type=float, default=0.0)
+    parser.add_argument("--coalescer", choices=["no", "duplicados", "unir"], default="no")
+    args = parser.parse_args()
+
+    col = MongoClient(args.mongo, serverSelectionTimeoutMS=5000)["chatbot_bench"]["sends"]
+    for n in [int(x) for x in args.trabajadores.split(",")]:
+        servidor, estado, url = iniciar_en_hilo(latencia=args.latencia, tasa_fallos=args.tasa_fallos)
+        sembrar(col, args.mensajes, args.jids)
+        segundos = medir(args.mongo, col, url, args.mensajes, n, args.coalescer)
+        resumen = estado.resumen()
+        # Con coalescencia el gateway recibe menos llamadas que mensajes; los absorbidos quedan en coalesced_into
+        absorbidos = col.count_documents({"coalesced_into": {"$exists": True}})
+        duplicados = resumen["recibidos"] + absorbidos - args.mensajes
+        print(f"{n} trabajador(es): {args.mensajes} mensajes en {segundos:.2f} s = {args.mensajes / segundos:7.0f} msg/s  "
+              f"llamadas={resumen['recibidos']}  ahorradas={absorbidos}  duplicados={duplicados}  "
+              f"rechazados={resumen['rechazados']}")
+        servidor.shutdown()
+    col.drop()
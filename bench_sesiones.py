@@ -0,0 +1,61 @@
+"""Compara la latencia por turno (cargar + modificar + guardar) entre backends de sesión.
+
+Uso: python bench_sesiones.py [--clientes 200] [--turnos 20] [--mongo mongodb://localhost:27017/]
+Sin --mongo solo se miden los backends memoria y sqlite.
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from almacen_sesiones import AlmacenMemoria, AlmacenSQLite, AlmacenMongo
+from conversacion import cargar_conversacion, guardar_conversacion
+
+
+def turno(almacen, cliente_id: str, n: int):
+    conversacion = cargar_conversacion(almacen, cliente_id)
+    conversacion.agregar_mensaje("user", f"mensaje {n} del cliente")
+    conversacion.actualizar_estado({"nombre": "Cliente", "tipo_auto": "nuevo", "paso": n})
+    conversacion.actualizar_memoria({
+        "emociones": conversacion.memoria["emociones"] + ["neutral"],
+        "ultima_pregunta": f"mensaje {n} del cliente"
+    })
+    conversacion.agregar_mensaje("assistant", f"respuesta {n} del asistente")
+    guardar_conversacion(almacen, conversacion)
+
+
+def medir(nombre: str, almacen, clientes: int, turnos: int):
+    tiempos = []
+    for n in range(turnos):
+        for c in range(clientes):
+            inicio = time.perf_counter()
+            turno(almacen, f"52166700{c:05d}@s.whatsapp.net", n)
+            tiempos.append((time.perf_counter() - inicio) * 1e6)
+    tiempos.sort()
+    p95 = tiempos[int(len(tiempos) * 0.95) - 1]
+    print(f"{nombre:<8} turnos={len(tiempos):>6}  media={statistics.mean(tiempos):9.1f} µs  "
+          f"p50={statistics.median(tiempos):9.1f} µs  p95={p95:9.1f} µs")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clientes", type=int, default=200)
+    parser.add_argument("--turnos", type=int, default=20)
+    parser.add_argument("--mongo", default=None, help="URI de MongoDB para incluir el backend mongo")
+    args = parser.parse_args()
+
+    medir("memoria", AlmacenMemoria(), args.clientes, args.turnos)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sqlite = AlmacenSQLite(os.path.join(tmp, "bench_sesiones.db"))
+        medir("sqlite", sqlite, args.clientes, args.turnos)
+        sqlite.cerrar()
+
+    if args.mongo:
+        from pymongo import MongoClient
+        client = MongoClient(args.mongo, serverSelectionTimeoutMS=5000)
+        coleccion = client["chatbot_bench"]["conversaciones"]
+        coleccion.drop()
+        medir("mongo", AlmacenMongo(coleccion), args.clientes, args.turnos)
+        coleccion.drop()
@@ -0,0 +1,99 @@
+"""Costo de programar y cancelar timeouts y precisión del disparo.
+
+Mide `Temporizador.programar`/`cancelar` con --pendientes vencimientos simultáneos y,
+si APScheduler está instalado, lo mismo con `add_job`/`remove_job` en un
+AsyncIOScheduler con MemoryJobStore (cota inferior de MongoDBJobStore, que además
+escribe un documento por trabajo). Después dispara --disparos vencimientos
+repartidos en --ventana segundos y reporta el retraso respecto a su fecha.
+
+Uso: python bench_temporizador.py [--pendientes 50000] [--disparos 5000] [--ventana 2.0]
+"""
+from datetime import datetime, timedelta
+import argparse
+import asyncio
+import random
+import time
+
+from temporizador import Temporizador
+
+
+async def nada(*args):
+    pass
+
+
+def medir_temporizador(n: int) -> tuple:
+    temporizador = Temporizador()
+    base = datetime.utcnow() + timedelta(minutes=5)
+    fechas = [base + timedelta(milliseconds=random.randint(0, 60000)) for _ in range(n)]
+    inicio = time.perf_counter()
+    for i, fecha in enumerate(fechas):
+        temporizador.programar(str(i), fecha, nada, i)
+    programar = (time.perf_counter() - inicio) / n * 1e6
+    inicio = time.perf_counter()
+    for i in range(n):
+        temporizador.cancelar(str(i))
+    cancelar = (time.perf_counter() - inicio) / n * 1e6
+    return programar, cancelar
+
+
+async def medir_apscheduler(n: int) -> tuple | None:
+    try:
+        from apscheduler.schedulers.asyncio import AsyncIOScheduler
+    except ImportError:
+        return None
+    scheduler = AsyncIOScheduler()
+    scheduler.start()
+    base = datetime.now() + timedelta(minutes=5)
+    inicio = time.perf_counter()
+    for i in range(n):
+        scheduler.add_job(nada, "date", run_date=base + timedelta(milliseconds=random.randint(0, 60000)),
+                          args=[i], id=f"timeout_{i}")
+    programar = (time.perf_counter() - inicio) / n * 1e6
+    inicio = time.perf_counter()
+    for i in range(n):
+        scheduler.remove_job(f"timeout_{i}")
+    cancelar = (time.perf_counter() - inicio) / n * 1e6
+    scheduler.shutdown(wait=False)
+    return programar, cancelar
+
+
+async def medir_disparo(n: int, ventana: float) -> list:
+    temporizador = Temporizador()
+    temporizador.iniciar()
+    retrasos = []
+    listo = asyncio.Event()
+
+    def registrar(esperado: float):
+        retrasos.append(time.monotonic() - esperado)
+        if len(retrasos) == n:
+            listo.set()
+
+    ahora = datetime.utcnow()
+    base = time.monotonic()
+    for i in range(n):
+        desfase = random.uniform(0.05, ventana)
+        temporizador.programar(str(i), ahora + timedelta(seconds=desfase), registrar, base + desfase)
+    await asyncio.wait_for(listo.wait(), timeout=ventana + 10)
+    temporizador.detener()
+    return sorted(retrasos)
+
+
+async def principal(args):
+    programar, cancelar = medir_temporizador(args.pendientes)
+    print(f"Temporizador: programar {programar:.2f} µs, cancelar {cancelar:.2f} µs ({args.pendientes} pendientes)")
+    aps = await medir_apscheduler(args.pendientes)
+    if aps:
+        print(f"APScheduler (memoria): add_job {aps[0]:.2f} µs, remove_job {aps[1]:.2f} µs")
+    else:
+        print("APScheduler no está instalado; se omite la comparación")
+    retrasos = await medir_disparo(args.disparos, args.ventana)
+    print(f"Disparo de {args.disparos} vencimientos: retraso p50 {retrasos[len(retrasos) // 2] * 1000:.2f} ms, "
+          f"p99 {retrasos[int(len(retrasos) * 0.99)] * 1000:.2f} ms, máx {retrasos[-1] * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pendientes", type=int, default=50000)
+    parser.add_argument("--disparos", type=int, default=5000)
+    parser.add_argument("--ventana", type=float, default=2.0)
+    asyncio.run(principal(parser.parse_args()))
@@ -0,0 +1,223 @@
+from collections import deque
+from datetime import datetime
+from bson.errors import InvalidDocument
+from pymongo.errors import BulkWriteError
+import atexit
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# ------------------ CONFIG ------------------
+TAM_LOTE = int(os.getenv("BITACORA_TAM_LOTE", "200"))
+INTERVALO = float(os.getenv("BITACORA_INTERVALO", "1.0"))          # segundos entre vaciados
+CAPACIDAD = int(os.getenv("BITACORA_CAPACIDAD", "20000"))
+# Qué hacer con la cola llena: descartar_antiguos | descartar_nuevos | bloquear
+POLITICA = os.getenv("BITACORA_POLITICA", "descartar_antiguos")
+ESPERA_BLOQUEO = 0.5                                                # máximo a bloquear por evento
+DUPLICADO = 11000                                                   # código de clave duplicada
+MAX_REINTENTOS = int(os.getenv("BITACORA_MAX_REINTENTOS", "5"))    # por evento, ante errores transitorios
+# writeErrors que se reintentan (primario caído o en cambio, red, apagado); los demás
+# (validación, tipo inválido, ...) fallarían igual siempre y van directo a descartes
+TRANSITORIOS = {6, 7, 89, 91, 189, 262, 9001, 10107, 11600, 11602, 13435, 13436}
+
+
+class BitacoraBuffer:
+    """Cola acotada en memoria con un hilo que escribe la bitácora por lotes.
+
+    `registrar` solo encola (microsegundos); el hilo hace `insert_many(ordered=False)`
+    cuando se junta `tam_lote` eventos o pasa `intervalo`. `cerrar` vacía lo pendiente.
+    Cada `observador` recibe los lotes ya escritos (p. ej. los acumulados de métricas).
+    Los eventos con error permanente, o transitorio más de MAX_REINTENTOS veces, se
+    sacan de la cola y se guardan en `descartes` (si se da) con su error.
+    """
+
+    def __init__(self, coleccion, tam_lote: int = TAM_LOTE, intervalo: float = INTERVALO,
+                 capacidad: int = CAPACIDAD, politica: str = POLITICA, observadores: list | None = None,
+                 descartes=None, max_reintentos: int = MAX_REINTENTOS):
+        if politica not in ("descartar_antiguos", "descartar_nuevos", "bloquear"):
+            raise ValueError(f"Política de desbordamiento desconocida: {politica}")
+        self.coleccion = coleccion
+        self.tam_lote = tam_lote
+        self.intervalo = intervalo
+        self.capacidad = capacidad
+        self.politica = politica
+        self.observadores = list(observadores or [])
+        self.descartes = descartes
+        self.max_reintentos = max_reintentos
+        self._intentos = {}            # id(evento) -> reintentos, solo de los que esperan reintento
+        self._cola = deque()
+        self._cond = threading.Condition()
+        self._detener = False
+        self._hilo = None
+        self._cerrada = False
+        self.escritos = 0
+        self.descartados = 0
+        self.errores = 0
+        self.rechazados = 0
+
+    def iniciar(self):
+        if self._hilo and self._hilo.is_alive():
+            return
+        self._detener = False
+        self._cerrada = False
+        self._hilo = threading.Thread(target=self._ciclo, name="bitacora-flusher", daemon=True)
+        self._hilo.start()
+        atexit.register(self.cerrar)
+
+    def registrar(self, registro: dict):
+        with self._cond:
+            if len(self._cola) >= self.capacidad:
+                if self.politica == "descartar_nuevos":
+                    self.descartados += 1
+                    return
+                if self.politica == "bloquear":
+                    self._cond.notify_all()
+                    self._cond.wait_for(lambda: len(self._cola) < self.capacidad, timeout=ESPERA_BLOQUEO)
+                while len(self._cola) >= self.capacidad:
+                    self._intentos.pop(id(self._cola.popleft()), None)
+                    self.descartados += 1
+            self._cola.append(registro)
+            if len(self._cola) >= self.tam_lote:
+                self._cond.notify_all()
+
+    def pendientes(self) -> int:
+        with self._cond:
+            return len(self._cola)
+
+    def _tomar_lote(self) -> list:
+        with self._cond:
+            n = min(len(self._cola), self.tam_lote)
+            lote = [self._cola.popleft() for _ in range(n)]
+            self._cond.notify_all()
+            return lote
+
+    def _escribir(self, lote: list) -> list:
+        """Escribe el lote y devuelve los eventos que hay que reintentar (vacío si todo quedó)."""
+        rechazados = []
+        try:
+            self.coleccion.insert_many(lote, ordered=False)
+            escritos, pendientes = lote, []
+        except BulkWriteError as e:
+            # Con ordered=False el resto del lote sí se insertó. Un _id duplicado es un
+            # evento que ya estaba escrito (reintento de un lote anterior): cuenta como escrito.
+            errores = {err["index"]: err for err in e.details.get("writeErrors", []) if err.get("code") != DUPLICADO}
+            escritos = [r for i, r in enumerate(lote) if i not in errores]
+            pendientes, transitorio = [], None
+            for i, err in errores.items():
+                registro = lote[i]
+                intentos = self._intentos.get(id(registro), 0) + 1
+                if err.get("code") in TRANSITORIOS and intentos <= self.max_reintentos:
+                    self._intentos[id(registro)] = intentos
+                    pendientes.append(registro)
+                    transitorio = transitorio or err.get("errmsg")
+                else:
+                    rechazados.append((registro, err.get("errmsg")))
+            if pendientes:
+                self.errores += 1
+                logger.error(f"Error transitorio al escribir {len(pendientes)} de {len(lote)} eventos de bitácora, "
+                             f"se reintentan: {transitorio}")
+        except InvalidDocument as e:
+            # Algún evento no se puede serializar y ningún reintento lo arregla: se aísla uno por uno
+            if len(lote) == 1:
+                self._descartar([(lote[0], str(e))])
+                return []
+            return [r for registro in lote for r in self._escribir([registro])]
+        except Exception as e:
+            # No se sabe qué llegó a escribirse. Se reintenta el lote entero con el mismo _id
+            # que pymongo ya le puso: en la colección `bitacora` lo ya insertado vuelve como
+            # duplicado y se cuenta una sola vez. La serie de tiempo no tiene _id único: ahí
+            # solo un corte a mitad de lote (red, primario caído) puede repetir eventos.
+            # Sin tope de reintentos: una caída larga la acota `capacidad`.
+            self.errores += 1
+            logger.error(f"Error al escribir lote de bitácora ({len(lote)} eventos): {e}")
+            return lote
+        for registro in escritos:
+            self._intentos.pop(id(registro), None)
+        if rechazados:
+            self._descartar(rechazados)
+        self.escritos += len(escritos)
+        if escritos:
+            for observador in self.observadores:
+                try:
+                    observador(escritos)
+                except Exception as e:
+                    # El lote ya está escrito: no se reintenta por un fallo del observador
+                    logger.error(f"Error en observador de bitácora {observador!r}: {e}")
+        return pendientes
+
+    def _descartar(self, rechazados: list):
+        """Saca de la cola eventos que no se pueden escribir: un solo log y, si hay, a `descartes`."""
+        for registro, _ in rechazados:
+            self._intentos.pop(id(registro), None)
+        self.rechazados += len(rechazados)
+        logger.error(f"{len(rechazados)} eventos de bitácora descartados por error permanente o reintentos "
+                     f"agotados (evento {rechazados[0][0].get('event')!r}): {rechazados[0][1]}")
+        if self.descartes is None:
+            return
+        ahora = datetime.utcnow()
+        try:
+            self.descartes.insert_many([{"registro": {k: v for k, v in r.items() if k != "_id"},
+                                         "error": str(error), "fecha": ahora} for r, error in rechazados],
+                                       ordered=False)
+        except Exception as e:
+            logger.error(f"No se pudieron guardar {len(rechazados)} eventos descartados de bitácora: {e}")
+
+    def _devolver(self, lote: list):
+        # Reintento en el siguiente ciclo sin rebasar la capacidad
+        with self._cond:
+            espacio = self.capacidad - len(self._cola)
+            if espacio < len(lote):
+                sobran = len(lote) - max(espacio, 0)
+                for registro in lote[:sobran]:
+                    self._intentos.pop(id(registro), None)
+                self.descartados += sobran
+                lote = lote[sobran:]
+            self._cola.extendleft(reversed(lote))
+
+    def _ciclo(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._detener or len(self._cola) >= self.tam_lote, timeout=self.intervalo)
+                if self._detener:
+                    return
+            while True:
+                lote = self._tomar_lote()
+                if not lote:
+                    break
+                pendientes = self._escribir(lote)
+                if pendientes:
+                    self._devolver(pendientes)
+                    time.sleep(self.intervalo)
+                    break
+                if len(lote) < self.tam_lote:
+                    break
+
+    def vaciar(self):
+        """Escribe todo lo pendiente en el hilo que llama."""
+        while True:
+            lote = self._tomar_lote()
+            if not lote:
+                return
+            pendientes = self._escribir(lote)
+            if pendientes:
+                for registro in pendientes:
+                    self._intentos.pop(id(registro), None)
+                self.descartados += len(pendientes)
+                return
+
+    def cerrar(self, timeout: float = 5.0):
+        with self._cond:
+            if self._cerrada:
+                return
+            self._cerrada = True
+            self._detener = True
+            self._cond.notify_all()
+        if self._hilo and self._hilo.is_alive():
+            self._hilo.join(timeout)
+        self.vaciar()
+        if self.descartados or self.rechazados:
+            logger.warning(f"Bitácora cerrada con {self.descartados} eventos descartados y "
+                           f"{self.rechazados} rechazados por la base")
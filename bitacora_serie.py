@@ -0,0 +1,217 @@
+"""Bitácora en una colección de series de tiempo de MongoDB con esquema fijo.
+
+Cada evento se guarda como:
+  {"t": fecha, "m": {"c": cliente, "a": teléfono asesor}, "e": código,
+   "g": assignment_id, "r": aceptó, "lat": ms desde la pregunta, "n": conteo,
+   "err": error, "h"/"hc"/"hs": hash del texto, "x": campos no previstos}
+
+Los nombres de evento pasan a códigos enteros, los campos `time`/`ask_time`/
+`response_time`/... se unifican en `t`, el nombre del asesor se obtiene de
+`asesores` por su teléfono y los textos largos (mensaje al asesor, resumen del
+cliente, sesión) se guardan una sola vez en `bitacora_textos` y se referencian por hash.
+
+`ColeccionSerieTiempo` expone `insert_many`, así que BitacoraBuffer la usa como
+si fuera la colección y `guardar_bitacora` no cambia.
+
+Uso: python bitacora_serie.py --migrar [--mongo URI] [--db chatbot_db] [--lote 1000]
+"""
+from pymongo import MongoClient, ASCENDING, UpdateOne
+from pymongo.errors import CollectionInvalid
+from collections import OrderedDict
+from bson import ObjectId, json_util
+from datetime import datetime
+import argparse
+import hashlib
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# ------------------ CONFIG ------------------
+# BITACORA_ALMACEN: serie (colección de series de tiempo) | documento (colección `bitacora` original)
+ALMACEN = os.getenv("BITACORA_ALMACEN", "serie")
+COLECCION_SERIE = "bitacora_ts"
+COLECCION_TEXTOS = "bitacora_textos"
+RETENCION_DIAS = int(os.getenv("BITACORA_RETENCION_DIAS", "0"))    # 0 = sin expiración
+HASHES_EN_CACHE = 10000
+LARGO_ERROR = 500
+
+# Los códigos son permanentes: no reutilizar ni renumerar
+CODIGOS_EVENTO = {
+    "asked_availability": 1,
+    "advisor_availability_response": 2,
+    "advisor_timeout": 3,
+    "client_info_sent": 4,
+    "client_assigned": 5,
+    "no_advisors_available": 6,
+    "incomplete_session": 7,
+    "cleanup_stale_assignments": 8,
+    "timeout_check_failed": 9,
+    "advisor_response_failed": 10,
+    "lead_queued": 11,
+    "lead_dispatched": 12,
+    "lead_completed": 13,
+    "error_assigning_advisor": 20,
+    "error_timeout_check": 21,
+    "error_advisor_response": 22,
+    "error_cleanup_assignments": 23,
+}
+EVENTOS_POR_CODIGO = {codigo: evento for evento, codigo in CODIGOS_EVENTO.items()}
+CAMPOS_TIEMPO = ("time", "ask_time", "response_time", "sent_time", "assignment_time", "timeout_time")
+CAMPOS_TEXTO = {"message": "h", "client_info": "hc", "session": "hs"}
+
+
+def hash_texto(valor) -> str:
+    crudo = valor if isinstance(valor, str) else json_util.dumps(valor, sort_keys=True)
+    return hashlib.blake2b(crudo.encode(), digest_size=12).hexdigest()
+
+
+def compactar(registro: dict, textos: dict) -> dict:
+    """Convierte un registro de `guardar_bitacora` al esquema fijo; los textos van a `textos`."""
+    r = dict(registro)
+    r.pop("_id", None)
+    r.pop("advisor_name", None)
+    evento = r.pop("event", None)
+    tiempos = [r.pop(c) for c in CAMPOS_TIEMPO if c in r]
+    fecha = r.pop("fecha_completa", None)
+    t = next((v for v in tiempos if isinstance(v, datetime)), None) or fecha or datetime.utcnow()
+
+    doc = {"t": t, "m": {"c": r.pop("client_id", None), "a": r.pop("advisor_phone", None)},
+           "e": CODIGOS_EVENTO.get(evento, 0)}
+    asignacion = r.pop("assignment_id", None)
+    if asignacion is not None:
+        doc["g"] = ObjectId(asignacion) if ObjectId.is_valid(str(asignacion)) else str(asignacion)
+    original = r.pop("original_ask_time", None)
+    if isinstance(original, datetime):
+        doc["lat"] = int((t - original).total_seconds() * 1000)
+    if "response" in r:
+        doc["r"] = str(r.pop("response")).lower() == "yes"
+    if "count" in r:
+        doc["n"] = r.pop("count")
+    if "error" in r:
+        doc["err"] = str(r.pop("error"))[:LARGO_ERROR]
+    for campo, clave in CAMPOS_TEXTO.items():
+        if r.get(campo) is not None:
+            valor = r.pop(campo)
+            h = hash_texto(valor)
+            textos[h] = valor
+            doc[clave] = h
+    if doc["e"] == 0 and evento:
+        r["event"] = evento
+    if r:
+        doc["x"] = r
+    return doc
+
+
+def expandir(doc: dict, textos_col=None) -> dict:
+    """Registro legible (nombres de evento y campos originales) a partir del esquema fijo."""
+    registro = {
+        "event": EVENTOS_POR_CODIGO.get(doc["e"], (doc.get("x") or {}).get("event")),
+        "client_id": doc["m"].get("c"),
+        "advisor_phone": doc["m"].get("a"),
+        "time": doc["t"],
+    }
+    for clave, campo in (("g", "assignment_id"), ("n", "count"), ("err", "error"), ("lat", "latencia_ms")):
+        if clave in doc:
+            registro[campo] = str(doc[clave]) if clave == "g" else doc[clave]
+    if "r" in doc:
+        registro["response"] = "yes" if doc["r"] else "no"
+    for campo, clave in CAMPOS_TEXTO.items():
+        if clave in doc:
+            texto = textos_col.find_one({"_id": doc[clave]}) if textos_col is not None else None
+            registro[campo] = texto["v"] if texto else doc[clave]
+    registro.update({k: v for k, v in (doc.get("x") or {}).items() if k != "event"})
+    return registro
+
+
+# ------------------ COLECCIÓN ------------------
+def asegurar_coleccion_serie(db):
+    opciones = {"timeseries": {"timeField": "t", "metaField": "m", "granularity": "minutes"}}
+    if RETENCION_DIAS:
+        opciones["expireAfterSeconds"] = RETENCION_DIAS * 86400
+    try:
+        db.create_collection(COLECCION_SERIE, **opciones)
+        logger.info(f"Colección de series de tiempo '{COLECCION_SERIE}' creada")
+    except CollectionInvalid:
+        pass  # ya existe
+    except Exception as e:
+        # MongoDB < 5.0: se crea como colección normal en la primera inserción
+        logger.error(f"No se pudo crear '{COLECCION_SERIE}' como serie de tiempo: {str(e)}")
+    try:
+        db[COLECCION_SERIE].create_index([("m.a", ASCENDING), ("t", ASCENDING)], name="asesor_t")
+        db[COLECCION_SERIE].create_index([("m.c", ASCENDING), ("t", ASCENDING)], name="cliente_t")
+    except Exception as e:
+        logger.error(f"Error al crear índices de {COLECCION_SERIE}: {str(e)}")
+    return db[COLECCION_SERIE]
+
+
+class ColeccionSerieTiempo:
+    """Destino de BitacoraBuffer: compacta cada lote y lo inserta en la serie de tiempo."""
+
+    def __init__(self, db):
+        self.coleccion = asegurar_coleccion_serie(db)
+        self.textos = db[COLECCION_TEXTOS]
+        self._hashes = OrderedDict()     # textos ya guardados, para no repetir el upsert
+
+    def _guardar_textos(self, textos: dict, ahora: datetime):
+        nuevos = [h for h in textos if h not in self._hashes]
+        if nuevos:
+            self.textos.bulk_write(
+                [UpdateOne({"_id": h}, {"$setOnInsert": {"v": textos[h], "primera": ahora}}, upsert=True) for h in nuevos],
+                ordered=False
+            )
+        for h in textos:
+            self._hashes[h] = True
+            self._hashes.move_to_end(h)
+        while len(self._hashes) > HASHES_EN_CACHE:
+            self._hashes.popitem(last=False)
+
+    def insert_many(self, registros: list, ordered: bool = False):
+        textos = {}
+        docs = [compactar(r, textos) for r in registros]
+        # Los textos primero, para que toda referencia en la serie sea resoluble
+        if textos:
+            self._guardar_textos(textos, datetime.utcnow())
+        return self.coleccion.insert_many(docs, ordered=ordered)
+
+
+def coleccion_bitacora(db, almacen: str | None = None):
+    """Colección que recibe los lotes de BitacoraBuffer según BITACORA_ALMACEN."""
+    if (almacen or ALMACEN) == "documento":
+        return db["bitacora"]
+    return ColeccionSerieTiempo(db)
+
+
+# ------------------ MIGRACIÓN ------------------
+def migrar(db, lote: int = 1000) -> int:
+    """Copia la colección `bitacora` original a la serie de tiempo (no borra el origen)."""
+    destino = ColeccionSerieTiempo(db)
+    total = 0
+    pendientes = []
+    for registro in db["bitacora"].find({}).batch_size(lote):
+        pendientes.append(registro)
+        if len(pendientes) >= lote:
+            destino.insert_many(pendientes)
+            total += len(pendientes)
+            pendientes = []
+    if pendientes:
+        destino.insert_many(pendientes)
+        total += len(pendientes)
+    return total
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--migrar", action="store_true")
+    parser.add_argument("--mongo", default="mongodb://localhost:27017/")
+    parser.add_argument("--db", default="chatbot_db")
+    parser.add_argument("--lote", type=int, default=1000)
+    args = parser.parse_args()
+
+    if args.migrar:
+        client = MongoClient(args.mongo, serverSelectionTimeoutMS=5000)
+        inicio = time.perf_counter()
+        n = migrar(client[args.db], args.lote)
+        logger.info(f"Eventos migrados a {COLECCION_SERIE}: {n} en {time.perf_counter() - inicio:.1f} s")
@@ -0,0 +1,85 @@
+"""Botones de disponibilidad del asesor con el id de la asignación firmado.
+
+Los botones llevaban `yes_{client_id}` / `no_{client_id}` y la respuesta se
+buscaba por (cliente, asesor, estado): sin índice que la cubra y ambigua cuando
+el mismo cliente pasó por varias asignaciones con el mismo asesor. Ahora el
+buttonId lleva la acción y el `_id` de la asignación, firmados:
+
+    yes.<ObjectId en base64url, 16>.<HMAC-SHA256 truncado a 8 bytes, 11>
+
+(32 caracteres; WhatsApp admite 256). Con el id la respuesta se resuelve con un
+find_one_and_update por `_id`; la firma impide que alguien responda por una
+asignación ajena cambiando el id a mano.
+
+El secreto sale de BOTONES_SECRETO o, si no está definido, se crea una vez en
+`config` ({"_id": "botones"}) para que todos los workers y reinicios lo compartan.
+"""
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from bson import ObjectId
+import hashlib
+import hmac
+import logging
+import os
+import re
+import secrets
+
+logger = logging.getLogger(__name__)
+
+# ------------------ CONFIG ------------------
+ACCIONES = ("yes", "no")
+BYTES_FIRMA = 8
+LEGADO = re.compile(r"^(yes|no)_(.+)$")
+
+
+def cargar_secreto(db) -> bytes:
+    secreto = os.getenv("BOTONES_SECRETO")
+    if secreto:
+        return secreto.encode()
+    db["config"].update_one({"_id": "botones"}, {"$setOnInsert": {"secreto": secrets.token_hex(32)}}, upsert=True)
+    return db["config"].find_one({"_id": "botones"})["secreto"].encode()
+
+
+def _b64(datos: bytes) -> str:
+    return urlsafe_b64encode(datos).rstrip(b"=").decode()
+
+
+def _desde_b64(texto: str) -> bytes:
+    return urlsafe_b64decode(texto + "=" * (-len(texto) % 4))
+
+
+def _firma(secreto: bytes, accion: str, id_bytes: bytes) -> bytes:
+    return hmac.new(secreto, accion.encode() + b"." + id_bytes, hashlib.sha256).digest()[:BYTES_FIRMA]
+
+
+def boton_id(secreto: bytes, accion: str, assignment_id) -> str:
+    id_bytes = ObjectId(assignment_id).binary
+    return f"{accion}.{_b64(id_bytes)}.{_b64(_firma(secreto, accion, id_bytes))}"
+
+
+def leer_boton(secreto: bytes, button_id: str) -> tuple | None:
+    """(acción, ObjectId) si el buttonId es válido y está bien firmado; None si no."""
+    try:
+        accion, id_texto, firma_texto = button_id.split(".")
+        id_bytes = _desde_b64(id_texto)
+        firma = _desde_b64(firma_texto)
+    except ValueError:
+        return None
+    if accion not in ACCIONES or len(id_bytes) != 12:
+        return None
+    if not hmac.compare_digest(firma, _firma(secreto, accion, id_bytes)):
+        logger.warning(f"Botón con firma inválida: {button_id}")
+        return None
+    return accion, ObjectId(id_bytes)
+
+
+def leer_legado(button_id: str) -> tuple | None:
+    """(acción, cliente_id) de los botones `yes_{cliente}` enviados antes del cambio."""
+    coincide = LEGADO.match(button_id)
+    return (coincide.group(1), coincide.group(2)) if coincide else None
+
+
+def botones_disponibilidad(secreto: bytes, assignment_id, si: str = "Sí", no: str = "No") -> list:
+    return [
+        {"buttonId": boton_id(secreto, "yes", assignment_id), "buttonText": {"displayText": si}, "type": 1},
+        {"buttonId": boton_id(secreto, "no", assignment_id), "buttonText": {"displayText": no}, "type": 1},
+    ]
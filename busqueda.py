@@ -0,0 +1,190 @@
+"""Índice invertido de conversaciones para que los asesores busquen leads ("hilux 2019", "crédito").
+
+Cada mensaje indexado guarda sus términos normalizados (minúsculas, sin acentos vía unidecode,
+sin palabras vacías) en un arreglo con índice multikey, que es el índice invertido en MongoDB.
+Se alimenta de forma incremental desde guardar_mensaje; `--reindexar` lo reconstruye desde historial.
+
+Uso: python busqueda.py --reindexar [--mongo URI] [--db chatbotdb]
+"""
+from pymongo import MongoClient, ASCENDING, DESCENDING
+from pymongo.errors import DuplicateKeyError
+from collections import deque
+from datetime import datetime
+from unidecode import unidecode
+import argparse
+import logging
+import re
+import threading
+import time
+
+from historial import codificar_cursor, decodificar_cursor
+
+logger = logging.getLogger(__name__)
+
+RESULTADOS_POR_PAGINA = 20
+RESULTADOS_MAXIMOS = 100
+LARGO_EXTRACTO = 200
+
+PALABRAS_VACIAS = {
+    "a", "al", "de", "del", "el", "la", "las", "lo", "los", "un", "una", "unos", "unas", "y", "o", "u",
+    "en", "con", "por", "para", "que", "me", "mi", "te", "tu", "se", "es", "su", "ya", "si", "no"
+}
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def normalizar_terminos(texto: str) -> list:
+    """Términos únicos, en minúsculas y sin acentos, en el orden en que aparecen."""
+    vistos = []
+    for termino in _TOKEN.findall(unidecode(texto or "").lower()):
+        if len(termino) < 2 or termino in PALABRAS_VACIAS or termino in vistos:
+            continue
+        vistos.append(termino)
+    return vistos
+
+
+def indice_de(historial_col):
+    return historial_col.database["indice_busqueda"]
+
+
+def asegurar_indices_busqueda(indice_col):
+    """Índices que cubren el orden (fecha, _id) de la paginación por cursor."""
+    try:
+        indice_col.create_index([("terminos", ASCENDING), ("fecha", DESCENDING), ("_id", DESCENDING)],
+                                name="terminos_fecha_id")
+        indice_col.create_index([("cliente_id", ASCENDING), ("fecha", DESCENDING), ("_id", DESCENDING)],
+                                name="cliente_fecha_id")
+    except Exception as e:
+        logger.error(f"Error al crear índices de búsqueda: {str(e)}")
+        return
+    # Los de la versión con skip() ya no sirven para el orden por (fecha, _id)
+    for anterior in ("terminos_fecha", "cliente_fecha"):
+        try:
+            indice_col.drop_index(anterior)
+        except Exception:
+            pass
+
+
+def indexar_mensaje(indice_col, mensaje_id, cliente_id: str, mensaje: str, role: str, fecha: datetime):
+    terminos = normalizar_terminos(mensaje)
+    if not terminos:
+        return
+    try:
+        indice_col.insert_one({
+            "_id": mensaje_id,
+            "cliente_id": cliente_id,
+            "role": role,
+            "fecha": fecha,
+            "terminos": terminos,
+            "extracto": mensaje[:LARGO_EXTRACTO]
+        })
+    except DuplicateKeyError:
+        pass
+    except Exception as e:
+        logger.error(f"Error al indexar mensaje de {cliente_id}: {str(e)}")
+
+
+# ------------------ MÉTRICAS ------------------
+class MetricasBusqueda:
+    def __init__(self, ventana: int = 1000):
+        self._lock = threading.Lock()
+        self._latencias = deque(maxlen=ventana)
+        self.consultas = 0
+
+    def registrar(self, ms: float):
+        with self._lock:
+            self.consultas += 1
+            self._latencias.append(ms)
+
+    def resumen(self) -> dict:
+        with self._lock:
+            latencias = sorted(self._latencias)
+            consultas = self.consultas
+        if not latencias:
+            return {"consultas": consultas, "p50_ms": None, "p95_ms": None, "max_ms": None}
+        return {
+            "consultas": consultas,
+            "p50_ms": round(latencias[len(latencias) // 2], 2),
+            "p95_ms": round(latencias[max(int(len(latencias) * 0.95) - 1, 0)], 2),
+            "max_ms": round(latencias[-1], 2)
+        }
+
+
+metricas = MetricasBusqueda()
+
+
+def buscar(indice_col, consulta: str, cursor: str | None = None, por_pagina: int = RESULTADOS_POR_PAGINA,
+           cliente_id: str | None = None) -> dict:
+    """Mensajes que contienen todos los términos de la consulta, del más reciente al más antiguo.
+
+    Paginación por llave (fecha, _id) como en historial.pagina_historial: `siguiente` es el
+    cursor de la página que sigue (None en la última). ValueError si el cursor no es válido.
+    """
+    inicio = time.perf_counter()
+    terminos = normalizar_terminos(consulta)
+    resultados = []
+    siguiente = None
+    if terminos:
+        filtro = {"terminos": {"$all": terminos}}
+        if cliente_id:
+            filtro["cliente_id"] = cliente_id
+        if cursor:
+            fecha, doc_id = decodificar_cursor(cursor)
+            filtro["$or"] = [
+                {"fecha": {"$lt": fecha}},
+                {"fecha": fecha, "_id": {"$lt": doc_id}}
+            ]
+        docs = list(
+            indice_col.find(filtro, {"terminos": 0})
+            .sort([("fecha", DESCENDING), ("_id", DESCENDING)])
+            .limit(por_pagina + 1)
+        )
+        if len(docs) > por_pagina:
+            docs = docs[:por_pagina]
+            siguiente = codificar_cursor(docs[-1]["fecha"], docs[-1]["_id"])
+        resultados = [
+            {"mensaje_id": str(d["_id"]), "cliente_id": d["cliente_id"], "role": d.get("role"),
+             "fecha": d["fecha"], "extracto": d.get("extracto", "")}
+            for d in docs
+        ]
+    ms = (time.perf_counter() - inicio) * 1000
+    metricas.registrar(ms)
+    logger.debug(f"Búsqueda '{consulta}' términos={terminos} cursor={cursor}: {len(resultados)} resultados en {ms:.1f} ms")
+    return {"terminos": terminos, "resultados": resultados, "siguiente": siguiente, "tiempo_ms": round(ms, 2)}
+
+
+# ------------------ REINDEXADO ------------------
+def reindexar(historial_col, lote: int = 1000) -> int:
+    indice_col = indice_de(historial_col)
+    asegurar_indices_busqueda(indice_col)
+    total = 0
+    for doc in historial_col.find({}, {"cliente_id": 1, "mensaje": 1, "role": 1, "fecha": 1}).batch_size(lote):
+        indexar_mensaje(indice_col, doc["_id"], doc["cliente_id"], doc.get("mensaje", ""), doc.get("role"), doc["fecha"])
+        total += 1
+    buckets = historial_col.database["historial_buckets"]
+    for bucket in buckets.find({}, {"cliente_id": 1, "mensajes": 1}).batch_size(100):
+        for m in bucket.get("mensajes", []):
+            indexar_mensaje(indice_col, m["_id"], bucket["cliente_id"], m.get("mensaje", ""), m.get("role"), m["fecha"])
+            total += 1
+    return total
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reindexar", action="store_true")
+    parser.add_argument("--buscar", default=None, help="Ejecuta una consulta y muestra los resultados")
+    parser.add_argument("--mongo", default="mongodb://localhost:27017/")
+    parser.add_argument("--db", default="chatbotdb")
+    args = parser.parse_args()
+
+    client = MongoClient(args.mongo, serverSelectionTimeoutMS=5000)
+    historial_col = client[args.db]["historial"]
+    if args.reindexar:
+        inicio = time.perf_counter()
+        n = reindexar(historial_col)
+        logger.info(f"Mensajes reindexados: {n} en {time.perf_counter() - inicio:.1f} s")
+    if args.buscar:
+        res = buscar(indice_de(historial_col), args.buscar)
+        for r in res["resultados"]:
+            print(f"{r['fecha']:%Y-%m-%d %H:%M} {r['cliente_id']}: {r['extracto']}")
+        print(f"{len(res['resultados'])} resultados en {res['tiempo_ms']} ms")
@@ -0,0 +1,101 @@
+"""Cola persistente de leads sin asesor, con prioridad por espera y valor del lead.
+
+Cuando ningún asesor tiene cupo el lead ya no se descarta: queda en `cola_leads`
+hasta que se libera capacidad (aceptación completada, rechazo o timeout).
+
+Prioridad: gana la menor `prioridad = encolado - valor * BONO_POR_VALOR`. Como la
+espera crece igual para todos, esa clave no cambia con el tiempo y basta con un
+montículo en memoria (O(log n) al encolar y al tomar); un lead "nuevo" (valor 2)
+cuenta como si llevara 2 * BONO más esperando que uno "usado" (valor 1).
+
+Documento: {"_id": cliente_id, "encolado", "prioridad", "tipo_auto", "area"}.
+El documento solo se borra cuando el lead se despacha, así que al reiniciar
+`cargar` reconstruye el montículo desde la colección.
+"""
+from datetime import datetime, timedelta
+from pymongo import ASCENDING, ReturnDocument
+import heapq
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# ------------------ CONFIG ------------------
+COLECCION_COLA = "cola_leads"
+VALOR_LEAD = {"nuevo": 2, "usado": 1}
+BONO_POR_VALOR = timedelta(minutes=float(os.getenv("COLA_BONO_MINUTOS", "10")))
+
+
+def prioridad(encolado: datetime, tipo_auto: str | None) -> datetime:
+    return encolado - BONO_POR_VALOR * VALOR_LEAD.get(tipo_auto, 0)
+
+
+class ColaLeads:
+    def __init__(self, db):
+        self.col = db[COLECCION_COLA]
+        self._heap = []                # (prioridad, cliente_id)
+        self._vigentes = {}            # cliente_id -> prioridad de su entrada válida
+        try:
+            self.col.create_index([("prioridad", ASCENDING)], name="prioridad")
+        except Exception as e:
+            logger.error(f"Error al crear índices de {COLECCION_COLA}: {str(e)}")
+        self.cargar()
+
+    def cargar(self):
+        self._vigentes = {doc["_id"]: doc["prioridad"] for doc in self.col.find({}, {"prioridad": 1})}
+        self._heap = [(p, cliente_id) for cliente_id, p in self._vigentes.items()]
+        heapq.heapify(self._heap)
+        if self._heap:
+            logger.info(f"Cola de leads recuperada: {len(self._heap)} en espera")
+
+    def __len__(self) -> int:
+        return len(self._vigentes)
+
+    def __contains__(self, cliente_id) -> bool:
+        return cliente_id in self._vigentes
+
+    def encolar(self, cliente_id: str, tipo_auto: str | None = None, area: str | None = None) -> bool:
+        """Agrega el lead si no estaba; un lead ya en cola conserva su hora original."""
+        ahora = datetime.utcnow()
+        previo = self.col.find_one_and_update(
+            {"_id": cliente_id},
+            {"$setOnInsert": {"encolado": ahora, "prioridad": prioridad(ahora, tipo_auto),
+                              "tipo_auto": tipo_auto, "area": area}},
+            projection={"prioridad": 1}, upsert=True, return_document=ReturnDocument.BEFORE
+        )
+        if cliente_id not in self._vigentes:
+            p = previo["prioridad"] if previo else prioridad(ahora, tipo_auto)
+            self._vigentes[cliente_id] = p
+            heapq.heappush(self._heap, (p, cliente_id))
+        return previo is None
+
+    def tomar(self) -> dict | None:
+        """Saca de memoria el lead de mayor prioridad; sigue en MongoDB hasta `quitar`."""
+        while self._heap:
+            p, cliente_id = heapq.heappop(self._heap)
+            if self._vigentes.get(cliente_id) == p:
+                del self._vigentes[cliente_id]
+                return {"cliente_id": cliente_id, "prioridad": p}
+        return None
+
+    def devolver(self, lead: dict):
+        """Regresa a la cola un lead tomado que no se pudo despachar."""
+        if lead["cliente_id"] not in self._vigentes:
+            self._vigentes[lead["cliente_id"]] = lead["prioridad"]
+            heapq.heappush(self._heap, (lead["prioridad"], lead["cliente_id"]))
+
+    def quitar(self, cliente_id: str) -> dict | None:
+        """Borra el lead (despachado o cancelado); devuelve su documento para medir la espera."""
+        self._vigentes.pop(cliente_id, None)      # la entrada del montículo se descarta al salir
+        if len(self._heap) > 2 * len(self._vigentes) + 1024:
+            self._heap = [(p, c) for c, p in self._vigentes.items()]
+            heapq.heapify(self._heap)
+        return self.col.find_one_and_delete({"_id": cliente_id})
+
+    def resumen(self) -> dict:
+        primero = self.col.find_one({}, {"encolado": 1}, sort=[("encolado", ASCENDING)])
+        return {
+            "en_cola": len(self),
+            "espera_max_s": round((datetime.utcnow() - primero["encolado"]).total_seconds()) if primero else 0,
+            "por_tipo": {t: self.col.count_documents({"tipo_auto": t}) for t in VALOR_LEAD},
+        }
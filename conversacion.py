@@ -0,0 +1,141 @@
+from datetime import datetime
+import copy
+import logging
+
+from resumen import resumen_vacio, incorporar_turno, incorporar_emocion, refrescar_contexto, resumen_para_prompt
+
+logger = logging.getLogger(__name__)
+
+# ------------------ LÍMITES DEL DOCUMENTO ------------------
+MAX_RECIENTES = 20          # últimos turnos guardados en el anillo
+MAX_EMOCIONES = 10
+MAX_MODELOS_FAVORITOS = 10
+
+MEMORIA_INICIAL = {
+    "modelos_favoritos": [],
+    "tipo_auto_preferido": None,
+    "emociones": [],
+    "ultima_pregunta": "",
+    "tipo_vehiculo": None
+}
+
+LIMITES_MEMORIA = {
+    "emociones": MAX_EMOCIONES,
+    "modelos_favoritos": MAX_MODELOS_FAVORITOS
+}
+
+
+class Conversacion:
+    """Documento único por cliente con estado, memoria acotada, los últimos turnos y su resumen.
+
+    Los cambios se acumulan en memoria y se escriben juntos con `guardar_conversacion`.
+    """
+
+    def __init__(self, cliente_id: str, doc: dict | None = None):
+        doc = doc or {}
+        self.cliente_id = cliente_id
+        self.estado = dict(doc.get("estado") or {})
+        self.memoria = {**copy.deepcopy(MEMORIA_INICIAL), **(doc.get("memoria") or {})}
+        self.recientes = list(doc.get("recientes") or [])
+        self._cambios = {}
+        self._nuevos = []
+        self._reiniciada = False
+        self.resumen = {**resumen_vacio(), **(doc.get("resumen") or {})}
+        self._resumen_pendiente = False
+        if "resumen" not in doc and self.recientes:
+            # Documentos anteriores al resumen: se siembra una vez con el anillo
+            for turno in self.recientes:
+                incorporar_turno(self.resumen, turno["role"], turno["mensaje"])
+            self._resumen_pendiente = True
+
+    def actualizar_estado(self, nuevo_estado: dict):
+        self.estado.update(nuevo_estado)
+        for k, v in nuevo_estado.items():
+            self._cambios[f"estado.{k}"] = v
+        self._resumen_pendiente = True
+
+    def actualizar_memoria(self, nuevo_dato: dict):
+        for k, v in nuevo_dato.items():
+            if k in LIMITES_MEMORIA and isinstance(v, list):
+                v = v[-LIMITES_MEMORIA[k]:]
+            self.memoria[k] = v
+            self._cambios[f"memoria.{k}"] = v
+        self._resumen_pendiente = True
+
+    def agregar_mensaje(self, role: str, mensaje: str, fecha: datetime | None = None):
+        turno = {"role": role, "mensaje": mensaje, "fecha": fecha or datetime.now()}
+        self.recientes.append(turno)
+        del self.recientes[:-MAX_RECIENTES]
+        self._nuevos.append(turno)
+        incorporar_turno(self.resumen, role, mensaje)
+        self._resumen_pendiente = True
+
+    def registrar_emocion(self, emocion: str):
+        incorporar_emocion(self.resumen, emocion)
+        self._resumen_pendiente = True
+
+    def reiniciar(self):
+        self.estado.clear()
+        self.memoria = copy.deepcopy(MEMORIA_INICIAL)
+        self.recientes = []
+        self.resumen = resumen_vacio()
+        self._cambios = {}
+        self._nuevos = []
+        self._reiniciada = True
+
+    def tiene_cambios(self) -> bool:
+        return bool(self._cambios or self._nuevos or self._reiniciada or self._resumen_pendiente)
+
+    def _cerrar_resumen(self):
+        if self._resumen_pendiente:
+            refrescar_contexto(self.resumen, self.estado, self.memoria)
+            self._cambios["resumen"] = self.resumen
+
+    def texto_resumen(self) -> str:
+        self._cerrar_resumen()
+        return resumen_para_prompt(self.resumen)
+
+    def a_documento(self) -> dict:
+        self._cerrar_resumen()
+        return {
+            "_id": self.cliente_id,
+            "estado": self.estado,
+            "memoria": self.memoria,
+            "recientes": self.recientes,
+            "resumen": self.resumen,
+            "ts": datetime.now()
+        }
+
+    def operacion_guardado(self) -> dict:
+        """Construye el update de Mongo que persiste los cambios pendientes."""
+        self._cerrar_resumen()
+        update = {"$set": {**self._cambios, "ts": datetime.now()}}
+        if self._nuevos:
+            update["$push"] = {"recientes": {"$each": self._nuevos, "$slice": -MAX_RECIENTES}}
+        return update
+
+    def marcar_guardada(self):
+        self._cambios = {}
+        self._nuevos = []
+        self._reiniciada = False
+        self._resumen_pendiente = False
+
+
+def cargar_conversacion(almacen, cliente_id: str) -> Conversacion:
+    """Carga la conversación desde un `AlmacenSesiones` (ver almacen_sesiones.py)."""
+    try:
+        doc = almacen.cargar(cliente_id)
+    except Exception as e:
+        logger.error(f"Error al cargar conversación para {cliente_id}: {str(e)}")
+        doc = None
+    return Conversacion(cliente_id, doc)
+
+
+def guardar_conversacion(almacen, conversacion: Conversacion):
+    if not conversacion.tiene_cambios():
+        return
+    try:
+        almacen.guardar(conversacion)
+        conversacion.marcar_guardada()
+    except Exception as e:
+        logger.error(f"Error al guardar conversación para {conversacion.cliente_id}: {str(e)}")
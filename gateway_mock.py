@@ -0,0 +1,92 @@
+"""Gateway de WhatsApp simulado para pruebas de rendimiento del outbox.
+
+Acepta POST /send con {"jid", "message", "buttons"?} como el gateway real, espera una
+latencia configurable y falla una fracción de las peticiones con HTTP 503.
+GET /stats devuelve cuántos mensajes recibió (total y por jid).
+
+Uso: python gateway_mock.py [--puerto 3000] [--latencia 0.05] [--tasa-fallos 0.0]
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import Counter
+import argparse
+import json
+import random
+import threading
+import time
+
+
+class EstadoGateway:
+    def __init__(self, latencia: float = 0.0, tasa_fallos: float = 0.0):
+        self.latencia = latencia
+        self.tasa_fallos = tasa_fallos
+        self.recibidos = 0
+        self.rechazados = 0
+        self.por_jid = Counter()
+        self.lock = threading.Lock()
+
+    def resumen(self) -> dict:
+        with self.lock:
+            return {"recibidos": self.recibidos, "rechazados": self.rechazados,
+                    "jids": len(self.por_jid), "max_por_jid": max(self.por_jid.values(), default=0)}
+
+
+def crear_servidor(puerto: int, estado: EstadoGateway) -> ThreadingHTTPServer:
+    class Manejador(BaseHTTPRequestHandler):
+        def _responder(self, codigo: int, cuerpo: dict):
+            datos = json.dumps(cuerpo).encode()
+            self.send_response(codigo)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(datos)))
+            self.end_headers()
+            self.wfile.write(datos)
+
+        def do_POST(self):
+            if self.path != "/send":
+                return self._responder(404, {"error": "ruta desconocida"})
+            cuerpo = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if not cuerpo.get("jid"):
+                return self._responder(400, {"error": "jid requerido"})
+            if estado.latencia:
+                time.sleep(estado.latencia)
+            if estado.tasa_fallos and random.random() < estado.tasa_fallos:
+                with estado.lock:
+                    estado.rechazados += 1
+                return self._responder(503, {"error": "fallo simulado"})
+            with estado.lock:
+                estado.recibidos += 1
+                estado.por_jid[cuerpo["jid"]] += 1
+            self._responder(200, {"status": "ok"})
+
+        def do_GET(self):
+            if self.path == "/stats":
+                return self._responder(200, estado.resumen())
+            self._responder(404, {"error": "ruta desconocida"})
+
+        def log_message(self, *args):
+            pass
+
+    return ThreadingHTTPServer(("127.0.0.1", puerto), Manejador)
+
+
+def iniciar_en_hilo(puerto: int = 0, latencia: float = 0.0, tasa_fallos: float = 0.0):
+    """Arranca el gateway en segundo plano; devuelve (servidor, estado, url de envío)."""
+    estado = EstadoGateway(latencia, tasa_fallos)
+    servidor = crear_servidor(puerto, estado)
+    threading.Thread(target=servidor.serve_forever, name="gateway-mock", daemon=True).start()
+    return servidor, estado, f"http://127.0.0.1:{servidor.server_address[1]}/send"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--puerto", type=int, default=3000)
+    parser.add_argument("--latencia", type=float, default=0.05)
+    parser.add_argument("--tasa-fallos", type=float, default=0.0)
+    args = parser.parse_args()
+
+    estado = EstadoGateway(args.latencia, args.tasa_fallos)
+    servidor = crear_servidor(args.puerto, estado)
+    print(f"Gateway simulado en http://127.0.0.1:{args.puerto}/send")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        print(json.dumps(estado.resumen()))
@@ -0,0 +1,175 @@
+from datetime import datetime
+from pymongo import ASCENDING, DESCENDING
+from bson import ObjectId
+import base64
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Mensajes que necesitan los prompts (resumir_historial_emociones usa los últimos 5)
+MENSAJES_PROMPT = 5
+PAGINA_DASHBOARD = 50
+PAGINA_MAXIMA = 200
+
+# Layout de escritura: "documento" (un doc por mensaje) o "bucket" (un doc por cliente/día/N mensajes).
+# Los lectores de este módulo entienden ambos, así que se puede cambiar sin migrar primero.
+HISTORIAL_LAYOUT = os.getenv("CHATBOT_HISTORIAL_LAYOUT", "documento")
+MENSAJES_POR_BUCKET = int(os.getenv("CHATBOT_MENSAJES_POR_BUCKET", "200"))
+VERIFICAR_BUCKETS = 60.0    # segundos entre revisiones de si hay buckets, con layout "documento"
+
+CAMPOS_MENSAJE = ("role", "mensaje", "fecha")
+
+
+def buckets_de(historial_col):
+    return historial_col.database["historial_buckets"]
+
+
+_hay_buckets = {}           # colección de buckets -> (hay documentos, cuándo se revisó)
+
+
+def usa_buckets(historial_col) -> bool:
+    """Si los lectores deben consultar historial_buckets además de la colección por mensaje.
+
+    Con layout "bucket" siempre. Con "documento" solo si quedan buckets (p. ej. se volvió
+    al layout anterior); se revisa con el conteo estimado, como mucho cada VERIFICAR_BUCKETS.
+    """
+    if HISTORIAL_LAYOUT == "bucket":
+        return True
+    buckets = buckets_de(historial_col)
+    clave = buckets.full_name
+    ahora = time.monotonic()
+    hay, revisado = _hay_buckets.get(clave, (False, None))
+    if revisado is None or ahora - revisado >= VERIFICAR_BUCKETS:
+        try:
+            hay = buckets.estimated_document_count() > 0
+        except Exception as e:
+            logger.error(f"Error al revisar historial_buckets: {str(e)}")
+        _hay_buckets[clave] = (hay, ahora)
+    return hay
+
+
+def asegurar_indices_historial(historial_col):
+    """Índice compuesto para leer la conversación de un cliente por fecha sin escanear la colección."""
+    try:
+        historial_col.create_index(
+            [("cliente_id", ASCENDING), ("fecha", DESCENDING), ("_id", DESCENDING)],
+            name="cliente_fecha"
+        )
+        buckets = buckets_de(historial_col)
+        buckets.create_index([("cliente_id", ASCENDING), ("dia", ASCENDING), ("n", ASCENDING)], name="cliente_dia_n")
+        buckets.create_index([("cliente_id", ASCENDING), ("fin", DESCENDING)], name="cliente_fin")
+    except Exception as e:
+        logger.error(f"Error al crear índice de historial: {str(e)}")
+
+
+# ------------------ ESCRITURA ------------------
+def guardar_mensaje_historial(historial_col, cliente_id: str, mensaje: str, role: str, fecha: datetime | None = None):
+    """Guarda el mensaje en el layout configurado y devuelve su _id."""
+    fecha = fecha or datetime.now()
+    if HISTORIAL_LAYOUT == "bucket":
+        mensaje_id = ObjectId()
+        buckets_de(historial_col).update_one(
+            {"cliente_id": cliente_id, "dia": fecha.strftime("%Y-%m-%d"), "n": {"$lt": MENSAJES_POR_BUCKET}},
+            {
+                "$push": {"mensajes": {"_id": mensaje_id, "role": role, "mensaje": mensaje, "fecha": fecha}},
+                "$inc": {"n": 1},
+                "$min": {"inicio": fecha},
+                "$max": {"fin": fecha}
+            },
+            upsert=True
+        )
+        return mensaje_id
+    return historial_col.insert_one({"cliente_id": cliente_id, "mensaje": mensaje, "role": role, "fecha": fecha}).inserted_id
+
+
+# ------------------ LECTURA ------------------
+def _clave(m: dict) -> tuple:
+    return (m["fecha"], m["_id"])
+
+
+def _mensajes_en_buckets(historial_col, cliente_id: str, n: int, antes: tuple | None = None) -> list:
+    """Hasta `n` mensajes en buckets, del más reciente al más antiguo, anteriores a `antes`."""
+    if not usa_buckets(historial_col):
+        return []
+    filtro = {"cliente_id": cliente_id}
+    if antes:
+        filtro["inicio"] = {"$lte": antes[0]}
+        proyeccion = {"mensajes": 1}
+    else:
+        # Sin cursor basta con la cola de cada bucket: no se trae el arreglo completo
+        proyeccion = {"mensajes": {"$slice": -n}, "fin": 1}
+    resultado = []
+    for bucket in buckets_de(historial_col).find(filtro, proyeccion).sort("fin", DESCENDING):
+        for m in reversed(bucket.get("mensajes", [])):
+            if antes and _clave(m) >= antes:
+                continue
+            resultado.append(m)
+        if len(resultado) >= n:
+            break
+    resultado.sort(key=_clave, reverse=True)
+    return resultado[:n]
+
+
+def ultimos_mensajes(historial_col, cliente_id: str, n: int = MENSAJES_PROMPT) -> list:
+    """Últimos `n` mensajes del cliente en orden cronológico, solo con los campos del prompt."""
+    try:
+        docs = list(
+            historial_col.find({"cliente_id": cliente_id}, {"role": 1, "mensaje": 1, "fecha": 1})
+            .sort("fecha", DESCENDING)
+            .limit(n)
+        )
+        docs += _mensajes_en_buckets(historial_col, cliente_id, n)
+        docs.sort(key=_clave, reverse=True)
+        docs = docs[:n]
+        docs.reverse()
+        return [{k: d[k] for k in CAMPOS_MENSAJE} for d in docs]
+    except Exception as e:
+        logger.error(f"Error al leer historial de {cliente_id}: {str(e)}")
+        return []
+
+
+# ------------------ PAGINACIÓN POR CURSOR ------------------
+def codificar_cursor(fecha: datetime, doc_id) -> str:
+    crudo = f"{fecha.isoformat()}|{doc_id}"
+    return base64.urlsafe_b64encode(crudo.encode()).decode()
+
+
+def decodificar_cursor(cursor: str) -> tuple:
+    """(fecha, ObjectId) del cursor; ValueError si no es uno emitido por codificar_cursor."""
+    try:
+        fecha, doc_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        return datetime.fromisoformat(fecha), ObjectId(doc_id)
+    except Exception as e:
+        raise ValueError(f"Cursor inválido: {cursor}") from e
+
+
+def pagina_historial(historial_col, cliente_id: str, cursor: str | None = None, limite: int = PAGINA_DASHBOARD) -> tuple:
+    """Página de mensajes del más reciente al más antiguo.
+
+    Devuelve (mensajes, siguiente_cursor); el cursor es None en la última página.
+    Usa paginación por llave (fecha, _id), así que el costo no crece con el número de página.
+    """
+    filtro = {"cliente_id": cliente_id}
+    antes = None
+    if cursor:
+        fecha, doc_id = decodificar_cursor(cursor)
+        antes = (fecha, doc_id)
+        filtro["$or"] = [
+            {"fecha": {"$lt": fecha}},
+            {"fecha": fecha, "_id": {"$lt": doc_id}}
+        ]
+    docs = list(
+        historial_col.find(filtro, {"role": 1, "mensaje": 1, "fecha": 1})
+        .sort([("fecha", DESCENDING), ("_id", DESCENDING)])
+        .limit(limite + 1)
+    )
+    docs += _mensajes_en_buckets(historial_col, cliente_id, limite + 1, antes)
+    docs.sort(key=_clave, reverse=True)
+    siguiente = None
+    if len(docs) > limite:
+        docs = docs[:limite]
+        siguiente = codificar_cursor(docs[-1]["fecha"], docs[-1]["_id"])
+    mensajes = [{k: d[k] for k in CAMPOS_MENSAJE} for d in docs]
+    return mensajes, siguiente
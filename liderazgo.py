@@ -0,0 +1,239 @@
+"""Elección de líder con arrendamiento en MongoDB para los trabajos únicos.
+
+Con `uvicorn --workers N` cada proceso arranca su scheduler y su hilo de
+reasignación, así que el refresco de la caché de autos, la reasignación de
+pendientes y el despacho de la cola corrían N veces. Un documento por rol en
+`lideres` decide quién los ejecuta:
+
+    {"_id": rol, "lider": "host:pid:xxxxxx", "vence": fecha UTC, "epoca": n}
+
+- `intentar` toma el rol con un find_one_and_update condicionado a "vencido o
+  mío" y upsert; si otro proceso lo tiene vigente, el upsert choca con el `_id`
+  (DuplicateKeyError) y este proceso sigue como seguidor.
+- El líder renueva cada DURACION/3. Si no logra renovar (MongoDB caído) deja de
+  considerarse líder cuando vence su arrendamiento medido con reloj monotónico
+  local, antes de que otro pueda tomarlo: nunca hay dos líderes a la vez mientras
+  el desfase entre relojes sea mucho menor que DURACION.
+- `epoca` sube con cada cambio de dueño; sirve para saber que el estado en
+  memoria de un seguidor que acaba de ganar está viejo.
+- Si el líder muere, otro toma el rol en a lo sumo DURACION + DURACION/3; con
+  `renunciar` (apagado ordenado) basta con el siguiente intento.
+
+Los trabajos que deben correr en un solo proceso se envuelven con `solo_lider`;
+los que mantienen estado del propio proceso (cargas del motor) no.
+
+Demostración con varios procesos locales (requiere MongoDB):
+
+Uso: python liderazgo.py [--procesos 3] [--duracion 3] [--segundos 20] [--mongo URI] [--db chatbot_db]
+"""
+from datetime import datetime, timedelta
+from pymongo import MongoClient, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+import argparse
+import atexit
+import functools
+import inspect
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# ------------------ CONFIG ------------------
+COLECCION_LIDERES = "lideres"
+ROL = os.getenv("LIDER_ROL", "scheduler")
+DURACION = float(os.getenv("LIDER_DURACION", "15"))        # segundos de arrendamiento
+VENCIDO = datetime(1970, 1, 1)
+
+
+class Liderazgo:
+    def __init__(self, db, rol: str = ROL, duracion: float = DURACION, identidad: str | None = None):
+        self.col = db[COLECCION_LIDERES]
+        self.rol = rol
+        self.duracion = duracion
+        self.identidad = identidad or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.epoca = None
+        self.cambios = 0
+        self._vence_local = 0.0             # reloj monotónico; hasta aquí este proceso se sabe líder
+        self._anunciado = False
+        self._al_ganar = []
+        self._al_perder = []
+        self._detener = threading.Event()
+        self._hilo = None
+
+    @property
+    def es_lider(self) -> bool:
+        return time.monotonic() < self._vence_local
+
+    def al_ganar(self, funcion):
+        self._al_ganar.append(funcion)
+        return funcion
+
+    def al_perder(self, funcion):
+        self._al_perder.append(funcion)
+        return funcion
+
+    def intentar(self) -> bool:
+        """Toma o renueva el rol; devuelve si este proceso es el líder."""
+        inicio = time.monotonic()               # antes de la consulta: el arrendamiento local nunca dura de más
+        ahora = datetime.utcnow()
+        vence = ahora + timedelta(seconds=self.duracion)
+        try:
+            if self.es_lider:
+                doc = self.col.find_one_and_update(
+                    {"_id": self.rol, "lider": self.identidad, "epoca": self.epoca},
+                    {"$set": {"vence": vence, "renovado": ahora}},
+                    return_document=ReturnDocument.AFTER
+                )
+            else:
+                doc = self.col.find_one_and_update(
+                    {"_id": self.rol, "$or": [{"vence": {"$lt": ahora}}, {"lider": self.identidad}]},
+                    {"$set": {"lider": self.identidad, "vence": vence, "renovado": ahora, "desde": ahora},
+                     "$inc": {"epoca": 1}},
+                    upsert=True, return_document=ReturnDocument.AFTER
+                )
+        except DuplicateKeyError:
+            doc = None
+        except Exception as e:
+            # Sin MongoDB se conserva el rol solo hasta que venza el arrendamiento local
+            logger.error(f"Error al renovar el liderazgo de {self.rol}: {str(e)}")
+            self._revisar()
+            return self.es_lider
+        if doc:
+            self.epoca = doc["epoca"]
+            self._vence_local = inicio + self.duracion
+        else:
+            self._vence_local = 0.0
+        self._revisar()
+        return doc is not None
+
+    def _revisar(self):
+        actual = self.es_lider
+        if actual == self._anunciado:
+            return
+        self._anunciado = actual
+        self.cambios += 1
+        if actual:
+            logger.info(f"{self.identidad} es líder de {self.rol} (época {self.epoca})")
+        else:
+            logger.warning(f"{self.identidad} dejó de ser líder de {self.rol}")
+        for funcion in self._al_ganar if actual else self._al_perder:
+            try:
+                funcion()
+            except Exception as e:
+                logger.error(f"Error en el aviso de cambio de líder: {str(e)}")
+
+    def _ciclo(self):
+        while not self._detener.wait(self.duracion / 3):
+            self.intentar()
+
+    def iniciar(self):
+        """Primer intento en el acto (el arranque ya sabe si es líder) y renovación en un hilo."""
+        if self._hilo and self._hilo.is_alive():
+            return
+        self._detener.clear()
+        self.intentar()
+        self._hilo = threading.Thread(target=self._ciclo, name=f"lider-{self.rol}", daemon=True)
+        self._hilo.start()
+        atexit.register(self.renunciar)
+
+    def renunciar(self):
+        """Suelta el rol para que otro proceso lo tome sin esperar el vencimiento."""
+        self._detener.set()
+        if not self.es_lider:
+            return
+        self._vence_local = 0.0
+        try:
+            self.col.update_one({"_id": self.rol, "lider": self.identidad}, {"$set": {"vence": VENCIDO}})
+        except Exception as e:
+            logger.error(f"Error al renunciar al liderazgo de {self.rol}: {str(e)}")
+        self._revisar()
+
+    def estado(self) -> dict:
+        doc = self.col.find_one({"_id": self.rol}) or {}
+        return {"rol": self.rol, "identidad": self.identidad, "es_lider": self.es_lider,
+                "lider": doc.get("lider"), "epoca": doc.get("epoca"), "vence": doc.get("vence")}
+
+    def solo_lider(self, funcion):
+        """Envuelve un trabajo periódico para que solo se ejecute en el líder."""
+        if inspect.iscoroutinefunction(funcion):
+            @functools.wraps(funcion)
+            async def envoltura(*args, **kwargs):
+                if self.es_lider:
+                    return await funcion(*args, **kwargs)
+        else:
+            @functools.wraps(funcion)
+            def envoltura(*args, **kwargs):
+                if self.es_lider:
+                    return funcion(*args, **kwargs)
+        return envoltura
+
+
+# ------------------ DEMOSTRACIÓN ------------------
+def _proceso_demo(mongo: str, nombre_db: str, rol: str, duracion: float, segundos: float):
+    logging.basicConfig(level=logging.INFO, format=f'%(asctime)s - {os.getpid()} - %(message)s')
+    db = MongoClient(mongo, serverSelectionTimeoutMS=5000)[nombre_db]
+    lider = Liderazgo(db, rol=rol, duracion=duracion)
+    lider.iniciar()
+    trabajos = db[f"{COLECCION_LIDERES}_demo"]
+    fin = time.monotonic() + segundos
+    while time.monotonic() < fin:
+        # El "trabajo único": cada ejecución queda registrada con su época
+        if lider.es_lider:
+            trabajos.insert_one({"rol": rol, "identidad": lider.identidad, "epoca": lider.epoca, "t": time.time()})
+        time.sleep(0.2)
+    lider.renunciar()
+
+
+def demostrar(mongo: str, nombre_db: str, procesos: int, duracion: float, segundos: float):
+    db = MongoClient(mongo, serverSelectionTimeoutMS=5000)[nombre_db]
+    rol = f"demo-{uuid.uuid4().hex[:6]}"
+    trabajos = db[f"{COLECCION_LIDERES}_demo"]
+    trabajos.delete_many({})
+    hijos = [multiprocessing.Process(target=_proceso_demo, args=(mongo, nombre_db, rol, duracion, segundos))
+             for _ in range(procesos)]
+    for hijo in hijos:
+        hijo.start()
+    # A un tercio del tiempo se mata al líder sin que pueda renunciar (simula una caída)
+    time.sleep(segundos / 3)
+    doc = db[COLECCION_LIDERES].find_one({"_id": rol}) or {}
+    pid = int(doc["lider"].split(":")[1]) if doc.get("lider") else None
+    for hijo in hijos:
+        if hijo.pid == pid:
+            hijo.kill()
+            print(f"Líder {doc['lider']} (época {doc['epoca']}) terminado con SIGKILL")
+    for hijo in hijos:
+        hijo.join()
+
+    ejecuciones = list(trabajos.find({"rol": rol}).sort("t", 1))
+    duenos = {}
+    solapados = 0
+    for previa, actual in zip(ejecuciones, ejecuciones[1:]):
+        # Un trabajo de una época vieja después de uno de la nueva: dos líderes a la vez
+        if actual["epoca"] < previa["epoca"]:
+            solapados += 1
+    for e in ejecuciones:
+        duenos.setdefault(e["epoca"], set()).add(e["identidad"])
+    print(f"{len(ejecuciones)} ejecuciones, épocas {sorted(duenos)}, "
+          f"{sum(len(v) > 1 for v in duenos.values())} épocas con más de un dueño, {solapados} solapamientos")
+    for previa, actual in zip(ejecuciones, ejecuciones[1:]):
+        if actual["epoca"] != previa["epoca"]:
+            print(f"Cambio de época {previa['epoca']} -> {actual['epoca']}: "
+                  f"{actual['t'] - previa['t']:.2f} s sin líder (arrendamiento {duracion} s)")
+    db[COLECCION_LIDERES].delete_one({"_id": rol})
+    trabajos.delete_many({"rol": rol})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--procesos", type=int, default=3)
+    parser.add_argument("--duracion", type=float, default=3.0)
+    parser.add_argument("--segundos", type=float, default=20.0)
+    parser.add_argument("--mongo", default="mongodb://localhost:27017/")
+    parser.add_argument("--db", default="chatbot_db")
+    args = parser.parse_args()
+    demostrar(args.mongo, args.db, args.procesos, args.duracion, args.segundos)
@@ -0,0 +1,229 @@
+"""Logging estructurado en JSON, con formato perezoso y muestreo por evento.
+
+El hilo de la petición solo arma el LogRecord y lo pone en una cola (QueueHandler);
+un QueueListener en segundo plano lo serializa, redacta/trunca los campos (y enmascara
+teléfonos y correos en los mensajes de texto libre) y lo escribe en un archivo rotativo.
+Así un prompt de 4 KB o una sesión completa no cuestan nada si el nivel está
+deshabilitado o el evento no sale en el muestreo.
+
+Configuración por entorno:
+  CHATBOT_LOG_LEVEL      nivel mínimo (INFO)
+  CHATBOT_LOG_FILE       archivo de salida; vacío = stderr
+  CHATBOT_LOG_MAX_BYTES  tamaño antes de rotar (10 MB)
+  CHATBOT_LOG_BACKUPS    archivos rotados que se conservan (5)
+  CHATBOT_LOG_MUESTREO   tasas por evento, p. ej. "sesion_recuperada=0.1,prompt_ollama=0.01"
+"""
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from datetime import datetime
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import re
+
+LARGO_MAXIMO = int(os.getenv("CHATBOT_LOG_LARGO_MAXIMO", "200"))   # caracteres por campo de texto
+LARGO_MAXIMO_MENSAJE = 2000                                           # mensajes de texto libre (logger.info(f"..."))
+MAX_ELEMENTOS = 20                                                    # elementos por lista/dict anidado
+PROFUNDIDAD_MAXIMA = 3
+CAMPOS_SECRETOS = {"password", "token", "api_key", "authorization", "secret"}
+CAMPOS_TELEFONO = {"telefono", "advisor_phone", "phone", "jid", "advisor_jid", "asignados", "assigned_advisors",
+                   "cliente_id", "client_id"}           # el id del cliente es su jid de WhatsApp
+# Texto libre del cliente o estructuras que lo contienen: se enmascaran números largos y
+# correos en todo su contenido, también en lo anidado
+CAMPOS_TEXTO_LIBRE = {"texto", "mensaje", "message", "respuesta", "prompt", "sesion", "session"}
+_DIGITOS = re.compile(r"\d{6,}")
+# Los jid de WhatsApp (…@s.whatsapp.net, …@g.us) no son correos: conservan los últimos 4 dígitos
+_CORREO = re.compile(r"[\w.+-]+@(?!s\.whatsapp\.net\b|g\.us\b)[\w-]+(\.[\w-]+)+")
+_INMUTABLES = (str, int, float, bool, type(None), datetime)
+
+
+def _tasas_desde_entorno() -> dict:
+    tasas = {}
+    for par in filter(None, os.getenv("CHATBOT_LOG_MUESTREO", "").split(",")):
+        nombre, _, tasa = par.partition("=")
+        try:
+            tasas[nombre.strip()] = float(tasa)
+        except ValueError:
+            pass
+    return tasas
+
+
+MUESTREO = _tasas_desde_entorno()
+
+
+# ------------------ REDACCIÓN ------------------
+def _enmascarar_telefono(valor: str) -> str:
+    return _DIGITOS.sub(lambda m: "*" * (len(m.group()) - 4) + m.group()[-4:], valor)
+
+
+def _enmascarar_texto(valor: str) -> str:
+    return _enmascarar_telefono(_CORREO.sub("[correo]", valor))
+
+
+def _truncar(texto: str, largo: int) -> str:
+    if len(texto) > largo:
+        return f"{texto[:largo]}… (+{len(texto) - largo} caracteres)"
+    return texto
+
+
+def sanear(valor, clave: str = "", profundidad: int = 0, texto_libre: bool = False):
+    """Copia acotada del valor: secretos ocultos, teléfonos enmascarados, textos truncados.
+
+    `texto_libre` se hereda a lo anidado bajo un campo de CAMPOS_TEXTO_LIBRE.
+    """
+    clave = clave.lower()
+    if clave in CAMPOS_SECRETOS:
+        return "[oculto]"
+    texto_libre = texto_libre or clave in CAMPOS_TEXTO_LIBRE
+    if isinstance(valor, Perezoso):
+        valor = valor()
+    if valor is None or isinstance(valor, (bool, int, float)):
+        return valor
+    if isinstance(valor, datetime):
+        return valor.isoformat()
+    if isinstance(valor, dict):
+        if profundidad >= PROFUNDIDAD_MAXIMA:
+            return f"{{{len(valor)} campos}}"
+        items = list(valor.items())
+        salida = {str(k): sanear(v, str(k), profundidad + 1, texto_libre) for k, v in items[:MAX_ELEMENTOS]}
+        if len(items) > MAX_ELEMENTOS:
+            salida["…"] = f"+{len(items) - MAX_ELEMENTOS} campos"
+        return salida
+    if isinstance(valor, (list, tuple, set)):
+        if profundidad >= PROFUNDIDAD_MAXIMA:
+            return f"[{len(valor)} elementos]"
+        items = list(valor)
+        salida = [sanear(v, clave, profundidad + 1, texto_libre) for v in items[:MAX_ELEMENTOS]]
+        if len(items) > MAX_ELEMENTOS:
+            salida.append(f"… +{len(items) - MAX_ELEMENTOS} elementos")
+        return salida
+    texto = str(valor)
+    if texto_libre:
+        texto = _enmascarar_texto(texto)
+    elif clave in CAMPOS_TELEFONO:
+        texto = _enmascarar_telefono(texto)
+    return _truncar(texto, LARGO_MAXIMO)
+
+
+class Perezoso:
+    """Valor que solo se calcula al serializar el registro, en el hilo del listener."""
+    __slots__ = ("funcion", "args")
+
+    def __init__(self, funcion, *args):
+        self.funcion = funcion
+        self.args = args
+
+    def __call__(self):
+        try:
+            return self.funcion(*self.args)
+        except Exception as e:
+            return f"<error al calcular: {e}>"
+
+
+# ------------------ FORMATO ------------------
+class FormateadorJSON(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        doc = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "nivel": record.levelname,
+            "logger": record.name,
+        }
+        campos = getattr(record, "campos", None)
+        if campos is not None:
+            doc["evento"] = record.msg
+            doc.update(sanear(campos))
+        else:
+            # logger.info(f"... {client_id} ...") sigue siendo texto libre: mismo enmascarado
+            doc["mensaje"] = _truncar(_enmascarar_texto(record.getMessage()), LARGO_MAXIMO_MENSAJE)
+        if record.exc_text:
+            doc["excepcion"] = record.exc_text
+        return json.dumps(doc, ensure_ascii=False, default=str)
+
+
+class _ColaHandler(QueueHandler):
+    # QueueHandler.prepare formatea en el hilo que llama; aquí solo se copian los
+    # campos de primer nivel para que cambios posteriores del llamador no se filtren.
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        campos = getattr(record, "campos", None)
+        if campos:
+            record.campos = {k: (dict(v) if isinstance(v, dict) else list(v) if isinstance(v, list) else v)
+                             for k, v in campos.items()}
+        elif record.args:
+            # logger.info("%s", sesion): con argumentos mutables el mensaje se arma ya,
+            # si no el listener formatearía el objeto tal como esté cuando lo saque de la cola
+            # Un único dict como argumento queda como record.args: es el objeto del llamador
+            if isinstance(record.args, dict) or not all(isinstance(a, _INMUTABLES) for a in record.args):
+                record.msg = record.getMessage()
+                record.args = None
+        if record.exc_info:
+            # Se resuelve aquí para no retener los frames del llamador mientras espera en la cola
+            record.exc_text = _formato_excepcion.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+_formato_excepcion = logging.Formatter()
+_listener = None
+
+
+def configurar_logging(nivel: str | None = None, archivo: str | None = None,
+                       max_bytes: int | None = None, respaldos: int | None = None) -> QueueListener:
+    """Sustituye a logging.basicConfig: raíz -> cola -> listener -> archivo rotativo (o stderr).
+
+    `archivo` es el valor por defecto de cada script; CHATBOT_LOG_FILE lo sustituye.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+    nivel = (nivel or os.getenv("CHATBOT_LOG_LEVEL", "INFO")).upper()
+    archivo = os.getenv("CHATBOT_LOG_FILE", archivo or "")
+    if archivo:
+        destino = RotatingFileHandler(
+            archivo, encoding="utf-8",
+            maxBytes=max_bytes or int(os.getenv("CHATBOT_LOG_MAX_BYTES", str(10 * 1024 * 1024))),
+            backupCount=respaldos if respaldos is not None else int(os.getenv("CHATBOT_LOG_BACKUPS", "5"))
+        )
+    else:
+        destino = logging.StreamHandler()
+    destino.setFormatter(FormateadorJSON())
+
+    cola = queue.SimpleQueue()
+    raiz = logging.getLogger()
+    for handler in list(raiz.handlers):
+        raiz.removeHandler(handler)
+    raiz.addHandler(_ColaHandler(cola))
+    raiz.setLevel(nivel)
+
+    _listener = QueueListener(cola, destino, respect_handler_level=False)
+    _listener.start()
+    atexit.register(detener_logging)
+    return _listener
+
+
+def detener_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+# ------------------ EVENTOS ------------------
+def log_evento(logger: logging.Logger, evento: str, nivel: int = logging.INFO, **campos):
+    """Registra `evento` con campos estructurados.
+
+    No hace nada (ni copia ni formatea) si el nivel está deshabilitado o si el evento
+    queda fuera de su tasa de muestreo. Advertencias y errores nunca se muestrean.
+    """
+    if not logger.isEnabledFor(nivel):
+        return
+    if nivel < logging.WARNING:
+        tasa = MUESTREO.get(evento)
+        if tasa is not None and random.random() >= tasa:
+            return
+        if tasa is not None:
+            campos["muestreo"] = tasa
+    logger.log(nivel, evento, extra={"campos": campos}, stacklevel=2)
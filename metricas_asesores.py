@@ -0,0 +1,184 @@
+"""Métricas de asesores acumuladas por hora y por día a partir de la bitácora.
+
+Se alimenta de cada lote que BitacoraBuffer escribe (observador), así que el panel
+no necesita recorrer todos los eventos `advisor_availability_response` /
+`advisor_timeout`: lee un documento por asesor y periodo.
+
+Documento en `metricas_asesores`:
+  {"_id": "<telefono>|<g>|<periodo>", "asesor", "g": "hora"|"dia", "periodo": datetime, "dia": "YYYY-MM-DD",
+   "preguntas", "aceptadas", "rechazadas", "timeouts", "latencia_total_ms", "latencia_n", "latencia_max_ms"}
+
+Uso: python metricas_asesores.py --backfill [--origen serie|documento] [--mongo URI] [--db chatbot_db]
+"""
+from pymongo import MongoClient, ASCENDING, UpdateOne
+from datetime import datetime
+import argparse
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+COLECCION_METRICAS = "metricas_asesores"
+GRANULARIDADES = ("hora", "dia")
+CONTADORES = ("preguntas", "aceptadas", "rechazadas", "timeouts", "latencia_total_ms", "latencia_n")
+
+
+def _periodo(fecha: datetime, granularidad: str) -> datetime:
+    if granularidad == "hora":
+        return fecha.replace(minute=0, second=0, microsecond=0)
+    return fecha.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _fecha_evento(registro: dict) -> datetime | None:
+    for campo in ("response_time", "timeout_time", "ask_time", "time", "fecha_completa"):
+        if isinstance(registro.get(campo), datetime):
+            return registro[campo]
+    return None
+
+
+def _latencia_ms(registro: dict, fecha: datetime) -> int | None:
+    if registro.get("latencia_ms") is not None:
+        return registro["latencia_ms"]
+    original = registro.get("original_ask_time")
+    if isinstance(original, datetime):
+        return int((fecha - original).total_seconds() * 1000)
+    return None
+
+
+def acumular(registros: list) -> dict:
+    """Suma un lote de eventos por (asesor, granularidad, periodo) en memoria."""
+    acumulado = {}
+    for registro in registros:
+        evento = registro.get("event")
+        asesor = registro.get("advisor_phone")
+        if evento not in ("asked_availability", "advisor_availability_response", "advisor_timeout") or not asesor:
+            continue
+        fecha = _fecha_evento(registro)
+        if fecha is None:
+            continue
+        latencia = None
+        if evento == "asked_availability":
+            incrementos = {"preguntas": 1}
+        elif evento == "advisor_timeout":
+            incrementos = {"timeouts": 1}
+        else:
+            aceptada = str(registro.get("response", "")).lower() == "yes"
+            incrementos = {"aceptadas" if aceptada else "rechazadas": 1}
+            latencia = _latencia_ms(registro, fecha)
+            if latencia is not None:
+                incrementos["latencia_total_ms"] = latencia
+                incrementos["latencia_n"] = 1
+        for g in GRANULARIDADES:
+            clave = (asesor, g, _periodo(fecha, g))
+            fila = acumulado.setdefault(clave, {"inc": dict.fromkeys(CONTADORES, 0), "max": 0})
+            for campo, valor in incrementos.items():
+                fila["inc"][campo] += valor
+            if latencia is not None:
+                fila["max"] = max(fila["max"], latencia)
+    return acumulado
+
+
+def operaciones(acumulado: dict) -> list:
+    ops = []
+    for (asesor, g, periodo), fila in acumulado.items():
+        ops.append(UpdateOne(
+            {"_id": f"{asesor}|{g}|{periodo.isoformat()}"},
+            {
+                "$inc": {k: v for k, v in fila["inc"].items() if v},
+                "$max": {"latencia_max_ms": fila["max"]},
+                "$setOnInsert": {"asesor": asesor, "g": g, "periodo": periodo, "dia": periodo.strftime("%Y-%m-%d")}
+            },
+            upsert=True
+        ))
+    return ops
+
+
+def asegurar_indices_metricas(col):
+    try:
+        col.create_index([("g", ASCENDING), ("dia", ASCENDING)], name="g_dia")
+    except Exception as e:
+        logger.error(f"Error al crear índices de {COLECCION_METRICAS}: {str(e)}")
+
+
+class MetricasAsesores:
+    """Observador de BitacoraBuffer: aplica cada lote escrito a los acumulados."""
+
+    def __init__(self, db):
+        self.coleccion = db[COLECCION_METRICAS]
+        asegurar_indices_metricas(self.coleccion)
+
+    def __call__(self, registros: list):
+        ops = operaciones(acumular(registros))
+        if ops:
+            self.coleccion.bulk_write(ops, ordered=False)
+
+    def consultar(self, dia: str, granularidad: str = "dia", asesor: str | None = None) -> list:
+        filtro = {"g": granularidad, "dia": dia}
+        if asesor:
+            filtro["asesor"] = asesor
+        return [formatear(doc) for doc in self.coleccion.find(filtro).sort([("asesor", ASCENDING), ("periodo", ASCENDING)])]
+
+
+def formatear(doc: dict) -> dict:
+    respondidas = doc.get("aceptadas", 0) + doc.get("rechazadas", 0)
+    cerradas = respondidas + doc.get("timeouts", 0)
+    return {
+        "asesor": doc["asesor"],
+        "periodo": doc["periodo"],
+        "preguntas": doc.get("preguntas", 0),
+        "aceptadas": doc.get("aceptadas", 0),
+        "rechazadas": doc.get("rechazadas", 0),
+        "timeouts": doc.get("timeouts", 0),
+        "tasa_timeout": round(doc.get("timeouts", 0) / cerradas, 3) if cerradas else None,
+        "latencia_promedio_ms": round(doc["latencia_total_ms"] / doc["latencia_n"]) if doc.get("latencia_n") else None,
+        "latencia_max_ms": doc.get("latencia_max_ms") or None,
+    }
+
+
+# ------------------ BACKFILL ------------------
+def backfill(db, origen: str = "serie", lote: int = 5000) -> int:
+    """Recalcula los acumulados desde cero con los eventos ya guardados.
+
+    Borra la colección de métricas; los eventos que se escriban mientras corre pueden
+    quedar fuera o contarse dos veces, así que conviene ejecutarlo con el servidor detenido.
+    """
+    from bitacora_serie import COLECCION_SERIE, CODIGOS_EVENTO, expandir
+
+    db.drop_collection(COLECCION_METRICAS)
+    eventos = ["asked_availability", "advisor_availability_response", "advisor_timeout"]
+    if origen == "serie":
+        cursor = db[COLECCION_SERIE].find({"e": {"$in": [CODIGOS_EVENTO[e] for e in eventos]}}).batch_size(lote)
+        convertir = expandir
+    else:
+        cursor = db["bitacora"].find({"event": {"$in": eventos}}).batch_size(lote)
+        convertir = None
+    observador = MetricasAsesores(db)
+    total = 0
+    pendientes = []
+    for doc in cursor:
+        pendientes.append(convertir(doc) if convertir else doc)
+        if len(pendientes) >= lote:
+            observador(pendientes)
+            total += len(pendientes)
+            pendientes = []
+    if pendientes:
+        observador(pendientes)
+        total += len(pendientes)
+    return total
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backfill", action="store_true")
+    parser.add_argument("--origen", choices=["serie", "documento"], default="serie")
+    parser.add_argument("--mongo", default="mongodb://localhost:27017/")
+    parser.add_argument("--db", default="chatbot_db")
+    parser.add_argument("--lote", type=int, default=5000)
+    args = parser.parse_args()
+
+    if args.backfill:
+        client = MongoClient(args.mongo, serverSelectionTimeoutMS=5000)
+        inicio = time.perf_counter()
+        n = backfill(client[args.db], args.origen, args.lote)
+        logger.info(f"Eventos acumulados en {COLECCION_METRICAS}: {n} en {time.perf_counter() - inicio:.1f} s")
@@ -0,0 +1,78 @@
+"""Convierte estado_conversacion, memoria_clientes e historial al documento único de conversaciones.
+
+Uso: python migrar_conversaciones.py [--mongo URI] [--db chatbotdb] [--lote 500]
+"""
+from pymongo import MongoClient, UpdateOne, DESCENDING
+from datetime import datetime
+import argparse
+import logging
+
+from conversacion import Conversacion, MAX_RECIENTES
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def construir_documento(db, cliente_id: str, estado: dict | None, memoria: dict | None) -> dict:
+    estado = {k: v for k, v in (estado or {}).items() if k != "_id"}
+    memoria = {k: v for k, v in (memoria or {}).items() if k != "_id"}
+    recientes = list(
+        db["historial"].find(
+            {"cliente_id": cliente_id},
+            {"_id": 0, "role": 1, "mensaje": 1, "fecha": 1}
+        ).sort("fecha", DESCENDING).limit(MAX_RECIENTES)
+    )
+    recientes.reverse()
+    conversacion = Conversacion(cliente_id, {"estado": estado, "recientes": recientes})
+    # Pasa la memoria por los límites del documento nuevo
+    conversacion.actualizar_memoria(memoria)
+    return conversacion.a_documento()
+
+
+def migrar(db, lote: int = 500) -> int:
+    conversaciones_col = db["conversaciones"]
+    memoria_col = db["memoria_clientes"]
+    operaciones = []
+    total = 0
+    vistos = set()
+
+    def vaciar():
+        nonlocal operaciones, total
+        if operaciones:
+            conversaciones_col.bulk_write(operaciones, ordered=False)
+            total += len(operaciones)
+            logger.info(f"Conversaciones migradas: {total}")
+            operaciones = []
+
+    for estado in db["estado_conversacion"].find():
+        cliente_id = estado["_id"]
+        vistos.add(cliente_id)
+        doc = construir_documento(db, cliente_id, estado, memoria_col.find_one({"_id": cliente_id}))
+        operaciones.append(UpdateOne({"_id": cliente_id}, {"$set": doc}, upsert=True))
+        if len(operaciones) >= lote:
+            vaciar()
+
+    # Clientes que solo tienen memoria
+    for memoria in memoria_col.find():
+        if memoria["_id"] in vistos:
+            continue
+        doc = construir_documento(db, memoria["_id"], None, memoria)
+        operaciones.append(UpdateOne({"_id": memoria["_id"]}, {"$set": doc}, upsert=True))
+        if len(operaciones) >= lote:
+            vaciar()
+
+    vaciar()
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--mongo", default="mongodb://localhost:27017/")
+    parser.add_argument("--db", default="chatbotdb")
+    parser.add_argument("--lote", type=int, default=500)
+    args = parser.parse_args()
+
+    inicio = datetime.now()
+    client = MongoClient(args.mongo, serverSelectionTimeoutMS=5000)
+    migrados = migrar(client[args.db], args.lote)
+    logger.info(f"Migración terminada: {migrados} conversaciones en {(datetime.now() - inicio).total_seconds():.1f} s")
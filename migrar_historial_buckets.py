@@ -0,0 +1,118 @@
+"""Mueve el historial de un documento por mensaje al layout de buckets (cliente/día/N mensajes).
+
+Cada lote se escribe en historial_buckets y después se borran los originales. Se puede
+interrumpir y volver a correr: el `_id` de cada bucket es el de su primer mensaje y se
+escribe con upsert, y los mensajes que ya están en algún bucket (lote escrito pero no
+borrado del todo) solo se borran. Mientras tanto los lectores de historial.py pueden ver
+duplicados los mensajes del lote que estaba a medias.
+
+Uso: python migrar_historial_buckets.py [--mongo URI] [--db chatbotdb] [--lote 1000] [--dry-run]
+"""
+from pymongo import MongoClient, ReplaceOne, ASCENDING, DESCENDING
+from datetime import datetime
+from itertools import islice
+import argparse
+import logging
+
+from historial import asegurar_indices_historial, buckets_de, MENSAJES_POR_BUCKET
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def nuevo_bucket(cliente_id: str, m: dict) -> dict:
+    return {
+        "_id": m["_id"],
+        "cliente_id": cliente_id,
+        "dia": m["fecha"].strftime("%Y-%m-%d"),
+        "n": 0,
+        "inicio": m["fecha"],
+        "fin": m["fecha"],
+        "mensajes": []
+    }
+
+
+def ya_migrados(buckets_col, ids: list) -> set:
+    """Ids de mensajes que ya están en algún bucket (índice mensajes_id)."""
+    buscados = set(ids)
+    return {m["_id"] for b in buckets_col.find({"mensajes._id": {"$in": ids}}, {"mensajes._id": 1})
+            for m in b.get("mensajes", []) if m["_id"] in buscados}
+
+
+def migrar(historial_col, lote: int = 1000, dry_run: bool = False) -> tuple:
+    buckets_col = buckets_de(historial_col)
+    if not dry_run:
+        buckets_col.create_index([("mensajes._id", ASCENDING)], name="mensajes_id")
+    pendientes = []       # buckets completos listos para escribir
+    ids_movidos = []
+    ids_repetidos = []    # originales de mensajes que una corrida anterior ya dejó en un bucket
+    total_mensajes = 0
+    total_buckets = 0
+    actual = None
+
+    def vaciar():
+        nonlocal pendientes, ids_movidos, ids_repetidos, total_buckets
+        if not pendientes and not ids_repetidos:
+            return
+        if not dry_run:
+            if pendientes:
+                buckets_col.bulk_write([ReplaceOne({"_id": b["_id"]}, b, upsert=True) for b in pendientes], ordered=False)
+            historial_col.delete_many({"_id": {"$in": ids_movidos + ids_repetidos}})
+        total_buckets += len(pendientes)
+        logger.info(f"Buckets escritos: {total_buckets}, mensajes movidos: {total_mensajes}")
+        pendientes = []
+        ids_movidos = []
+        ids_repetidos = []
+
+    cursor = historial_col.find(
+        {}, {"cliente_id": 1, "role": 1, "mensaje": 1, "fecha": 1}
+    ).sort([("cliente_id", DESCENDING), ("fecha", ASCENDING), ("_id", ASCENDING)]).batch_size(lote)
+
+    while True:
+        docs = list(islice(cursor, lote))
+        if not docs:
+            break
+        repetidos = ya_migrados(buckets_col, [d["_id"] for d in docs])
+        for doc in docs:
+            if doc["_id"] in repetidos:
+                ids_repetidos.append(doc["_id"])
+                continue
+            dia = doc["fecha"].strftime("%Y-%m-%d")
+            if actual is None or actual["cliente_id"] != doc["cliente_id"] or actual["dia"] != dia or actual["n"] >= MENSAJES_POR_BUCKET:
+                if actual is not None:
+                    pendientes.append(actual)
+                actual = nuevo_bucket(doc["cliente_id"], doc)
+            actual["mensajes"].append({"_id": doc["_id"], "role": doc["role"], "mensaje": doc["mensaje"], "fecha": doc["fecha"]})
+            actual["n"] += 1
+            actual["fin"] = doc["fecha"]
+            ids_movidos.append(doc["_id"])
+            total_mensajes += 1
+            # Solo se vacían buckets completos; los ids del bucket abierto se borran con el siguiente lote
+            if len(ids_movidos) >= lote and pendientes:
+                abiertos = actual["n"]
+                ids_abiertos = ids_movidos[-abiertos:]
+                ids_movidos = ids_movidos[:-abiertos]
+                vaciar()
+                ids_movidos = ids_abiertos
+
+    if actual is not None:
+        pendientes.append(actual)
+    vaciar()
+    return total_mensajes, total_buckets
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--mongo", default="mongodb://localhost:27017/")
+    parser.add_argument("--db", default="chatbotdb")
+    parser.add_argument("--lote", type=int, default=1000)
+    parser.add_argument("--dry-run", action="store_true", help="Solo cuenta, no escribe ni borra")
+    args = parser.parse_args()
+
+    client = MongoClient(args.mongo, serverSelectionTimeoutMS=5000)
+    historial_col = client[args.db]["historial"]
+    asegurar_indices_historial(historial_col)
+    inicio = datetime.now()
+    mensajes, buckets = migrar(historial_col, args.lote, args.dry_run)
+    segundos = (datetime.now() - inicio).total_seconds()
+    logger.info(f"Migración terminada: {mensajes} mensajes en {buckets} buckets, {segundos:.1f} s")
@@ -0,0 +1,558 @@
+"""Despachador del outbox: entrega los documentos de `sends` al gateway de WhatsApp.
+
+Los servidores solo insertan {"jid", "message", "buttons"?, "sent": False, "sent_time"}.
+Este proceso los reclama uno a uno con find_one_and_update sobre el índice
+(sent, lease_until, priority), los agrupa por destinatario, respeta límites de envío
+por jid y globales (cubetas de tokens), reintenta con backoff exponencial y marca cada
+mensaje como entregado. Pueden correr varios procesos en paralelo. El orden por jid se
+conserva dentro del lote de cada trabajador; entre reintentos y trabajadores es de mejor esfuerzo.
+
+Estados de un documento:
+  sent=False, sin lease_until            pendiente
+  sent=False, claimed_by, lease_until    reclamado; si el lease vence, otro trabajador lo toma
+  sent=False, lease_until sin dueño      en espera de reintento (no disponible antes de lease_until)
+  sent=True                              entregado (delivered_time)
+  sent=None, failed=True                 descartado tras MAX_INTENTOS o error permanente
+
+Uso: python outbox.py [--mongo URI] [--db chatbot_db] [--transporte http|mock] [--change-stream]
+     (un proceso por trabajador; se escalan lanzando más procesos)
+"""
+from pymongo import MongoClient, ASCENDING, DESCENDING, ReturnDocument
+from collections import deque
+from datetime import datetime, timedelta
+import argparse
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# ------------------ CONFIG ------------------
+GATEWAY_URL = os.getenv("CHATBOT_GATEWAY_URL", "http://localhost:3000/send")
+TAM_LOTE = int(os.getenv("OUTBOX_TAM_LOTE", "200"))
+INTERVALO = float(os.getenv("OUTBOX_INTERVALO", "0.5"))            # segundos entre consultas sin trabajo
+TASA_GLOBAL = float(os.getenv("OUTBOX_TASA_GLOBAL", "20"))          # mensajes/s hacia el gateway
+TASA_JID = float(os.getenv("OUTBOX_TASA_JID", "1"))                 # mensajes/s por destinatario
+RAFAGA_JID = int(os.getenv("OUTBOX_RAFAGA_JID", "3"))
+MAX_INTENTOS = int(os.getenv("OUTBOX_MAX_INTENTOS", "6"))
+BACKOFF_BASE = 2.0                                                  # segundos, se duplica por intento
+BACKOFF_MAX = 300.0
+ENVEJECIMIENTO = float(os.getenv("OUTBOX_ENVEJECIMIENTO", "20"))   # segundos de espera por cada nivel ganado
+# Coalescencia por jid: no | duplicados (descarta repetidos) | unir (además junta textos sin botones)
+COALESCER = os.getenv("OUTBOX_COALESCER", "no")
+VENTANA_COALESCER = float(os.getenv("OUTBOX_VENTANA_COALESCER", "5"))   # segundos entre mensajes unibles
+PUBLICAR_METRICAS = 10.0                                            # segundos entre publicaciones de métricas
+COLECCION_METRICAS = "outbox_metricas"
+LEASE = float(os.getenv("OUTBOX_LEASE", "60"))                      # segundos que un trabajador retiene un mensaje
+MARGEN_LEASE = 0.8                                                  # fracción del lease usable para enviar
+
+
+# Carriles de prioridad (mayor = antes). Un mensaje sube un nivel por cada ENVEJECIMIENTO
+# segundos en cola hasta PRIORIDAD_MAXIMA, así los carriles bajos nunca se quedan sin turno.
+CARRILES = {
+    "disponibilidad": 3,    # pregunta sí/no al asesor: corre contra TIEMPO_RESPUESTA_EJECUTIVO
+    "asignacion": 2,        # datos del cliente al asesor y confirmación al cliente
+    "conversacion": 1,      # respuestas del bot
+    "aviso": 0,             # errores y avisos informativos
+}
+CARRIL_POR_DEFECTO = "conversacion"
+PRIORIDAD_MAXIMA = max(CARRILES.values())
+
+
+def encolar(sends_col, jid: str, message, carril: str = CARRIL_POR_DEFECTO, buttons: list | None = None, **extra):
+    """Inserta un mensaje en el outbox con su carril y prioridad inicial."""
+    doc = {"jid": jid, "message": message, **extra, "sent": False, "sent_time": datetime.utcnow(),
+           "lane": carril, "priority": CARRILES[carril]}
+    if buttons:
+        doc["buttons"] = buttons
+    return sends_col.insert_one(doc)
+
+
+def asegurar_indices_outbox(sends_col):
+    try:
+        sends_col.create_index([("sent", ASCENDING), ("sent_time", ASCENDING)], name="sent_sent_time")
+        sends_col.create_index([("sent", ASCENDING), ("lease_until", ASCENDING), ("priority", DESCENDING)],
+                               name="sent_lease_priority")
+        # Sirve el orden del reclamo sin ordenar en memoria todo lo pendiente
+        sends_col.create_index([("sent", ASCENDING), ("priority", DESCENDING), ("sent_time", ASCENDING)],
+                               name="sent_priority_sent_time")
+    except Exception as e:
+        logger.error(f"Error al crear índices del outbox: {str(e)}")
+
+
+# ------------------ LÍMITES ------------------
+class CuboTokens:
+    def __init__(self, tasa: float, capacidad: float):
+        self.tasa = tasa
+        self.capacidad = capacidad
+        self.tokens = capacidad
+        self.ultimo = time.monotonic()
+
+    def _rellenar(self):
+        ahora = time.monotonic()
+        self.tokens = min(self.capacidad, self.tokens + (ahora - self.ultimo) * self.tasa)
+        self.ultimo = ahora
+
+    def tomar(self) -> bool:
+        self._rellenar()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def espera(self) -> float:
+        """Segundos hasta que haya un token disponible."""
+        self._rellenar()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.tasa
+
+
+class Limitador:
+    """Cubeta global más una por jid; las cubetas llenas e inactivas se descartan."""
+
+    def __init__(self, tasa_global: float = TASA_GLOBAL, tasa_jid: float = TASA_JID, rafaga_jid: int = RAFAGA_JID):
+        self.global_ = CuboTokens(tasa_global, max(tasa_global, 1))
+        self.tasa_jid = tasa_jid
+        self.rafaga_jid = rafaga_jid
+        self._por_jid = {}
+
+    def permitir_jid(self, jid: str) -> bool:
+        cubo = self._por_jid.get(jid)
+        if cubo is None:
+            cubo = self._por_jid[jid] = CuboTokens(self.tasa_jid, self.rafaga_jid)
+        return cubo.tomar()
+
+    def espera_jid(self, jid: str) -> float:
+        cubo = self._por_jid.get(jid)
+        return cubo.espera() if cubo else 0.0
+
+    def esperar_global(self):
+        while not self.global_.tomar():
+            time.sleep(self.global_.espera())
+
+    def purgar(self):
+        for jid in [j for j, c in self._por_jid.items() if c.espera() == 0 and c.tokens >= c.capacidad]:
+            del self._por_jid[jid]
+
+
+# ------------------ TRANSPORTES ------------------
+class ErrorTransporte(Exception):
+    def __init__(self, mensaje: str, permanente: bool = False):
+        super().__init__(mensaje)
+        self.permanente = permanente
+
+
+class Transporte:
+    """Entrega un mensaje al gateway; lanza ErrorTransporte si no se pudo."""
+
+    def enviar(self, doc: dict):
+        raise NotImplementedError
+
+
+class TransporteHTTP(Transporte):
+    def __init__(self, url: str = GATEWAY_URL, timeout: float = 10):
+        self.url = url
+        self.timeout = timeout
+        self._sesion = requests.Session()
+
+    def enviar(self, doc: dict):
+        cuerpo = {"jid": doc["jid"], "message": doc.get("message", "")}
+        if doc.get("buttons"):
+            cuerpo["buttons"] = doc["buttons"]
+        try:
+            res = self._sesion.post(self.url, json=cuerpo, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise ErrorTransporte(str(e))
+        if res.status_code == 429 or res.status_code >= 500:
+            raise ErrorTransporte(f"HTTP {res.status_code}")
+        if res.status_code >= 400:
+            raise ErrorTransporte(f"HTTP {res.status_code}: {res.text[:200]}", permanente=True)
+
+
+class TransporteMock(Transporte):
+    """Gateway simulado en proceso: latencia fija y una fracción de fallos transitorios."""
+
+    def __init__(self, latencia: float = 0.0, tasa_fallos: float = 0.0):
+        self.latencia = latencia
+        self.tasa_fallos = tasa_fallos
+        self.entregados = []
+        self._lock = threading.Lock()
+
+    def enviar(self, doc: dict):
+        if self.latencia:
+            time.sleep(self.latencia)
+        if self.tasa_fallos and random.random() < self.tasa_fallos:
+            raise ErrorTransporte("fallo simulado")
+        with self._lock:
+            self.entregados.append((doc["jid"], doc.get("message")))
+
+
+def crear_transporte(nombre: str) -> Transporte:
+    if nombre == "mock":
+        return TransporteMock()
+    return TransporteHTTP()
+
+
+# ------------------ COALESCENCIA ------------------
+def _hora_encolado(doc: dict) -> datetime | None:
+    if doc.get("sent_time"):
+        return doc["sent_time"]
+    generacion = getattr(doc.get("_id"), "generation_time", None)
+    return generacion.replace(tzinfo=None) if generacion else None
+
+
+def _texto(doc: dict) -> str | None:
+    mensaje = doc.get("message")
+    return mensaje.get("text") if isinstance(mensaje, dict) else mensaje
+
+
+def _botones(doc: dict) -> list | None:
+    mensaje = doc.get("message")
+    return doc.get("buttons") or (mensaje.get("buttons") if isinstance(mensaje, dict) else None)
+
+
+def _solo_texto(doc: dict) -> bool:
+    mensaje = doc.get("message")
+    return not _botones(doc) and (isinstance(mensaje, str) or (isinstance(mensaje, dict) and set(mensaje) == {"text"}))
+
+
+def coalescer(docs: list, modo: str = COALESCER, ventana: float = VENTANA_COALESCER) -> list:
+    """Agrupa los mensajes de un jid (ya en orden) en entregas [(doc a enviar, [docs originales])].
+
+    - Duplicado exacto, o copia en texto plano de un mensaje con botones: se entrega uno solo.
+    - modo "unir": textos sin botones consecutivos dentro de `ventana` se envían juntos.
+    Los mensajes con botones nunca se unen con otros: el canal no lo permite.
+    """
+    entregas = []
+    ultima = None
+    for doc in docs:
+        hora = _hora_encolado(doc)
+        if modo != "no" and entregas and hora and ultima and 0 <= (hora - ultima).total_seconds() <= ventana:
+            envio, originales = entregas[-1]
+            previo = originales[-1]
+            if _texto(doc) == _texto(previo):
+                if _botones(doc) == _botones(previo) or not _botones(doc):
+                    originales.append(doc)
+                    ultima = hora
+                    continue
+                if envio is previo and not _botones(previo):
+                    # El texto plano llegó antes que su versión con botones: se envía la de botones
+                    entregas[-1] = (doc, originales + [doc])
+                    ultima = hora
+                    continue
+            if modo == "unir" and _solo_texto(envio) and _solo_texto(doc):
+                unido = f"{_texto(envio)}\n\n{_texto(doc)}"
+                mensaje = {"text": unido} if isinstance(envio.get("message"), dict) else unido
+                entregas[-1] = ({**envio, "message": mensaje}, originales + [doc])
+                ultima = hora
+                continue
+        entregas.append((doc, [doc]))
+        ultima = hora
+    return entregas
+
+
+# ------------------ MÉTRICAS POR CARRIL ------------------
+class MetricasCarriles:
+    """Espera en cola (encolado -> entregado) por carril, publicada por cada trabajador."""
+
+    def __init__(self, ventana: int = 500):
+        self.ventana = ventana
+        self.entregados = {}
+        self._esperas = {}
+
+    def registrar(self, carril: str, espera_ms: float):
+        self.entregados[carril] = self.entregados.get(carril, 0) + 1
+        self._esperas.setdefault(carril, deque(maxlen=self.ventana)).append(round(espera_ms))
+
+    def publicar(self, col, trabajador: str, contadores: dict | None = None):
+        col.replace_one({"_id": trabajador}, {
+            "ts": datetime.utcnow(),
+            "carriles": {c: {"entregados": self.entregados[c], "esperas_ms": list(self._esperas[c])} for c in self._esperas},
+            "contadores": contadores or {}
+        }, upsert=True)
+
+
+def _percentil(valores: list, p: float):
+    return valores[min(int(len(valores) * p), len(valores) - 1)] if valores else None
+
+
+def resumen_outbox(sends_col, vigencia: float = 300) -> dict:
+    """Pendientes y espera en cola por carril, combinando lo publicado por los trabajadores activos."""
+    ahora = datetime.utcnow()
+    carriles = {c: {"pendientes": 0, "espera_mas_antigua_s": None, "entregados": 0,
+                    "espera_p50_ms": None, "espera_p95_ms": None, "espera_max_ms": None} for c in CARRILES}
+    for g in sends_col.aggregate([
+        {"$match": {"sent": False}},
+        {"$group": {"_id": {"$ifNull": ["$lane", CARRIL_POR_DEFECTO]}, "n": {"$sum": 1}, "antiguo": {"$min": "$sent_time"}}}
+    ]):
+        fila = carriles.setdefault(g["_id"], {})
+        fila["pendientes"] = g["n"]
+        fila["espera_mas_antigua_s"] = round((ahora - g["antiguo"]).total_seconds(), 1) if g.get("antiguo") else None
+    esperas = {}
+    trabajadores = 0
+    contadores = {}
+    for doc in sends_col.database[COLECCION_METRICAS].find({"ts": {"$gte": ahora - timedelta(seconds=vigencia)}}):
+        trabajadores += 1
+        for nombre, valor in doc.get("contadores", {}).items():
+            contadores[nombre] = contadores.get(nombre, 0) + valor
+        for c, m in doc.get("carriles", {}).items():
+            carriles.setdefault(c, {})["entregados"] = carriles[c].get("entregados", 0) + m["entregados"]
+            esperas.setdefault(c, []).extend(m["esperas_ms"])
+    for c, valores in esperas.items():
+        valores.sort()
+        carriles[c].update({"espera_p50_ms": _percentil(valores, 0.5), "espera_p95_ms": _percentil(valores, 0.95),
+                            "espera_max_ms": valores[-1]})
+    return {"trabajadores": trabajadores, "carriles": carriles, "contadores": contadores}
+
+
+# ------------------ DESPACHADOR ------------------
+class Despachador:
+    """Un trabajador del outbox. Varios procesos pueden ejecutarse a la vez: cada mensaje
+    se reclama con find_one_and_update (claimed_by + lease_until) antes de enviarse."""
+
+    def __init__(self, sends_col, transporte: Transporte, limitador: Limitador | None = None,
+                 tam_lote: int = TAM_LOTE, intervalo: float = INTERVALO, max_intentos: int = MAX_INTENTOS,
+                 lease: float = LEASE, trabajador: str | None = None, coalescer: str = COALESCER,
+                 ventana_coalescer: float = VENTANA_COALESCER):
+        self.sends_col = sends_col
+        self.transporte = transporte
+        self.limitador = limitador or Limitador()
+        self.tam_lote = tam_lote
+        self.intervalo = intervalo
+        self.max_intentos = max_intentos
+        self.lease = lease
+        self.modo_coalescer = coalescer
+        self.ventana_coalescer = ventana_coalescer
+        self.trabajador = trabajador or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._despertar = threading.Event()
+        self._detener = threading.Event()
+        self.enviados = 0
+        self.fallidos = 0
+        self.reintentos = 0
+        self.recuperados = 0
+        self.envejecidos = 0
+        self.llamadas_gateway = 0
+        self.llamadas_ahorradas = 0
+        self.metricas = MetricasCarriles()
+        self._proximo_envejecimiento = 0.0
+        self._proxima_publicacion = time.monotonic() + PUBLICAR_METRICAS
+        asegurar_indices_outbox(sends_col)
+
+    # ---- reclamo ----
+    def _reclamar(self, filtro_extra: dict, ahora: datetime) -> dict | None:
+        filtro = {"sent": False, "$or": [{"lease_until": None}, {"lease_until": {"$lte": ahora}}], **filtro_extra}
+        previo = self.sends_col.find_one_and_update(
+            filtro,
+            {"$set": {"claimed_by": self.trabajador, "lease_until": ahora + timedelta(seconds=self.lease)}},
+            sort=[("priority", DESCENDING), ("sent_time", ASCENDING)],
+            return_document=ReturnDocument.BEFORE
+        )
+        if previo and previo.get("claimed_by"):
+            # Lease vencido de un trabajador que cayó o tardó demasiado
+            self.recuperados += 1
+        return previo
+
+    def _reclamar_lote(self) -> list:
+        """Reclama hasta tam_lote mensajes; tras cada uno, los demás pendientes de su jid."""
+        reclamados = []
+        ahora = datetime.utcnow()
+        while len(reclamados) < self.tam_lote:
+            doc = self._reclamar({}, ahora)
+            if doc is None:
+                break
+            reclamados.append(doc)
+            while len(reclamados) < self.tam_lote:
+                # Mismo destinatario en el mismo trabajador para conservar el orden de entrega
+                siguiente = self._reclamar({"jid": doc["jid"]}, ahora)
+                if siguiente is None:
+                    break
+                reclamados.append(siguiente)
+        return reclamados
+
+    def _liberar(self, docs: list, segundos: float, ahora: datetime):
+        """Devuelve mensajes reclamados a la cola, disponibles dentro de `segundos`."""
+        if docs:
+            self.sends_col.update_many(
+                {"_id": {"$in": [d["_id"] for d in docs]}, "claimed_by": self.trabajador, "sent": False},
+                {"$set": {"lease_until": ahora + timedelta(seconds=segundos)}, "$unset": {"claimed_by": ""}}
+            )
+
+    def _envejecer(self, ahora: datetime):
+        """Sube un nivel a los mensajes que llevan ENVEJECIMIENTO segundos sin subir.
+
+        El filtro se reevalúa por documento, así que dos trabajadores no suben dos veces el mismo.
+        """
+        corte = ahora - timedelta(seconds=ENVEJECIMIENTO)
+        resultado = self.sends_col.update_many(
+            {"sent": False,
+             "$and": [
+                 {"$or": [{"priority": {"$lt": PRIORIDAD_MAXIMA}}, {"priority": None}]},
+                 {"$or": [{"aged_time": {"$lte": corte}}, {"aged_time": None, "sent_time": {"$lte": corte}},
+                          {"aged_time": None, "sent_time": None}]}
+             ]},
+            [{"$set": {"priority": {"$add": [{"$ifNull": ["$priority", CARRILES[CARRIL_POR_DEFECTO]]}, 1]},
+                       "aged_time": ahora}}]
+        )
+        self.envejecidos += resultado.modified_count
+
+    def _tareas_periodicas(self):
+        reloj = time.monotonic()
+        if reloj >= self._proximo_envejecimiento:
+            self._envejecer(datetime.utcnow())
+            self._proximo_envejecimiento = reloj + ENVEJECIMIENTO / 2
+        if reloj >= self._proxima_publicacion:
+            self.metricas.publicar(self.sends_col.database[COLECCION_METRICAS], self.trabajador, {
+                "enviados": self.enviados, "fallidos": self.fallidos, "reintentos": self.reintentos,
+                "llamadas_gateway": self.llamadas_gateway, "llamadas_ahorradas": self.llamadas_ahorradas
+            })
+            self._proxima_publicacion = reloj + PUBLICAR_METRICAS
+
+    def _por_destino(self, docs: list) -> dict:
+        """Grupos por jid en el orden en que se reclamaron (prioridad); dentro, por hora de encolado."""
+        grupos = {}
+        for doc in docs:
+            grupos.setdefault(doc["jid"], []).append(doc)
+        for grupo in grupos.values():
+            grupo.sort(key=lambda d: d.get("sent_time") or datetime.min)
+        return grupos
+
+    def _marcar_entregados(self, ids: list, ahora: datetime):
+        if ids:
+            self.sends_col.update_many(
+                {"_id": {"$in": ids}, "claimed_by": self.trabajador},
+                {"$set": {"sent": True, "delivered_time": ahora}, "$unset": {"lease_until": "", "claimed_by": ""}}
+            )
+
+    def _registrar_fallo(self, doc: dict, error: ErrorTransporte, ahora: datetime) -> float:
+        """Programa el reintento o descarta el mensaje; devuelve los segundos de espera."""
+        intentos = doc.get("attempts", 0) + 1
+        if error.permanente or intentos >= self.max_intentos:
+            self.fallidos += 1
+            logger.error(f"Mensaje {doc['_id']} para {doc['jid']} descartado tras {intentos} intentos: {error}")
+            self.sends_col.update_one({"_id": doc["_id"], "claimed_by": self.trabajador}, {
+                "$set": {"sent": None, "failed": True, "failed_time": ahora, "last_error": str(error)},
+                "$unset": {"lease_until": "", "claimed_by": ""},
+                "$inc": {"attempts": 1}
+            })
+            return 0.0
+        self.reintentos += 1
+        espera = min(BACKOFF_BASE * 2 ** (intentos - 1), BACKOFF_MAX) * random.uniform(0.8, 1.2)
+        # lease_until sin dueño = "no disponible antes de"; sent_time conserva la hora de encolado
+        self.sends_col.update_one({"_id": doc["_id"], "claimed_by": self.trabajador}, {
+            "$set": {"lease_until": ahora + timedelta(seconds=espera), "last_error": str(error)},
+            "$unset": {"claimed_by": ""},
+            "$inc": {"attempts": 1}
+        })
+        return espera
+
+    def _marcar_absorbidos(self, envio: dict, originales: list):
+        absorbidos = [d["_id"] for d in originales if d["_id"] != envio["_id"]]
+        if absorbidos:
+            self.sends_col.update_many({"_id": {"$in": absorbidos}, "claimed_by": self.trabajador},
+                                       {"$set": {"coalesced_into": envio["_id"]}})
+
+    def _entregar_grupo(self, jid: str, docs: list, vence: float) -> list:
+        """Envía en orden los mensajes de un jid; se detiene en el primer fallo o sin tokens."""
+        entregas = coalescer(docs, self.modo_coalescer, self.ventana_coalescer)
+        pendientes = lambda desde: [d for _, originales in entregas[desde:] for d in originales]
+        entregados = []
+        for i, (envio, originales) in enumerate(entregas):
+            if time.monotonic() >= vence:
+                # El lease está por vencer: otro trabajador podría reclamarlos, mejor soltarlos
+                self._liberar(pendientes(i), 0, datetime.utcnow())
+                break
+            if not self.limitador.permitir_jid(jid):
+                self._liberar(pendientes(i), self.limitador.espera_jid(jid), datetime.utcnow())
+                break
+            self.limitador.esperar_global()
+            self.llamadas_gateway += 1
+            try:
+                self.transporte.enviar(envio)
+            except ErrorTransporte as e:
+                ahora = datetime.utcnow()
+                original = next(d for d in originales if d["_id"] == envio["_id"])
+                espera = self._registrar_fallo(original, e, ahora)
+                # Los siguientes del mismo jid esperan al reintento para conservar el orden
+                self._liberar([d for d in originales if d is not original] + pendientes(i + 1), espera, ahora)
+                break
+            self.llamadas_ahorradas += len(originales) - 1
+            self._marcar_absorbidos(envio, originales)
+            ahora = datetime.utcnow()
+            for doc in originales:
+                entregados.append(doc["_id"])
+                if doc.get("sent_time"):
+                    self.metricas.registrar(doc.get("lane", CARRIL_POR_DEFECTO),
+                                            (ahora - doc["sent_time"]).total_seconds() * 1000)
+        return entregados
+
+    def procesar_lote(self) -> int:
+        """Reclama un lote y lo entrega; devuelve cuántos mensajes se entregaron."""
+        self._tareas_periodicas()
+        docs = self._reclamar_lote()
+        vence = time.monotonic() + self.lease * MARGEN_LEASE
+        total = 0
+        for jid, grupo in self._por_destino(docs).items():
+            # Se marca por destinatario para acotar lo que se reenviaría si el proceso cae
+            entregados = self._entregar_grupo(jid, grupo, vence)
+            self._marcar_entregados(entregados, datetime.utcnow())
+            total += len(entregados)
+        self.enviados += total
+        self.limitador.purgar()
+        return total
+
+    def escuchar_cambios(self):
+        """Despierta el ciclo en cuanto se inserta un mensaje (requiere replica set)."""
+        def _vigilar():
+            try:
+                with self.sends_col.watch([{"$match": {"operationType": "insert"}}]) as stream:
+                    for _ in stream:
+                        self._despertar.set()
+                        if self._detener.is_set():
+                            return
+            except Exception as e:
+                logger.warning(f"Change stream no disponible, se usa solo la consulta periódica: {str(e)}")
+        threading.Thread(target=_vigilar, name="outbox-change-stream", daemon=True).start()
+
+    def ejecutar(self):
+        logger.info(f"Despachador del outbox iniciado ({self.trabajador})")
+        while not self._detener.is_set():
+            try:
+                n = self.procesar_lote()
+            except Exception as e:
+                logger.error(f"Error en el ciclo del outbox: {str(e)}", exc_info=True)
+                n = 0
+            if n == 0:
+                self._despertar.wait(self.intervalo)
+                self._despertar.clear()
+        logger.info(f"Despachador {self.trabajador} detenido: {self.enviados} enviados, {self.fallidos} fallidos, "
+                    f"{self.reintentos} reintentos, {self.recuperados} leases recuperados, "
+                    f"{self.llamadas_ahorradas} llamadas al gateway ahorradas")
+
+    def detener(self):
+        self._detener.set()
+        self._despertar.set()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo", default="mongodb://localhost:27017/")
+    parser.add_argument("--db", default="chatbot_db")
+    parser.add_argument("--coleccion", default="sends")
+    parser.add_argument("--transporte", choices=["http", "mock"], default="http")
+    parser.add_argument("--change-stream", action="store_true", help="Despierta con cada inserción en lugar de esperar el intervalo")
+    args = parser.parse_args()
+
+    client = MongoClient(args.mongo, serverSelectionTimeoutMS=5000)
+    despachador = Despachador(client[args.db][args.coleccion], crear_transporte(args.transporte))
+    if args.change_stream:
+        despachador.escuchar_cambios()
+    try:
+        despachador.ejecutar()
+    except KeyboardInterrupt:
+        despachador.detener()
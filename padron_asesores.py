@@ -0,0 +1,201 @@
+"""Padrón de asesores en memoria con teléfonos normalizados.
+
+`get_asesores` y la asignación consultaban `asesores` en cada llamada y reescribían
+cada teléfono con el prefijo 521. El padrón carga los activos una vez, los indexa
+por teléfono (búsqueda O(1)) y se recarga cuando cambian:
+
+- con change stream sobre `asesores` (requiere replica set), o
+- con un sello de versión en `asesores_meta` que incrementan `guardar_asesor` /
+  `cambiar_estado`; se compara como máximo cada VERIFICAR_VERSION segundos.
+
+Además se recarga cada TTL segundos por si alguien edita la colección a mano.
+
+Uso: python padron_asesores.py --normalizar | --activar TEL | --desactivar TEL
+                               | --alta TEL --nombre NOMBRE [--mongo URI] [--db chatbot_db]
+"""
+from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError
+import argparse
+import logging
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# ------------------ CONFIG ------------------
+COLECCION_META = "asesores_meta"
+ID_VERSION = "padron"
+VERIFICAR_VERSION = float(os.getenv("PADRON_VERIFICAR_VERSION", "5"))   # segundos entre consultas del sello
+TTL = float(os.getenv("PADRON_TTL", "300"))                            # recarga completa aunque no haya cambios
+NOMBRE_POR_DEFECTO = "Asesor Desconocido"
+
+
+def normalizar_telefono(telefono) -> str:
+    """Teléfono móvil de México en el formato del gateway: 521 + 10 dígitos."""
+    digitos = re.sub(r"\D", "", str(telefono or ""))
+    if len(digitos) == 10:
+        return f"521{digitos}"
+    if len(digitos) == 12 and digitos.startswith("52"):
+        return f"521{digitos[2:]}"
+    if digitos.startswith("521"):
+        return digitos
+    return f"521{digitos}" if digitos else ""
+
+
+def jid_asesor(telefono) -> str:
+    return f"{normalizar_telefono(telefono)}@s.whatsapp.net"
+
+
+# ------------------ ESCRITURA ------------------
+def _incrementar_version(db):
+    db[COLECCION_META].update_one({"_id": ID_VERSION}, {"$inc": {"version": 1}}, upsert=True)
+
+
+def guardar_asesor(col, telefono: str, nombre: str | None = None, activo: bool = True, **extra) -> str:
+    """Alta o actualización de un asesor; el teléfono se guarda ya normalizado."""
+    telefono = normalizar_telefono(telefono)
+    campos = {"telefono": telefono, "activo": activo, **extra}
+    if nombre:
+        campos["nombre"] = nombre
+    col.update_one({"telefono": telefono}, {"$set": campos}, upsert=True)
+    _incrementar_version(col.database)
+    return telefono
+
+
+def cambiar_estado(col, telefono: str, activo: bool) -> bool:
+    # También el teléfono tal cual, por si la colección aún no pasó por --normalizar
+    variantes = list({normalizar_telefono(telefono), str(telefono)})
+    resultado = col.update_many({"telefono": {"$in": variantes}}, {"$set": {"activo": activo}})
+    if resultado.matched_count:
+        _incrementar_version(col.database)
+    return bool(resultado.matched_count)
+
+
+def normalizar_coleccion(col) -> int:
+    """Reescribe una sola vez los teléfonos guardados sin el formato 521."""
+    cambiados = 0
+    for doc in col.find({"telefono": {"$exists": True}}, {"telefono": 1}):
+        telefono = normalizar_telefono(doc["telefono"])
+        if telefono and telefono != doc["telefono"]:
+            try:
+                col.update_one({"_id": doc["_id"]}, {"$set": {"telefono": telefono}})
+                cambiados += 1
+            except DuplicateKeyError:
+                logger.warning(f"Teléfono duplicado tras normalizar, se deja sin cambios: {doc['telefono']}")
+    if cambiados:
+        _incrementar_version(col.database)
+    return cambiados
+
+
+# ------------------ PADRÓN ------------------
+class PadronAsesores:
+    """Asesores activos en memoria, en el orden de la colección, indexados por teléfono.
+
+    Las lecturas no tocan MongoDB salvo para comparar el sello de versión; la carga
+    reemplaza la instantánea completa, así que los lectores nunca ven una a medias.
+    """
+
+    def __init__(self, col, verificar_version: float = VERIFICAR_VERSION, ttl: float = TTL):
+        self.col = col
+        self.meta = col.database[COLECCION_META]
+        self.verificar_version = verificar_version
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._lista = ()
+        self._por_telefono = {}
+        self._version = None
+        self._cargado = 0.0
+        self._verificado = 0.0
+        self._sucio = True
+        self.recargas = 0
+
+    def _leer_version(self):
+        doc = self.meta.find_one({"_id": ID_VERSION})
+        return doc.get("version") if doc else None
+
+    def recargar(self):
+        version = self._leer_version()
+        lista = []
+        por_telefono = {}
+        for doc in self.col.find({"activo": True}, {"telefono": 1, "nombre": 1, "area": 1, "tipos": 1, "capacidad": 1, "_id": 0}):
+            if "telefono" not in doc:
+                continue
+            telefono = normalizar_telefono(doc["telefono"])
+            if telefono in por_telefono:
+                continue
+            asesor = {"telefono": telefono, "nombre": doc.get("nombre", NOMBRE_POR_DEFECTO)}
+            asesor.update({k: doc[k] for k in ("area", "tipos") if doc.get(k)})
+            if doc.get("capacidad") is not None:
+                asesor["capacidad"] = int(doc["capacidad"])
+            lista.append(asesor)
+            por_telefono[telefono] = asesor
+        with self._lock:
+            self._lista = tuple(lista)
+            self._por_telefono = por_telefono
+            self._version = version
+            self._cargado = self._verificado = time.monotonic()
+            self._sucio = False
+        self.recargas += 1
+        logger.info(f"Padrón de asesores cargado: {len(lista)} activos (versión {version})")
+
+    def invalidar(self):
+        self._sucio = True
+
+    def _vigente(self):
+        ahora = time.monotonic()
+        if self._sucio or ahora - self._cargado >= self.ttl:
+            self.recargar()
+        elif ahora - self._verificado >= self.verificar_version:
+            self._verificado = ahora
+            if self._leer_version() != self._version:
+                self.recargar()
+
+    def instantanea(self) -> tuple:
+        """Tupla interna de activos (sin copiar); los llamadores no deben modificarla."""
+        self._vigente()
+        return self._lista
+
+    def activos(self) -> list:
+        self._vigente()
+        return [dict(a) for a in self._lista]
+
+    def buscar(self, telefono) -> dict | None:
+        self._vigente()
+        asesor = self._por_telefono.get(normalizar_telefono(telefono))
+        return dict(asesor) if asesor else None
+
+    def escuchar_cambios(self):
+        """Invalida el padrón con cada cambio en `asesores` (requiere replica set)."""
+        def _vigilar():
+            try:
+                with self.col.watch() as stream:
+                    for _ in stream:
+                        self.invalidar()
+            except Exception as e:
+                logger.warning(f"Change stream de asesores no disponible, se usa el sello de versión: {str(e)}")
+        threading.Thread(target=_vigilar, name="padron-asesores", daemon=True).start()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo", default="mongodb://localhost:27017/")
+    parser.add_argument("--db", default="chatbot_db")
+    parser.add_argument("--normalizar", action="store_true")
+    parser.add_argument("--activar")
+    parser.add_argument("--desactivar")
+    parser.add_argument("--alta")
+    parser.add_argument("--nombre")
+    args = parser.parse_args()
+
+    col = MongoClient(args.mongo, serverSelectionTimeoutMS=5000)[args.db]["asesores"]
+    if args.normalizar:
+        logger.info(f"Teléfonos normalizados: {normalizar_coleccion(col)}")
+    if args.alta:
+        logger.info(f"Asesor guardado: {guardar_asesor(col, args.alta, args.nombre)}")
+    if args.activar:
+        logger.info(f"Activado: {cambiar_estado(col, args.activar, True)}")
+    if args.desactivar:
+        logger.info(f"Desactivado: {cambiar_estado(col, args.desactivar, False)}")
@@ -0,0 +1,137 @@
+"""Presencia de asesores: última actividad y tiempo de respuesta aprendido.
+
+`send_to_next_advisor` preguntaba en orden y esperaba los TIEMPO_RESPUESTA_EJECUTIVO
+(300 s) completos por cada asesor desconectado: con tres asesores fuera el cliente
+esperaba 15 minutos. Aquí se lleva en memoria, por teléfono:
+
+- `visto`: última actividad (respuesta a un botón o latido de POST /asesores/latido).
+- `ewma_s`: promedio móvil exponencial (ALFA) de su tiempo de respuesta.
+- `timeouts`: preguntas seguidas sin respuesta; se reinicia al responder.
+
+Con eso el motor de asignación prefiere a los presentes (`ausente` da falso) y cae
+al padrón completo solo si no hay ninguno, y cada pregunta vence en
+`tiempo_respuesta`: FACTOR * ewma acotado a [MINIMO, MAXIMO], o MINIMO si el
+asesor está ausente. `sincronizar` escribe los cambios en `presencia_asesores`
+y relee lo que guardaron los otros workers.
+"""
+from datetime import datetime, timedelta
+from pymongo import UpdateOne
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# ------------------ CONFIG ------------------
+COLECCION_PRESENCIA = "presencia_asesores"
+VENTANA_PRESENTE = timedelta(minutes=float(os.getenv("PRESENCIA_VENTANA_MINUTOS", "30")))
+TIMEOUTS_AUSENTE = int(os.getenv("PRESENCIA_TIMEOUTS_AUSENTE", "2"))   # preguntas seguidas sin respuesta
+ALFA = 0.3
+FACTOR = float(os.getenv("PRESENCIA_FACTOR", "3"))                    # espera = FACTOR * tiempo típico
+MINIMO = float(os.getenv("PRESENCIA_ESPERA_MINIMA", "60"))            # segundos
+MAXIMO = float(os.getenv("PRESENCIA_ESPERA_MAXIMA", "300"))           # la espera fija de antes
+
+
+class Presencia:
+    def __init__(self, db, maximo: float = MAXIMO):
+        self.col = db[COLECCION_PRESENCIA]
+        self.maximo = maximo
+        self._lock = threading.Lock()
+        self._asesores = {}              # teléfono -> {"visto", "ewma_s", "n", "timeouts"}
+        self._sucios = set()
+        self._ultimo_visto = None        # máximo de `visto`: si es viejo, nadie está presente
+
+    def _fila(self, telefono: str) -> dict:
+        return self._asesores.setdefault(telefono, {"visto": None, "ewma_s": None, "n": 0, "timeouts": 0})
+
+    def _marcar_visto(self, fila: dict, cuando: datetime):
+        if fila["visto"] is None or cuando > fila["visto"]:
+            fila["visto"] = cuando
+        if self._ultimo_visto is None or cuando > self._ultimo_visto:
+            self._ultimo_visto = cuando
+
+    def visto(self, telefono: str, cuando: datetime | None = None):
+        with self._lock:
+            self._marcar_visto(self._fila(telefono), cuando or datetime.utcnow())
+            self._sucios.add(telefono)
+
+    def respuesta(self, telefono: str, segundos: float, cuando: datetime | None = None):
+        """El asesor respondió (sí o no) `segundos` después de la pregunta."""
+        with self._lock:
+            fila = self._fila(telefono)
+            fila["ewma_s"] = segundos if fila["ewma_s"] is None else ALFA * segundos + (1 - ALFA) * fila["ewma_s"]
+            fila["n"] += 1
+            fila["timeouts"] = 0
+            self._marcar_visto(fila, cuando or datetime.utcnow())
+            self._sucios.add(telefono)
+
+    def timeout(self, telefono: str):
+        with self._lock:
+            self._fila(telefono)["timeouts"] += 1
+            self._sucios.add(telefono)
+
+    def filtro_ausentes(self, ahora: datetime | None = None):
+        """Predicado teléfono -> ausente con el corte fijo; None si nadie está presente."""
+        corte = (ahora or datetime.utcnow()) - VENTANA_PRESENTE
+        if self._ultimo_visto is None or self._ultimo_visto < corte:
+            return None
+        asesores = self._asesores
+
+        def ausente(telefono) -> bool:
+            fila = asesores.get(telefono)
+            return fila is None or fila["visto"] is None or fila["visto"] < corte or fila["timeouts"] >= TIMEOUTS_AUSENTE
+        return ausente
+
+    def tiempo_respuesta(self, telefono: str, ahora: datetime | None = None) -> float:
+        """Segundos de espera para la pregunta de disponibilidad a este asesor."""
+        ausente = self.filtro_ausentes(ahora)
+        if ausente is None:
+            return self.maximo              # sin datos de presencia: la espera de siempre
+        if ausente(telefono):
+            return MINIMO
+        ewma = self._asesores[telefono]["ewma_s"]
+        return self.maximo if ewma is None else min(max(FACTOR * ewma, MINIMO), self.maximo)
+
+    def ranking(self, ahora: datetime | None = None) -> list:
+        """Asesores presentes primero, después por tiempo típico de respuesta."""
+        ahora = ahora or datetime.utcnow()
+        ausente = self.filtro_ausentes(ahora) or (lambda telefono: True)
+        with self._lock:
+            filas = [(t, dict(f)) for t, f in self._asesores.items()]
+        filas.sort(key=lambda x: (ausente(x[0]), x[1]["ewma_s"] if x[1]["ewma_s"] is not None else float("inf")))
+        return [{"telefono": t, "presente": not ausente(t), "visto": f["visto"],
+                 "ewma_s": round(f["ewma_s"], 1) if f["ewma_s"] is not None else None,
+                 "respuestas": f["n"], "timeouts_seguidos": f["timeouts"],
+                 "espera_s": self.tiempo_respuesta(t, ahora)} for t, f in filas]
+
+    def sincronizar(self):
+        """Guarda lo que cambió desde la última vez y recoge lo que guardaron otros workers."""
+        with self._lock:
+            sucios, self._sucios = self._sucios, set()
+            ops = []
+            for t in sucios:
+                fila = self._asesores[t]
+                cambios = {"$set": {"ewma_s": fila["ewma_s"], "n": fila["n"], "timeouts": fila["timeouts"]}}
+                if fila["visto"] is not None:
+                    cambios["$max"] = {"visto": fila["visto"]}
+                ops.append(UpdateOne({"_id": t}, cambios, upsert=True))
+        try:
+            if ops:
+                self.col.bulk_write(ops, ordered=False)
+            docs = list(self.col.find({}))
+        except Exception as e:
+            logger.error(f"Error al sincronizar la presencia de asesores: {str(e)}")
+            with self._lock:
+                self._sucios |= sucios
+            return
+        with self._lock:
+            for doc in docs:
+                if doc["_id"] in self._sucios:
+                    continue                # cambió mientras se escribía: se guarda en la próxima vuelta
+                fila = self._fila(doc["_id"])
+                if doc.get("visto"):
+                    self._marcar_visto(fila, doc["visto"])
+                # El que tiene más respuestas medidas trae el promedio más informado
+                if doc.get("n", 0) > fila["n"]:
+                    fila["ewma_s"], fila["n"] = doc.get("ewma_s"), doc["n"]
+                fila["timeouts"] = doc.get("timeouts", fila["timeouts"])
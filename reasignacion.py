@@ -0,0 +1,147 @@
+"""Reasignación de asignaciones sin respuesta, una sola vez por asignación.
+
+`reasignar_pendientes` corría cada minuto, leía todas las asignaciones con
+`respuesta: None` de más de cinco minutos y llamaba a `asignar_asesor_humano` por
+cada una sin marcarla, así que los mismos leads se reprocesaban en cada vuelta
+(y cada vuelta insertaba otra asignación pendiente).
+
+`Reasignador` hace por vuelta (tick):
+1. Busca hasta `lote` vencidas con el índice (respuesta, fecha).
+2. Las reclama con un solo `update_many` condicionado a `respuesta: None`, que
+   las pasa a "sin_respuesta" con el id del tick: cada documento cambia de estado
+   una sola vez aunque corran varios procesos.
+3. Reasigna una vez por cliente lo que quedó marcado con su tick.
+
+El hilo no despierta cada minuto: duerme hasta que vence la pendiente más
+antigua (o INTERVALO_MAXIMO) y `registrar`/`notificar` lo despiertan al crear una.
+Si el proceso cae entre el paso 2 y el 3, esas asignaciones quedan marcadas sin
+reasignar (a lo sumo una vez, nunca en bucle); se ven con {"tick": {"$exists": true}}.
+
+Con `lider` (liderazgo.Liderazgo) solo el proceso líder ejecuta ticks; los demás
+duermen INTERVALO_MAXIMO y vuelven a revisar. Con `liberar` (p. ej.
+MotorAsignacion.liberar) se devuelve el cupo del asesor de cada asignación vencida.
+"""
+from datetime import datetime, timedelta
+from pymongo import ASCENDING
+from bson import ObjectId
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# ------------------ CONFIG ------------------
+ESPERA = timedelta(minutes=float(os.getenv("REASIGNACION_MINUTOS", "5")))
+LOTE = int(os.getenv("REASIGNACION_LOTE", "500"))
+INTERVALO_MAXIMO = 60.0                   # segundos; cota de sueño si no hay pendientes
+RESPUESTA_VENCIDA = "sin_respuesta"
+
+
+def asegurar_indices_reasignacion(col):
+    try:
+        col.create_index([("respuesta", ASCENDING), ("fecha", ASCENDING)], name="respuesta_fecha")
+        col.create_index([("tick", ASCENDING)], name="tick", sparse=True)
+    except Exception as e:
+        logger.error(f"Error al crear índices de asignaciones: {str(e)}")
+
+
+class Reasignador:
+    def __init__(self, col, reasignar, espera: timedelta = ESPERA, lote: int = LOTE,
+                 reloj=datetime.now, intervalo_maximo: float = INTERVALO_MAXIMO, lider=None, liberar=None):
+        self.col = col
+        self.reasignar = reasignar
+        self.espera = espera
+        self.lote = lote
+        self.reloj = reloj                  # los servidores guardan `fecha` con datetime.now()
+        self.intervalo_maximo = intervalo_maximo
+        self.lider = lider
+        self.liberar = liberar
+        self._despertar = threading.Event()
+        self._detener = threading.Event()
+        self._hilo = None
+        self.ultimo = None
+        self.totales = {"ticks": 0, "reclamadas": 0, "clientes": 0, "errores": 0}
+        asegurar_indices_reasignacion(col)
+
+    def registrar(self, cliente_id: str, asesor_phone: str, **extra):
+        """Inserta una asignación pendiente y despierta al hilo para que recalcule su espera."""
+        resultado = self.col.insert_one({"cliente_id": cliente_id, "asesor_phone": asesor_phone,
+                                         "respuesta": None, "fecha": self.reloj(), **extra})
+        self.notificar()
+        return resultado
+
+    def notificar(self):
+        self._despertar.set()
+
+    def tick(self) -> dict:
+        inicio = time.perf_counter()
+        ahora = self.reloj()
+        tick_id = ObjectId()
+        ids = [d["_id"] for d in self.col.find({"respuesta": None, "fecha": {"$lt": ahora - self.espera}}, {"_id": 1})
+               .sort("fecha", ASCENDING).limit(self.lote)]
+        reclamadas = []
+        if ids:
+            self.col.update_many(
+                {"_id": {"$in": ids}, "respuesta": None},
+                {"$set": {"respuesta": RESPUESTA_VENCIDA, "tick": tick_id, "fecha_reasignacion": ahora}}
+            )
+            reclamadas = list(self.col.find({"tick": tick_id}, {"cliente_id": 1, "asesor_phone": 1}))
+        if self.liberar is not None:
+            for doc in reclamadas:
+                if doc.get("asesor_phone"):
+                    self.liberar(doc["asesor_phone"])
+        # Varias pendientes del mismo cliente se reasignan una sola vez
+        clientes = list(dict.fromkeys(d["cliente_id"] for d in reclamadas if d.get("cliente_id")))
+        errores = 0
+        for cliente_id in clientes:
+            try:
+                self.reasignar(cliente_id)
+            except Exception as e:
+                errores += 1
+                logger.error(f"Error reasignando {cliente_id}: {str(e)}")
+        resumen = {"tick": str(tick_id), "candidatas": len(ids), "reclamadas": len(reclamadas),
+                   "clientes": len(clientes), "errores": errores, "ms": round((time.perf_counter() - inicio) * 1000, 1)}
+        self.ultimo = resumen
+        self.totales["ticks"] += 1
+        for campo in ("reclamadas", "clientes", "errores"):
+            self.totales[campo] += resumen[campo]
+        if ids:
+            logger.info(f"Reasignación: {resumen['reclamadas']} asignaciones vencidas, {resumen['clientes']} clientes "
+                        f"reasignados, {errores} errores en {resumen['ms']} ms")
+        return resumen
+
+    def _proxima_espera(self) -> float:
+        doc = self.col.find_one({"respuesta": None, "fecha": {"$type": "date"}}, {"fecha": 1},
+                                sort=[("fecha", ASCENDING)])
+        if not doc:
+            return self.intervalo_maximo
+        segundos = (doc["fecha"] + self.espera - self.reloj()).total_seconds()
+        return min(max(segundos, 0.0), self.intervalo_maximo)
+
+    def _ciclo(self):
+        while not self._detener.is_set():
+            if self.lider is not None and not self.lider.es_lider:
+                self._despertar.wait(self.intervalo_maximo)
+                self._despertar.clear()
+                continue
+            try:
+                resumen = self.tick()
+                # Lote lleno: quedan más vencidas, se sigue sin dormir
+                espera = 0.0 if resumen["candidatas"] >= self.lote else self._proxima_espera()
+            except Exception as e:
+                logger.error(f"Error en la reasignación de pendientes: {str(e)}")
+                espera = self.intervalo_maximo
+            self._despertar.wait(espera)
+            self._despertar.clear()
+
+    def iniciar(self):
+        if self._hilo and self._hilo.is_alive():
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._ciclo, name="reasignador", daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        self._detener.set()
+        self._despertar.set()
@@ -0,0 +1,75 @@
+from datetime import datetime
+
+# ------------------ RESUMEN INCREMENTAL ------------------
+# Registro por cliente que se actualiza con cada turno en O(1), en lugar de
+# reconstruirse desde el historial completo como hacía resumir_historial_emociones.
+TURNOS_RESUMEN = 5
+CAMPOS_ESTADO = ["nombre", "tipo_auto", "tipo_vehiculo", "modelo", "confirmado"]
+
+
+def resumen_vacio() -> dict:
+    return {
+        "mensajes_usuario": 0,
+        "mensajes_asistente": 0,
+        "emociones": {},
+        "ultima_emocion": None,
+        "turnos": [],
+        "estado": "",
+        "memoria": "",
+        "actualizado": None
+    }
+
+
+def incorporar_turno(resumen: dict, role: str, mensaje: str, max_turnos: int = TURNOS_RESUMEN):
+    if role == "user":
+        resumen["mensajes_usuario"] += 1
+    else:
+        resumen["mensajes_asistente"] += 1
+    resumen["turnos"].append({"role": role, "mensaje": mensaje})
+    del resumen["turnos"][:-max_turnos]
+    resumen["actualizado"] = datetime.now()
+
+
+def incorporar_emocion(resumen: dict, emocion: str):
+    resumen["emociones"][emocion] = resumen["emociones"].get(emocion, 0) + 1
+    resumen["ultima_emocion"] = emocion
+
+
+def operacion_turno(role: str, mensaje: str, prefijo: str = "resumen", max_turnos: int = TURNOS_RESUMEN) -> dict:
+    """Update de Mongo equivalente a `incorporar_turno`, para aplicarlo sin leer el documento."""
+    contador = "mensajes_usuario" if role == "user" else "mensajes_asistente"
+    return {
+        "$inc": {f"{prefijo}.{contador}": 1},
+        "$push": {f"{prefijo}.turnos": {"$each": [{"role": role, "mensaje": mensaje}], "$slice": -max_turnos}},
+        "$set": {f"{prefijo}.actualizado": datetime.now()}
+    }
+
+
+def refrescar_contexto(resumen: dict, estado: dict, memoria: dict):
+    """Recalcula las líneas de estado y memoria; ambos documentos tienen tamaño acotado."""
+    resumen["estado"] = ", ".join([f"{k}: {v}" for k, v in estado.items() if k in CAMPOS_ESTADO])
+    resumen["memoria"] = ", ".join([f"{k}: {v}" for k, v in memoria.items() if k != "emociones"])
+
+
+def resumen_para_prompt(resumen: dict) -> str:
+    """Texto con el mismo formato que resumir_historial_emociones."""
+    lineas = [
+        f"{'Usuario' if t['role'] == 'user' else 'Asistente'}: {t['mensaje']}"
+        for t in resumen["turnos"]
+    ]
+    lineas.append(f"[Resumen de estado: {resumen['estado']}]")
+    lineas.append(f"[Memoria del cliente: {resumen['memoria']}]")
+    lineas.append(f"[Emociones detectadas: {', '.join(resumen['emociones'])}]")
+    return "\n".join(lineas)
+
+
+def resumen_para_chat(resumen: dict) -> list:
+    """Mensajes para ollama.chat: contexto resumido más los últimos turnos."""
+    contexto = (
+        f"Resumen de la conversación. Estado: {resumen['estado'] or 'sin datos'}. "
+        f"Memoria: {resumen['memoria'] or 'sin datos'}. "
+        f"Mensajes previos: {resumen['mensajes_usuario']} del cliente, {resumen['mensajes_asistente']} del asistente."
+    )
+    return [{"role": "system", "content": contexto}] + [
+        {"role": t["role"], "content": t["mensaje"]} for t in resumen["turnos"]
+    ]
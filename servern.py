@@ -10,6 +10,12 @@ from bs4 import BeautifulSoup
 import uvicorn
 import random
 
+from historial import ultimos_mensajes, asegurar_indices_historial, MENSAJES_PROMPT
+from reasignacion import Reasignador
+from liderazgo import Liderazgo
+from padron_asesores import PadronAsesores, normalizar_telefono
+from asignacion import MotorAsignacion
+
 app = FastAPI()
 
 # ------------------------------
@@ -30,6 +36,7 @@ asignaciones = db["asignaciones"]
 asesores_col = db["asesores"]
 sends = db["sends"]
 memoria_col = db["memoria_clientes"]  # Memoria avanzada
+asegurar_indices_historial(historial_col)
 
 # ------------------------------
 # Initialize asesores collection
@@ -62,16 +69,18 @@ except Exception as e:
     print(f"Error starting scheduler: {str(e)}")
     raise
 
-def reasignar_pendientes():
-    try:
-        limite = datetime.now() - timedelta(minutes=5)
-        pendientes = asignaciones.find({"respuesta": None, "fecha": {"$lt": limite}})
-        for p in pendientes:
-            asignar_asesor_humano(p["cliente_id"])
-    except Exception as e:
-        print(f"Error reasignando pendientes: {str(e)}")
+# Asesores activos en memoria y motor de asignación (ASIGNACION_ESTRATEGIA).
+# Este servidor no cierra los leads aceptados, así que el cupo por asesor no se limita
+padron = PadronAsesores(asesores_col)
+padron.escuchar_cambios()
+motor_asignacion = MotorAsignacion(padron, capacidad=0)
 
-scheduler.add_job(reasignar_pendientes, 'interval', minutes=1)
+# Reasignación de pendientes vencidas, una sola vez por asignación (ver reasignacion.py)
+# Un solo proceso (el líder) reasigna aunque uvicorn corra con varios workers
+lider = Liderazgo(db)
+reasignador = Reasignador(asignaciones, lambda cliente_id: asignar_asesor_humano(cliente_id), lider=lider,
+                          liberar=motor_asignacion.liberar)
+lider.al_ganar(reasignador.notificar)
 
 # ------------------------------
 # Models
@@ -272,13 +281,16 @@ def asignar_asesor_humano(cliente_id: str):
             return
 
         # Obtener asesores activos
-        asesores = list(asesores_col.find({"activo": True}, {"telefono": 1, "_id": 0}))
-        if not asesores:
+        # Los que ya se consultaron (rechazaron o no respondieron) no se vuelven a preguntar
+        # Ronda completa sin respuesta: se vuelve a empezar en lugar de quedarse sin asesor
+        elegido, consultados = motor_asignacion.elegir_en_ronda(estado.get("asesores_consultados", []),
+                                                               tipo_auto=estado.get("tipo_auto"))
+        if not elegido:
             print("No hay asesores disponibles")
             return
 
-        # Seleccionar primer asesor disponible
-        asesor = asesores[0]["telefono"]
+        asesor = elegido["telefono"]
+        actualizar_estado(cliente_id, {"asesores_consultados": consultados})
 
         # Crear mensaje humano para el asesor
         mensaje_asesor = (
@@ -296,12 +308,7 @@ def asignar_asesor_humano(cliente_id: str):
         })
 
         # Registrar asignación pendiente
-        asignaciones.insert_one({
-            "cliente_id": cliente_id,
-            "asesor_phone": asesor,
-            "respuesta": None,
-            "fecha": datetime.now()
-        })
+        reasignador.registrar(cliente_id, asesor)
 
         # Enviar mensaje humano al cliente confirmando que un asesor lo contactará pronto
         mensaje_cliente = (
@@ -347,7 +354,7 @@ async def webhook(mensaje: Mensaje):
                     actualizar_estado(cliente_id, {"modelo": model.title()})
                     break
 
-        historial = list(historial_col.find({"cliente_id": cliente_id}))
+        historial = ultimos_mensajes(historial_col, cliente_id, MENSAJES_PROMPT)
         historial_texto = [{"role": h["role"], "mensaje": h["mensaje"]} for h in historial]
 
         if "confirmado" not in estado:
@@ -375,10 +382,15 @@ async def advisor_response(response: AdvisorResponse):
         cliente_id = response.cliente_id
         respuesta = response.respuesta
         asesor_phone = response.asesor_phone
-        asignaciones.update_one(
-            {"cliente_id": cliente_id, "asesor_phone": asesor_phone},
-            {"$set": {"respuesta": respuesta, "fecha_respuesta": datetime.now()}}
+        # Solo la pendiente más reciente: una ya vencida la reasignó el Reasignador
+        asignacion = asignaciones.find_one_and_update(
+            {"cliente_id": cliente_id, "asesor_phone": normalizar_telefono(asesor_phone), "respuesta": None},
+            {"$set": {"respuesta": respuesta, "fecha_respuesta": datetime.now()}},
+            sort=[("fecha", -1)]
         )
+        if not asignacion:
+            print(f"Sin asignación pendiente de {asesor_phone} para {cliente_id}")
+            return {"status": "ignored"}
         estado = obtener_estado(cliente_id)
         if respuesta.lower() == "yes":
             mensaje = (
@@ -396,6 +408,7 @@ async def advisor_response(response: AdvisorResponse):
                 "sent": False
             })
         elif respuesta.lower() == "no":
+            motor_asignacion.liberar(normalizar_telefono(asesor_phone))
             asignar_asesor_humano(cliente_id)
         return {"status": "success"}
     except Exception as e:
@@ -414,6 +427,12 @@ def get_asesores():
         print(f"Error in /get_asesores: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
 
+# El hilo arranca cuando el módulo ya definió asignar_asesor_humano
+@app.on_event("startup")
+def iniciar_reasignador():
+    lider.iniciar()
+    reasignador.iniciar()
+
 # ------------------------------
 # Run server
 # ------------------------------
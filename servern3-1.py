@@ -12,6 +12,12 @@ import random
 import logging
 import json
 
+from historial import ultimos_mensajes, asegurar_indices_historial, MENSAJES_PROMPT
+from reasignacion import Reasignador
+from liderazgo import Liderazgo
+from padron_asesores import PadronAsesores, normalizar_telefono
+from asignacion import MotorAsignacion
+
 # =========================
 # Configuración / Logging
 # =========================
@@ -41,6 +47,7 @@ asesores_col = db["asesores"]
 sends = db["sends"]
 memoria_col = db["memoria_clientes"]
 cache_col = db["cache_sitio"]  # para cachear modelos
+asegurar_indices_historial(historial_col)
 
 # =========================
 # Datos / Inicialización
@@ -68,22 +75,25 @@ def inicializar_asesores():
 
 inicializar_asesores()
 
+# Asesores activos en memoria y motor de asignación (ASIGNACION_ESTRATEGIA).
+# Este servidor no cierra los leads aceptados, así que el cupo por asesor no se limita
+padron = PadronAsesores(asesores_col)
+padron.escuchar_cambios()
+motor_asignacion = MotorAsignacion(padron, capacidad=0)
+
 # =========================
 # Scheduler
 # =========================
 scheduler = BackgroundScheduler()
-def reasignar_pendientes():
-    try:
-        limite = datetime.now() - timedelta(minutes=5)
-        pendientes = asignaciones.find({"respuesta": None, "fecha": {"$lt": limite}})
-        for p in pendientes:
-            asignar_asesor_humano(p["cliente_id"])
-    except Exception as e:
-        logger.error(f"Error al reasignar pendientes: {str(e)}")
+# Reasignación de pendientes vencidas, una sola vez por asignación (ver reasignacion.py)
+# Un solo proceso (el líder) reasigna aunque uvicorn corra con varios workers
+lider = Liderazgo(db)
+reasignador = Reasignador(asignaciones, lambda cliente_id: asignar_asesor_humano(cliente_id), lider=lider,
+                          liberar=motor_asignacion.liberar)
+lider.al_ganar(reasignador.notificar)
 
 try:
     scheduler.start()
-    scheduler.add_job(reasignar_pendientes, 'interval', minutes=1)
     logger.info("Scheduler iniciado")
 except Exception as e:
     logger.error(f"Error al iniciar scheduler: {str(e)}")
@@ -638,12 +648,16 @@ def asignar_asesor_humano(cliente_id: str):
             logger.warning(f"Datos incompletos para asignar asesor a {cliente_id}: {estado}")
             return
 
-        asesores = list(asesores_col.find({"activo": True}, {"telefono": 1, "_id": 0}))
-        if not asesores:
+        # Los que ya se consultaron (rechazaron o no respondieron) no se vuelven a preguntar
+        # Ronda completa sin respuesta: se vuelve a empezar en lugar de quedarse sin asesor
+        elegido, consultados = motor_asignacion.elegir_en_ronda(estado.get("asesores_consultados", []),
+                                                               tipo_auto=estado.get("tipo_auto"))
+        if not elegido:
             logger.warning("No hay asesores disponibles")
             return
 
-        asesor = asesores[0]["telefono"]
+        asesor = elegido["telefono"]
+        actualizar_estado(cliente_id, {"asesores_consultados": consultados})
         mensaje_asesor = (
             f"Hola 👋 {asesor},\n"
             f"Nuevo cliente: {estado['nombre']}.\n"
@@ -664,12 +678,7 @@ def asignar_asesor_humano(cliente_id: str):
             "sent": False
         })
 
-        asignaciones.insert_one({
-            "cliente_id": cliente_id,
-            "asesor_phone": asesor,
-            "respuesta": None,
-            "fecha": datetime.now()
-        })
+        reasignador.registrar(cliente_id, asesor)
 
         # Mensaje para el cliente
         sends.insert_one({
@@ -748,7 +757,7 @@ async def webhook(mensaje: Mensaje):
                 estado.pop("confirmado", None)
 
         # Historial para LLM / contexto
-        historial = list(historial_col.find({"cliente_id": cliente_id}))
+        historial = ultimos_mensajes(historial_col, cliente_id, MENSAJES_PROMPT)
         historial_texto = [{"role": h["role"], "mensaje": h["mensaje"]} for h in historial]
 
         result = generar_respuesta_premium(texto, historial_texto, {**estado, "cliente_id": cliente_id})
@@ -779,10 +788,15 @@ async def advisor_response(response: AdvisorResponse):
         cliente_id = response.cliente_id
         respuesta = response.respuesta.lower()
         asesor_phone = response.asesor_phone
-        asignaciones.update_one(
-            {"cliente_id": cliente_id, "asesor_phone": asesor_phone},
-            {"$set": {"respuesta": respuesta, "fecha_respuesta": datetime.now()}}
+        # Solo la pendiente más reciente: una ya vencida la reasignó el Reasignador
+        asignacion = asignaciones.find_one_and_update(
+            {"cliente_id": cliente_id, "asesor_phone": normalizar_telefono(asesor_phone), "respuesta": None},
+            {"$set": {"respuesta": respuesta, "fecha_respuesta": datetime.now()}},
+            sort=[("fecha", -1)]
         )
+        if not asignacion:
+            logger.warning(f"Sin asignación pendiente de {asesor_phone} para {cliente_id}")
+            return {"status": "ignored"}
         estado = obtener_estado(cliente_id)
         if respuesta in ["yes", "sí", "si"]:
             mensaje = (
@@ -793,6 +807,7 @@ async def advisor_response(response: AdvisorResponse):
             sends.insert_one({"jid": f"{asesor_phone}@s.whatsapp.net", "message": {"text": mensaje}, "sent": False})
             sends.insert_one({"jid": cliente_id, "message": {"text": f"Hola, {estado.get('nombre','')}. Un asesor te contactará pronto."}, "sent": False})
         elif respuesta == "no":
+            motor_asignacion.liberar(normalizar_telefono(asesor_phone))
             asignar_asesor_humano(cliente_id)
         logger.info(f"advisor_response procesada para {cliente_id}: {respuesta}")
         return {"status": "success"}
@@ -809,6 +824,12 @@ def get_asesores():
         logger.error(f"Error en /get_asesores: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error del servidor: {str(e)}")
 
+# El hilo arranca cuando el módulo ya definió asignar_asesor_humano
+@app.on_event("startup")
+def iniciar_reasignador():
+    lider.iniciar()
+    reasignador.iniciar()
+
 # =========================
 # Main
 # =========================
@@ -1,24 +1,38 @@
 from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from pydantic import BaseModel, conint
 from pymongo import MongoClient
 from datetime import datetime, timedelta
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.jobstores.mongodb import MongoDBJobStore
 from apscheduler.schedulers.background import BackgroundScheduler
 import random
 import requests
 import logging
 import ollama
 import asyncio
+import time
 from ollama import GenerateResponse
 from Levenshtein import distance as levenshtein_distance
 import re
 from bson import ObjectId
 
+from bitacora import BitacoraBuffer
+from bitacora_serie import coleccion_bitacora
+from metricas_asesores import MetricasAsesores
+from outbox import encolar, asegurar_indices_outbox, resumen_outbox
+from padron_asesores import PadronAsesores, guardar_asesor, jid_asesor, normalizar_telefono
+from asignacion import MotorAsignacion, cargas_abiertas, AREA_POR_DEFECTO
+from temporizador import Temporizador, asegurar_indice_vencimiento
+from cola_leads import ColaLeads
+from liderazgo import Liderazgo
+from presencia import Presencia
+from turnos import Turnos, guardar_turnos
+from botones import botones_disponibilidad, cargar_secreto, leer_boton, leer_legado
+from log_estructurado import configurar_logging, log_evento, Perezoso
+
 # ------------------------------
 # Configuración básica
 # ------------------------------
-logging.basicConfig(level=logging.INFO)
+configurar_logging()
 logger = logging.getLogger(__name__)
 
 app = FastAPI()
@@ -42,16 +56,56 @@ asesores_col = db["asesores"]
 sends_col = db["sends"]
 assignments_col = db["assignments"]
 
-# Configuración del scheduler con MongoDBJobStore
-scheduler = AsyncIOScheduler({
-    'jobstores': {
-        'default': MongoDBJobStore(database='chatbot_db', collection='scheduler_jobs', client=client)
-    }
-})
+asegurar_indices_outbox(sends_col)
+
+# Asesores activos en memoria; se recargan al cambiar la colección o su sello de versión
+padron = PadronAsesores(asesores_col)
+# Estrategia según ASIGNACION_ESTRATEGIA (round_robin | menos_cargado | area)
+# Última actividad y tiempo de respuesta de cada asesor: primero los presentes, espera adaptativa
+presencia = Presencia(db)
+# Calendario semanal + excepciones: fuera de turno no se les pregunta
+turnos = Turnos(db)
+motor_asignacion = MotorAsignacion(padron, presencia=presencia, turnos=turnos)
+# Leads que esperan cupo de un asesor (persistente: sobrevive reinicios)
+cola_leads = ColaLeads(db)
+despachando_cola = False
+epoca_cola = None           # época de liderazgo con la que se cargó la cola en memoria
+
+# Bitácora con escritura por lotes en segundo plano (serie de tiempo salvo BITACORA_ALMACEN=documento)
+metricas_asesores = MetricasAsesores(db)
+# Los eventos que la base rechaza siempre (validación, reintentos agotados) van a bitacora_descartes
+bitacora = BitacoraBuffer(coleccion_bitacora(db), observadores=[metricas_asesores], descartes=db["bitacora_descartes"])
+bitacora.iniciar()
+
+# Timeouts de disponibilidad: montículo en memoria respaldado por assignments.deadline
+temporizador = Temporizador()
+asegurar_indice_vencimiento(assignments_col)
+try:
+    # Respuestas que aún llegan sin id de asignación (/advisor_response y botones yes_{cliente})
+    assignments_col.create_index([("client_id", 1), ("advisor_phone", 1), ("status", 1)], name="cliente_asesor_estado")
+    # Barrido periódico de pendientes vencidas
+    assignments_col.create_index([("status", 1), ("sent_time", 1)], name="status_sent_time")
+    assignments_col.create_index([("barrido", 1)], name="barrido", sparse=True)
+except Exception as e:
+    logger.error(f"Error al crear índice de asignaciones: {e}", exc_info=True)
+
+# Botones de disponibilidad con el id de la asignación firmado (ver botones.py)
+secreto_botones = cargar_secreto(db)
+
+# Scheduler en memoria en cada proceso; los trabajos únicos solo corren en el líder.
+# (Con MongoDBJobStore compartido los workers se pisaban los trabajos: cada uno los
+# reemplazaba al arrancar y cualquiera podía ejecutarlos.)
+scheduler = AsyncIOScheduler()
+lider = Liderazgo(db)
 
 BOT_NOMBRE = "Alex"
 AGENCIA = "Volkswagen Eurocity Culiacán"
 TIEMPO_RESPUESTA_EJECUTIVO = 300  # 5 minutos
+VENTANA_CARGA = timedelta(hours=8)  # asignaciones aceptadas que siguen contando como carga del asesor
+MARGEN_BARRIDO = timedelta(minutes=1)  # gracia para que el temporizador cierre antes que el barrido
+LOTE_BARRIDO = 500
+LEADS_POR_DESPACHO = 20  # máximo de leads de la cola que se intentan por cada liberación de cupo
+TRABAJOS_LEGADOS = ["refresh_car_cache", "resync_advisor_load", "dispatch_lead_queue"]  # ids en scheduler_jobs
 MODELOS_RESPALDO = [
     "Polo", "Saveiro", "Teramont", "Amarok Panamericana", "Transporter 6.1",
     "Nivus", "Taos", "T-Cross", "Virtus", "Jetta", "Tiguan", "Jetta GLI",
@@ -72,6 +126,39 @@ class AdvisorResponse(BaseModel):
     respuesta: str
     asesor_phone: str
 
+class GatewayCallback(BaseModel):
+    button_id: str
+    jid: str | None = None  # remitente, si el gateway lo reporta
+
+class TurnoSemanal(BaseModel):
+    dias: list[conint(ge=0, le=6)]       # 0 = lunes
+    inicio: str                          # "HH:MM", hora local
+    fin: str
+
+class ExcepcionTurno(BaseModel):
+    inicio: datetime                     # UTC (o con zona; se normaliza al guardar)
+    fin: datetime
+    disponible: bool = False
+
+class TurnosAsesor(BaseModel):
+    telefono: str
+    semanal: list[TurnoSemanal]
+    excepciones: list[ExcepcionTurno] | None = None
+
+class LatidoAsesor(BaseModel):
+    telefono: str
+
+class LeadCompletado(BaseModel):
+    cliente_id: str
+    asesor_phone: str
+
+class AsesorAdmin(BaseModel):
+    telefono: str
+    nombre: str = None
+    activo: bool = True
+    area: str = None
+    tipos: list[str] = None
+
 # ------------------------------
 # Funciones para autos
 # ------------------------------
@@ -109,7 +196,8 @@ def obtener_autos_nuevos(force_refresh=False):
     try:
         ahora = datetime.utcnow()
         cache = cache_col.find_one({"_id": "autos_nuevos"})
-        logger.info(f"Cache encontrado para autos_nuevos: {cache}")
+        log_evento(logger, "cache_consultado", logging.DEBUG, clave="autos_nuevos", encontrado=cache is not None,
+                   modelos=len(cache.get("data", [])) if cache else 0, ts=cache.get("ts") if cache else None)
         if cache and not force_refresh and (ahora - cache.get("ts", ahora) < timedelta(hours=3)):
             logger.info("Usando caché para autos nuevos")
             return cache.get("data", [])
@@ -133,7 +221,7 @@ def obtener_autos_nuevos(force_refresh=False):
             {"$set": {"data": modelos, "ts": ahora}},
             upsert=True
         )
-        logger.info(f"Autos nuevos obtenidos: {modelos}")
+        log_evento(logger, "autos_obtenidos", tipo="nuevos", total=len(modelos), modelos=modelos)
         return modelos
     except Exception as e:
         logger.error(f"Error al obtener autos nuevos: {e}", exc_info=True)
@@ -143,7 +231,8 @@ def obtener_autos_usados(force_refresh=False):
     try:
         ahora = datetime.utcnow()
         cache = cache_col.find_one({"_id": "autos_usados"})
-        logger.info(f"Cache encontrado para autos_usados: {cache}")
+        log_evento(logger, "cache_consultado", logging.DEBUG, clave="autos_usados", encontrado=cache is not None,
+                   modelos=len(cache.get("data", [])) if cache else 0, ts=cache.get("ts") if cache else None)
         if cache and not force_refresh and (ahora - cache.get("ts", ahora) < timedelta(hours=3)):
             logger.info("Usando caché para autos usados")
             return cache.get("data", [])
@@ -179,7 +268,7 @@ def obtener_autos_usados(force_refresh=False):
             {"$set": {"data": modelos, "ts": ahora}},
             upsert=True
         )
-        logger.info(f"Autos usados obtenidos: {modelos}")
+        log_evento(logger, "autos_obtenidos", tipo="usados", total=len(modelos), modelos=modelos)
         return modelos
     except Exception as e:
         logger.error(f"Error al obtener autos usados: {e}", exc_info=True)
@@ -191,7 +280,7 @@ def obtener_autos_usados(force_refresh=False):
 def obtener_sesion(cliente_id):
     try:
         sesion = sesiones_col.find_one({"cliente_id": cliente_id}) or {}
-        logger.info(f"Sesión recuperada para {cliente_id}: {sesion}")
+        log_evento(logger, "sesion_recuperada", logging.DEBUG, cliente_id=cliente_id, sesion=sesion)
         return sesion
     except Exception as e:
         logger.error(f"Error al obtener sesión para {cliente_id}: {e}", exc_info=True)
@@ -202,7 +291,8 @@ def guardar_sesion(cliente_id, sesion):
         sesion["cliente_id"] = cliente_id
         sesion["ts"] = datetime.utcnow()
         result = sesiones_col.update_one({"cliente_id": cliente_id}, {"$set": sesion}, upsert=True)
-        logger.info(f"Sesión guardada para {cliente_id}: {result.modified_count} modificados, {result.upserted_id} upserted")
+        log_evento(logger, "sesion_guardada", logging.DEBUG, cliente_id=cliente_id,
+                   modificados=result.modified_count, upserted=result.upserted_id)
     except Exception as e:
         logger.error(f"Error al guardar sesión para {cliente_id}: {e}", exc_info=True)
         raise
@@ -210,38 +300,89 @@ def guardar_sesion(cliente_id, sesion):
 def guardar_bitacora(registro):
     try:
         registro["fecha_completa"] = datetime.utcnow()
-        bitacora_col.insert_one(registro)
-        logger.info(f"Bitácora guardada: {registro}")
+        bitacora.registrar(registro)
+        log_evento(logger, "bitacora_encolada", logging.DEBUG, event=registro.get("event"))
     except Exception as e:
         logger.error(f"Error al guardar bitácora: {e}", exc_info=True)
 
 # ------------------------------
 # Limpieza de asignaciones obsoletas
 # ------------------------------
-async def cleanup_stale_assignments(client_id):
+async def barrer_asignaciones_vencidas():
+    """Marca como timeout, por lotes y para todos los clientes, las pendientes que ya vencieron.
+
+    Red de seguridad del temporizador (p. ej. vencimientos de un proceso que cayó y
+    nadie recuperó): solo toca las que llevan TIEMPO_RESPUESTA_EJECUTIVO + MARGEN_BARRIDO
+    sin respuesta, así que check_timeout ya tuvo su oportunidad. Lo que marca aquí lo
+    reasigna igual que check_timeout.
+    """
+    inicio = time.perf_counter()
+    now = datetime.utcnow()
+    barrido = ObjectId()
+    limite = now - timedelta(seconds=TIEMPO_RESPUESTA_EJECUTIVO) - MARGEN_BARRIDO
+    marcadas = []
     try:
-        now = datetime.utcnow()
-        result = assignments_col.update_many(
-            {
-                "client_id": client_id,
-                "status": "pending_availability",
-                "sent_time": {"$lt": now - timedelta(minutes=TIEMPO_RESPUESTA_EJECUTIVO)}
-            },
-            {"$set": {"status": "timeout", "response_time": now}}
-        )
-        if result.modified_count > 0:
-            logger.info(f"Limpieza: {result.modified_count} asignaciones obsoletas marcadas como timeout para {client_id}")
+        while True:
+            # Índice (status, sent_time): solo se leen las vencidas, las más viejas primero
+            ids = [d["_id"] for d in assignments_col.find(
+                {"status": "pending_availability", "sent_time": {"$lt": limite}}, {"_id": 1}
+            ).sort("sent_time", 1).limit(LOTE_BARRIDO)]
+            if not ids:
+                break
+            assignments_col.update_many(
+                {"_id": {"$in": ids}, "status": "pending_availability"},
+                {"$set": {"status": "timeout", "response_time": now, "barrido": barrido}}
+            )
+            marcadas.extend(ids)
+            if len(ids) < LOTE_BARRIDO:
+                break
+        if not marcadas:
+            return
+        docs = list(assignments_col.find({"barrido": barrido},
+                                         {"client_id": 1, "advisor_phone": 1, "advisor_name": 1, "sent_time": 1}))
+        for doc in docs:
+            temporizador.cancelar(str(doc["_id"]))
+            presencia.timeout(doc["advisor_phone"])
+            # Mismo evento que check_timeout: las métricas por asesor cuentan también estos timeouts
             guardar_bitacora({
-                "event": "cleanup_stale_assignments",
-                "client_id": client_id,
-                "count": result.modified_count,
-                "time": now
+                "event": "advisor_timeout",
+                "client_id": doc["client_id"],
+                "advisor_phone": doc["advisor_phone"],
+                "advisor_name": doc.get("advisor_name"),
+                "timeout_time": now,
+                "original_ask_time": doc["sent_time"],
+                "assignment_id": str(doc["_id"]),
+                "barrido": True
             })
+        resincronizar_cargas()
+        # Como en check_timeout, el lead pasa al siguiente asesor (o a cola_leads si nadie tiene
+        # cupo), salvo que el cliente ya tenga otra asignación viva
+        clientes = list(dict.fromkeys(d["client_id"] for d in docs))
+        atendidos = set(assignments_col.distinct("client_id", {
+            "client_id": {"$in": clientes}, "status": {"$in": ["pending_availability", "accepted"]}
+        }))
+        reasignados = 0
+        for client_id in clientes:
+            if client_id not in atendidos:
+                await send_to_next_advisor(client_id)
+                reasignados += 1
+        await despachar_cola()
+        logger.info(f"Barrido: {len(docs)} asignaciones vencidas marcadas como timeout, {reasignados} clientes reasignados")
+        # Resumen del barrido, además del advisor_timeout de cada asignación
+        guardar_bitacora({
+            "event": "cleanup_stale_assignments",
+            "count": len(docs),
+            "clientes": len(clientes),
+            "reasignados": reasignados,
+            "mas_antigua_s": round((now - min(d["sent_time"] for d in docs)).total_seconds()) if docs else None,
+            "ms": round((time.perf_counter() - inicio) * 1000, 1),
+            "time": now
+        })
     except Exception as e:
-        logger.error(f"Error en cleanup_stale_assignments para {client_id}: {e}", exc_info=True)
+        logger.error(f"Error en el barrido de asignaciones vencidas: {e}", exc_info=True)
         guardar_bitacora({
             "event": "error_cleanup_assignments",
-            "client_id": client_id,
+            "count": len(marcadas),
             "error": str(e),
             "time": datetime.utcnow()
         })
@@ -249,32 +390,204 @@ async def cleanup_stale_assignments(client_id):
 # ------------------------------
 # Asignación de ejecutivos
 # ----------------------
+async def despachar_cola():
+    """Asigna leads en espera, por prioridad, mientras algún asesor tenga cupo (solo el líder)."""
+    global despachando_cola, epoca_cola
+    if despachando_cola or not lider.es_lider:
+        return
+    despachando_cola = True
+    devueltos = []
+    try:
+        if epoca_cola != lider.epoca:
+            # Recién ganó el liderazgo: su montículo no vio lo que despachó el líder anterior
+            cola_leads.cargar()
+            epoca_cola = lider.epoca
+        for _ in range(LEADS_POR_DESPACHO):
+            if not motor_asignacion.hay_cupo():
+                break
+            lead = cola_leads.tomar()
+            if lead is None:
+                break
+            # Sin asesor para este lead (p. ej. otra área): se prueba el siguiente
+            if not await send_to_next_advisor(lead["cliente_id"], desde_cola=True):
+                devueltos.append(lead)
+    except Exception as e:
+        logger.error(f"Error al despachar la cola de leads: {e}", exc_info=True)
+    finally:
+        for lead in devueltos:
+            cola_leads.devolver(lead)
+        despachando_cola = False
+
+async def despacho_periodico():
+    """Recoge leads encolados por otros workers y el cupo que liberaron."""
+    cola_leads.cargar()
+    resincronizar_cargas()
+    await despachar_cola()
+
+def refrescar_cache_autos():
+    obtener_autos_nuevos(force_refresh=True)
+    obtener_autos_usados(force_refresh=True)
+
+@app.post("/lead_completado")
+async def lead_completado(req: LeadCompletado):
+    """El asesor terminó de atender al cliente: libera su cupo para la cola."""
+    try:
+        now = datetime.utcnow()
+        asesor_phone = normalizar_telefono(req.asesor_phone)
+        assignment = assignments_col.find_one_and_update(
+            {"client_id": req.cliente_id, "advisor_phone": asesor_phone, "status": "accepted"},
+            {"$set": {"status": "completed", "completed_time": now}}
+        )
+        if not assignment:
+            raise HTTPException(status_code=404, detail="Asignación aceptada no encontrada")
+        motor_asignacion.liberar(asesor_phone)
+        guardar_bitacora({
+            "event": "lead_completed",
+            "client_id": req.cliente_id,
+            "advisor_phone": asesor_phone,
+            "assignment_id": str(assignment["_id"]),
+            "time": now
+        })
+        await despachar_cola()
+        return {"status": "completed"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error al completar lead {req.cliente_id}: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Error al completar lead")
+
+@app.put("/asesores/turnos")
+async def guardar_turnos_asesor(req: TurnosAsesor):
+    """Reemplaza el calendario de un asesor; los demás workers lo recogen en la próxima recarga."""
+    try:
+        telefono = guardar_turnos(turnos.col, req.telefono, [dict(t) for t in req.semanal],
+                                  None if req.excepciones is None else [dict(e) for e in req.excepciones])
+    except (KeyError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Turno inválido: {e}")
+    try:
+        turnos.cargar()
+        await despachar_cola()
+        return {"telefono": telefono, "en_turno": telefono in turnos.en_turno()}
+    except Exception as e:
+        logger.error(f"Error al recargar turnos tras guardar {telefono}: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Error al recargar turnos")
+
+@app.post("/asesores/latido")
+async def latido_asesor(req: LatidoAsesor):
+    """Señal de vida opcional (app del asesor o gateway al ver actividad)."""
+    presencia.visto(normalizar_telefono(req.telefono))
+    return {"status": "ok"}
+
+@app.get("/stats/presencia")
+async def stats_presencia():
+    """Asesores presentes primero, con su tiempo típico de respuesta y la espera que se les da."""
+    return presencia.ranking()
+
+@app.get("/stats/cola")
+async def stats_cola():
+    """Leads en espera de un asesor con cupo."""
+    try:
+        return cola_leads.resumen()
+    except Exception as e:
+        logger.error(f"Error al consultar la cola de leads: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Error al consultar la cola de leads")
+
+def resincronizar_cargas():
+    """Cargas del motor desde las asignaciones abiertas (corrige lo que otros procesos asignaron)."""
+    try:
+        motor_asignacion.fijar_cargas(cargas_abiertas(assignments_col, {
+            "status": {"$in": ["pending_availability", "accepted"]},
+            "sent_time": {"$gte": datetime.utcnow() - VENTANA_CARGA}
+        }, "advisor_phone"))
+    except Exception as e:
+        logger.error(f"Error al resincronizar cargas de asesores: {e}", exc_info=True)
+
+@app.get("/stats/advisors")
+async def stats_advisors(dia: str | None = None, granularidad: str = "dia", asesor: str | None = None):
+    """Métricas acumuladas por asesor (preguntas, aceptadas, rechazadas, timeouts, latencia)."""
+    if granularidad not in ("dia", "hora"):
+        raise HTTPException(status_code=400, detail="granularidad debe ser 'dia' u 'hora'")
+    dia = dia or datetime.utcnow().strftime("%Y-%m-%d")
+    try:
+        return {"dia": dia, "granularidad": granularidad, "asesores": metricas_asesores.consultar(dia, granularidad, asesor)}
+    except Exception as e:
+        logger.error(f"Error al consultar métricas de asesores: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Error al consultar métricas")
+
+@app.get("/stats/outbox")
+async def stats_outbox():
+    """Mensajes pendientes y espera en cola por carril de prioridad."""
+    try:
+        return resumen_outbox(sends_col)
+    except Exception as e:
+        logger.error(f"Error al consultar métricas del outbox: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Error al consultar métricas del outbox")
+
 @app.get("/get_asesores")
-async def get_asesores():
+async def get_asesores(en_turno: bool = False, area: str | None = None):
     try:
-        asesores = list(asesores_col.find({"activo": True}, {"telefono": 1, "nombre": 1, "_id": 0}))
-        for advisor in asesores:
-            if not advisor["telefono"].startswith("521"):
-                advisor["telefono"] = f"521{advisor['telefono']}"
-        return [{"telefono": a["telefono"], "nombre": a.get("nombre", "Asesor Desconocido")} for a in asesores if "telefono" in a]
+        if en_turno:
+            # Con calendario: solo los que están de turno; sin calendario: siempre
+            dentro = turnos.en_turno(area=area)
+            programados = turnos.programados
+            return [a for a in padron.activos()
+                    if (a["telefono"] in dentro or a["telefono"] not in programados)
+                    and (area is None or a.get("area", AREA_POR_DEFECTO) == area)]
+        return padron.activos()
     except Exception as e:
         logger.error(f"Error al obtener asesores: {e}", exc_info=True)
         return []
 
-async def send_to_next_advisor(client_id):
+@app.post("/asesores")
+async def guardar_asesor_admin(req: AsesorAdmin):
+    """Alta, baja o reactivación de un asesor; el padrón en memoria se recarga solo."""
+    try:
+        extra = {k: v for k, v in (("area", req.area), ("tipos", req.tipos)) if v}
+        telefono = guardar_asesor(asesores_col, req.telefono, req.nombre, req.activo, **extra)
+        padron.invalidar()
+        await despachar_cola()
+        return {"telefono": telefono, "activo": req.activo}
+    except Exception as e:
+        logger.error(f"Error al guardar asesor {req.telefono}: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Error al guardar asesor")
+
+def descartar_lead(client_id, motivo) -> bool:
+    """Saca de la cola un lead que ya no se puede (o no hace falta) despachar."""
+    if cola_leads.quitar(client_id):
+        log_evento(logger, "lead_descartado", logging.INFO, cliente_id=client_id, motivo=motivo)
+        guardar_bitacora({
+            "event": "lead_discarded",
+            "client_id": client_id,
+            "motivo": motivo,
+            "time": datetime.utcnow()
+        })
+    return True
+
+async def send_to_next_advisor(client_id, desde_cola=False):
+    """Pregunta al siguiente asesor con cupo; sin cupo, el lead queda en cola_leads.
+
+    `desde_cola`: lo llama despachar_cola; empieza una ronda nueva de asesores y, si
+    sigue sin haber cupo, el lead permanece en la cola sin avisar otra vez al cliente.
+    Devuelve True si el lead ya no debe seguir en la cola (asignado o descartado).
+    """
+    sesion = {}
     try:
-        # Limpiar asignaciones obsoletas antes de asignar
-        await cleanup_stale_assignments(client_id)
+        if desde_cola and assignments_col.find_one(
+                {"client_id": client_id, "status": {"$in": ["pending_availability", "accepted"]}}, {"_id": 1}):
+            # Ya lo atiende (o se le preguntó a) un asesor por otra vía
+            return descartar_lead(client_id, "ya_asignado")
         sesion = obtener_sesion(client_id)
-        logger.info(f"Sesión para {client_id}: {sesion}")
+        log_evento(logger, "sesion_asignacion", logging.DEBUG, cliente_id=client_id, sesion=sesion)
         if "nombre" not in sesion or "tipo_auto" not in sesion or "modelo" not in sesion:
-            logger.warning(f"Sesión incompleta para {client_id}: {sesion}")
-            sends_col.insert_one({
-                "jid": client_id,
-                "message": f"{sesion.get('nombre', 'Cliente')}, por favor proporciona toda la información necesaria.",
-                "sent": False,
-                "sent_time": datetime.utcnow()
-            })
+            log_evento(logger, "sesion_incompleta", logging.WARNING, cliente_id=client_id,
+                       faltantes=[c for c in ("nombre", "tipo_auto", "modelo") if c not in sesion])
+            if desde_cola:
+                # Reintentarlo en cada despacho solo repetiría el aviso al cliente; si vuelve a
+                # completar sus datos, la conversación lo asigna (o lo encola) de nuevo
+                return descartar_lead(client_id, "sesion_incompleta")
+            encolar(sends_col, client_id,
+                    f"{sesion.get('nombre', 'Cliente')}, por favor proporciona toda la información necesaria.",
+                    carril="conversacion")
             guardar_bitacora({
                 "event": "incomplete_session",
                 "client_id": client_id,
@@ -282,41 +595,36 @@ async def send_to_next_advisor(client_id):
                 "time": datetime.utcnow()
             })
             return False
-        active_advisors = await get_asesores()
-        assigned_advisors = sesion.get("assigned_advisors", [])
-        logger.info(f"Asesores asignados para {client_id}: {assigned_advisors}")
-        logger.info(f"Asesores activos disponibles: {active_advisors}")
-        next_advisor = next((advisor for advisor in active_advisors if advisor["telefono"] not in assigned_advisors), None)
+        assigned_advisors = [] if desde_cola else sesion.get("assigned_advisors", [])
+        next_advisor = motor_asignacion.elegir(assigned_advisors, area=sesion.get("area"), tipo_auto=sesion.get("tipo_auto"))
+        log_evento(logger, "asesores_candidatos", logging.DEBUG, cliente_id=client_id,
+                   asignados=assigned_advisors, siguiente=next_advisor and next_advisor["telefono"])
         if next_advisor:
             assigned_advisors.append(next_advisor["telefono"])
             sesion["assigned_advisors"] = assigned_advisors
             sesion["asesor_nombre"] = next_advisor["nombre"]
             guardar_sesion(client_id, sesion)
-            advisor_jid = next_advisor["telefono"]
-            if not advisor_jid.startswith("521"):
-                advisor_jid = f"521{advisor_jid}"
-            advisor_jid = f"{advisor_jid}@s.whatsapp.net"
-            logger.info(f"Generando jid para asesor: {advisor_jid}")
+            advisor_jid = jid_asesor(next_advisor["telefono"])
             # Preguntar solo por disponibilidad
             message = f"Hola {next_advisor['nombre']}, ¿estás disponible para atender a un cliente ahora?"
-            sends_col.insert_one({
-                "jid": advisor_jid,
-                "message": message,
-                "buttons": [
-                    {"buttonId": f"yes_{client_id}", "buttonText": {"displayText": "Sí"}, "type": 1},
-                    {"buttonId": f"no_{client_id}", "buttonText": {"displayText": "No"}, "type": 1}
-                ],
-                "sent": False,
-                "sent_time": datetime.utcnow(),
-                "client_id": client_id
-            })
-            assignment_id = assignments_col.insert_one({
+            # El id se genera antes para firmarlo en los botones
+            assignment_id = ObjectId()
+            # Carril más alto: la espera en cola consume TIEMPO_RESPUESTA_EJECUTIVO
+            encolar(sends_col, advisor_jid, message, carril="disponibilidad",
+                    buttons=botones_disponibilidad(secreto_botones, assignment_id), client_id=client_id)
+            sent_time = datetime.utcnow()
+            # Ausente: espera corta; presente: proporcional a lo que suele tardar en responder
+            espera = presencia.tiempo_respuesta(next_advisor["telefono"], sent_time)
+            deadline = sent_time + timedelta(seconds=espera)
+            assignments_col.insert_one({
+                "_id": assignment_id,
                 "client_id": client_id,
                 "advisor_phone": next_advisor["telefono"],
                 "advisor_name": next_advisor["nombre"],
-                "sent_time": datetime.utcnow(),
+                "sent_time": sent_time,
+                "deadline": deadline,
                 "status": "pending_availability"
-            }).inserted_id
+            })
             # Guardar en bitácora la pregunta de disponibilidad
             guardar_bitacora({
                 "event": "asked_availability",
@@ -328,40 +636,50 @@ async def send_to_next_advisor(client_id):
                 "assignment_id": str(assignment_id)
             })
             
-            logger.info(f"Programando timeout para cliente {client_id}, asesor {next_advisor['telefono']} en {TIEMPO_RESPUESTA_EJECUTIVO} segundos")
-            scheduler.add_job(
-                check_timeout,
-                'date',
-                run_date=datetime.utcnow() + timedelta(seconds=TIEMPO_RESPUESTA_EJECUTIVO),
-                args=[client_id, next_advisor["telefono"], str(assignment_id)],
-                id=f"timeout_{client_id}_{next_advisor['telefono']}",
-                replace_existing=True
-            )
+            logger.info(f"Programando timeout para cliente {client_id}, asesor {next_advisor['telefono']} en {espera:.0f} segundos")
+            temporizador.programar(str(assignment_id), deadline, check_timeout,
+                                   client_id, next_advisor["telefono"], str(assignment_id))
             logger.info(f"Pregunta de disponibilidad enviada a {next_advisor['nombre']} ({advisor_jid}) para cliente {client_id}")
+            # Siempre contra MongoDB: el lead pudo quedar en cola desde otro worker
+            lead = cola_leads.quitar(client_id)
+            if lead:
+                guardar_bitacora({
+                    "event": "lead_dispatched",
+                    "client_id": client_id,
+                    "advisor_phone": next_advisor["telefono"],
+                    "espera_s": round((sent_time - lead["encolado"]).total_seconds()),
+                    "time": sent_time
+                })
             return True
         else:
-            logger.warning(f"No hay asesores disponibles para {client_id}")
-            sends_col.insert_one({
-                "jid": client_id,
-                "message": f"{sesion['nombre']}, lo siento, no hay ejecutivos disponibles ahora. Por favor, intenta de nuevo más tarde.",
-                "sent": False,
-                "sent_time": datetime.utcnow()
-            })
+            if desde_cola:
+                return False
+            logger.warning(f"No hay asesores con cupo para {client_id}, el lead queda en cola")
+            if cola_leads.encolar(client_id, sesion.get("tipo_auto"), sesion.get("area")):
+                encolar(sends_col, client_id,
+                        f"{sesion['nombre']}, en este momento todos nuestros ejecutivos están ocupados. "
+                        "Te asignaremos uno en cuanto se libere, no necesitas volver a escribir.",
+                        carril="conversacion")
             # Guardar en bitácora que no hay asesores disponibles
             guardar_bitacora({
                 "event": "no_advisors_available",
                 "client_id": client_id,
                 "time": datetime.utcnow()
             })
+            guardar_bitacora({
+                "event": "lead_queued",
+                "client_id": client_id,
+                "count": len(cola_leads),
+                "time": datetime.utcnow()
+            })
             return False
     except Exception as e:
         logger.error(f"Error en send_to_next_advisor para {client_id}: {e}", exc_info=True)
-        sends_col.insert_one({
-            "jid": client_id,
-            "message": f"{sesion.get('nombre', 'Cliente')}, lo siento, ocurrió un error al asignar un ejecutivo. Por favor, intenta de nuevo.",
-            "sent": False,
-            "sent_time": datetime.utcnow()
-        })
+        if not desde_cola:
+            # Desde la cola el lead se devuelve y se reintenta: no se avisa en cada despacho
+            encolar(sends_col, client_id,
+                    f"{sesion.get('nombre', 'Cliente')}, lo siento, ocurrió un error al asignar un ejecutivo. Por favor, intenta de nuevo.",
+                    carril="aviso")
         # Guardar en bitácora el error
         guardar_bitacora({
             "event": "error_assigning_advisor",
@@ -374,17 +692,34 @@ async def send_to_next_advisor(client_id):
 async def check_timeout(client_id, advisor_phone, assignment_id):
     try:
         logger.info(f"Verificando timeout para cliente {client_id}, asesor {advisor_phone}, assignment_id {assignment_id}")
-        assignment = assignments_col.find_one({
+        now = datetime.utcnow()
+        # Se marca de forma atómica: si otro proceso recuperó el mismo vencimiento, solo uno reasigna
+        assignment = assignments_col.find_one_and_update({
             "_id": ObjectId(assignment_id),
             "client_id": client_id,
             "advisor_phone": advisor_phone,
-            "status": "pending_availability"
-        })
-        logger.info(f"Asignación encontrada: {assignment}")
+            "status": "pending_availability",
+            "$or": [
+                {"deadline": {"$lte": now}},
+                {"deadline": None, "sent_time": {"$lte": now - timedelta(seconds=TIEMPO_RESPUESTA_EJECUTIVO)}}
+            ]
+        }, {"$set": {"status": "timeout", "response_time": now}})
+        log_evento(logger, "asignacion_encontrada", logging.DEBUG, assignment_id=assignment_id, asignacion=assignment)
         if not assignment:
+            actual = assignments_col.find_one({"_id": ObjectId(assignment_id)}, {"status": 1, "deadline": 1, "sent_time": 1})
+            if actual and actual["status"] == "pending_availability":
+                vence = actual.get("deadline") or actual["sent_time"] + timedelta(seconds=TIEMPO_RESPUESTA_EJECUTIVO)
+                temporizador.programar(assignment_id, vence, check_timeout, client_id, advisor_phone, assignment_id)
+                logger.info(f"Tiempo no alcanzado para {client_id} con {advisor_phone}, reprogramado para {vence}")
+                return
+            if actual:
+                # Ya respondida, vencida por otro proceso o barrida: el temporizador llegó tarde
+                logger.debug(f"Asignación {assignment_id} ya cerrada ({actual['status']}), sin timeout que aplicar")
+                return
             logger.warning(f"No se encontró asignación pendiente para cliente {client_id}, asesor {advisor_phone}, assignment_id {assignment_id}")
-            all_assignments = list(assignments_col.find({"client_id": client_id}))
-            logger.info(f"Todas las asignaciones para {client_id}: {all_assignments}")
+            # La consulta solo se ejecuta si el evento se llega a escribir
+            log_evento(logger, "asignaciones_cliente", logging.DEBUG, cliente_id=client_id,
+                       asignaciones=Perezoso(lambda: list(assignments_col.find({"client_id": client_id}))))
             guardar_bitacora({
                 "event": "timeout_check_failed",
                 "client_id": client_id,
@@ -394,37 +729,22 @@ async def check_timeout(client_id, advisor_phone, assignment_id):
                 "time": datetime.utcnow()
             })
             return
-        now = datetime.utcnow()
         time_elapsed = (now - assignment["sent_time"]).total_seconds()
-        logger.info(f"Tiempo transcurrido para {client_id} con asesor {advisor_phone}: {time_elapsed} segundos")
-        if time_elapsed >= TIEMPO_RESPUESTA_EJECUTIVO:
-            assignments_col.update_one(
-                {"_id": ObjectId(assignment_id)},
-                {"$set": {"status": "timeout", "response_time": now}}
-            )
-            logger.info(f"Marcando asignación {assignment_id} como timeout")
-            guardar_bitacora({
-                "event": "advisor_timeout",
-                "client_id": client_id,
-                "advisor_phone": advisor_phone,
-                "advisor_name": assignment["advisor_name"],
-                "timeout_time": now,
-                "original_ask_time": assignment["sent_time"],
-                "assignment_id": str(assignment_id)
-            })
-            logger.info(f"Timeout para {advisor_phone} con cliente {client_id}, intentando siguiente asesor")
-            await send_to_next_advisor(client_id)
-        else:
-            logger.info(f"Tiempo no alcanzado para {client_id} con {advisor_phone}, tiempo restante: {TIEMPO_RESPUESTA_EJECUTIVO - time_elapsed} segundos")
-            scheduler.add_job(
-                check_timeout,
-                'date',
-                run_date=datetime.utcnow() + timedelta(seconds=TIEMPO_RESPUESTA_EJECUTIVO - time_elapsed),
-                args=[client_id, advisor_phone, str(assignment_id)],
-                id=f"timeout_{client_id}_{advisor_phone}",
-                replace_existing=True
-            )
-            logger.info(f"Reprogramado timeout para cliente {client_id}, asesor {advisor_phone} en {TIEMPO_RESPUESTA_EJECUTIVO - time_elapsed} segundos")
+        logger.info(f"Marcando asignación {assignment_id} como timeout tras {time_elapsed} segundos")
+        guardar_bitacora({
+            "event": "advisor_timeout",
+            "client_id": client_id,
+            "advisor_phone": advisor_phone,
+            "advisor_name": assignment["advisor_name"],
+            "timeout_time": now,
+            "original_ask_time": assignment["sent_time"],
+            "assignment_id": str(assignment_id)
+        })
+        motor_asignacion.liberar(advisor_phone)
+        presencia.timeout(advisor_phone)
+        logger.info(f"Timeout para {advisor_phone} con cliente {client_id}, intentando siguiente asesor")
+        await send_to_next_advisor(client_id)
+        await despachar_cola()
     except Exception as e:
         logger.error(f"Error en check_timeout para {client_id}, asesor {advisor_phone}, assignment_id {assignment_id}: {e}", exc_info=True)
         guardar_bitacora({
@@ -441,8 +761,14 @@ async def advisor_response(req: AdvisorResponse):
     try:
         cliente_id = req.cliente_id
         respuesta = req.respuesta.lower()
-        asesor_phone = req.asesor_phone
-        assignment = assignments_col.find_one({"client_id": cliente_id, "advisor_phone": asesor_phone, "status": "pending_availability"})
+        # Las asignaciones guardan el teléfono normalizado ("+52 ...", "52..." y "521..." son el mismo)
+        asesor_phone = normalizar_telefono(req.asesor_phone)
+        now = datetime.utcnow()
+        assignment = assignments_col.find_one_and_update(
+            {"client_id": cliente_id, "advisor_phone": asesor_phone, "status": "pending_availability"},
+            {"$set": {"status": "accepted" if respuesta == "yes" else "declined", "response_time": now}},
+            sort=[("sent_time", -1)]
+        )
         if not assignment:
             logger.warning(f"No se encontró asignación pendiente para cliente {cliente_id} y asesor {asesor_phone}")
             guardar_bitacora({
@@ -453,92 +779,131 @@ async def advisor_response(req: AdvisorResponse):
                 "time": datetime.utcnow()
             })
             return {"texto": "Asignación no encontrada"}
-        now = datetime.utcnow()
-        # Guardar en bitácora la respuesta del asesor
+        await procesar_respuesta_asesor(assignment, respuesta, now)
+        return {"texto": "Respuesta registrada"}
+    except Exception as e:
+        logger.error(f"Error en advisor_response: {e}", exc_info=True)
+        # Guardar en bitácora el error
         guardar_bitacora({
-            "event": "advisor_availability_response",
+            "event": "error_advisor_response",
             "client_id": cliente_id,
             "advisor_phone": asesor_phone,
-            "advisor_name": assignment["advisor_name"],
-            "response": respuesta,
-            "response_time": now,
-            "original_ask_time": assignment["sent_time"],
-            "assignment_id": str(assignment["_id"])
+            "error": str(e),
+            "time": datetime.utcnow()
         })
-        if respuesta == "yes":
-            sesion = obtener_sesion(cliente_id)
-            assignments_col.update_one({"_id": assignment["_id"]}, {"$set": {"status": "accepted", "response_time": now}})
-            # Enviar información del cliente al asesor
-            advisor_jid = asesor_phone if asesor_phone.startswith("521") else f"521{asesor_phone}"
-            advisor_jid = f"{advisor_jid}@s.whatsapp.net"
-            client_summary = (
-                f"Cliente: {sesion['nombre']} busca {sesion['tipo_auto']} {sesion['modelo']}, "
-                f"contacto: {cliente_id}. Asesor asignado: {assignment['advisor_name']}"
-            )
-            sends_col.insert_one({
-                "jid": advisor_jid,
-                "message": client_summary,
-                "sent": False,
-                "sent_time": datetime.utcnow()
-            })
-            # Guardar en bitácora el envío de información del cliente
-            guardar_bitacora({
-                "event": "client_info_sent",
-                "client_id": cliente_id,
-                "advisor_phone": asesor_phone,
-                "advisor_name": assignment["advisor_name"],
-                "sent_time": now,
-                "message": client_summary,
-                "assignment_id": str(assignment["_id"])
-            })
-            # Registrar asignación final
-            info_cliente = {
-                "nombre": sesion["nombre"],
-                "tipo_auto": sesion["tipo_auto"],
-                "modelo": sesion["modelo"],
-                "contacto": cliente_id,
-                "ejecutivo": assignment["advisor_name"],
-                "fecha": now.strftime("%Y-%m-%d"),
-                "hora": now.strftime("%H:%M:%S")
-            }
+        return {"texto": "Error al procesar la respuesta del asesor"}
+
+@app.post("/gateway_callback")
+async def gateway_callback(req: GatewayCallback):
+    """Botón de disponibilidad pulsado por un asesor, con el buttonId tal como lo reporta el gateway."""
+    leido = leer_boton(secreto_botones, req.button_id)
+    if leido is None:
+        legado = leer_legado(req.button_id)
+        if legado is None or not req.jid:
+            raise HTTPException(status_code=400, detail="Botón no reconocido")
+        # Botones enviados antes de firmar el id: se resuelven por cliente y asesor
+        return await advisor_response(AdvisorResponse(
+            cliente_id=legado[1], respuesta=legado[0], asesor_phone=normalizar_telefono(req.jid.split("@")[0])
+        ))
+    respuesta, assignment_id = leido
+    try:
+        now = datetime.utcnow()
+        filtro = {"_id": assignment_id, "status": "pending_availability"}
+        if req.jid:
+            filtro["advisor_phone"] = normalizar_telefono(req.jid.split("@")[0])
+        # Un solo paso por _id: la respuesta gana o pierde contra el timeout de forma atómica
+        assignment = assignments_col.find_one_and_update(
+            filtro, {"$set": {"status": "accepted" if respuesta == "yes" else "declined", "response_time": now}}
+        )
+        if not assignment:
             guardar_bitacora({
-                "event": "client_assigned",
-                "client_id": cliente_id,
-                "advisor_phone": asesor_phone,
-                "advisor_name": assignment["advisor_name"],
-                "assignment_time": now,
-                "client_info": info_cliente,
-                "assignment_id": str(assignment["_id"])
-            })
-            client_message = (
-                f"{sesion['nombre']}, tu interés en el {sesion['tipo_auto']} {sesion['modelo']} está registrado. "
-                f"El ejecutivo {assignment['advisor_name']} te contactará pronto."
-            )
-            sends_col.insert_one({
-                "jid": cliente_id,
-                "message": client_message,
-                "sent": False,
-                "sent_time": datetime.utcnow()
+                "event": "advisor_response_failed",
+                "assignment_id": str(assignment_id),
+                "advisor_phone": filtro.get("advisor_phone"),
+                "error": "Asignación ya respondida, vencida o de otro asesor",
+                "time": now
             })
-            sesion["modelo_confirmado"] = True
-            guardar_sesion(cliente_id, sesion)
-        else:  # Respuesta "no" u otra
-            assignments_col.update_one({"_id": assignment["_id"]}, {"$set": {"status": "declined", "response_time": now}})
-            logger.info(f"Asesor {asesor_phone} no disponible, intentando siguiente asesor para {cliente_id}")
-            await send_to_next_advisor(cliente_id)
+            return {"texto": "Asignación no encontrada"}
+        await procesar_respuesta_asesor(assignment, respuesta, now)
         return {"texto": "Respuesta registrada"}
     except Exception as e:
-        logger.error(f"Error en advisor_response: {e}", exc_info=True)
-        # Guardar en bitácora el error
+        logger.error(f"Error en gateway_callback para asignación {assignment_id}: {e}", exc_info=True)
         guardar_bitacora({
             "event": "error_advisor_response",
-            "client_id": cliente_id,
-            "advisor_phone": asesor_phone,
+            "assignment_id": str(assignment_id),
             "error": str(e),
             "time": datetime.utcnow()
         })
         return {"texto": "Error al procesar la respuesta del asesor"}
 
+async def procesar_respuesta_asesor(assignment, respuesta, now):
+    """Lo que sigue a una respuesta ya registrada en `assignment` (documento previo al cambio)."""
+    cliente_id = assignment["client_id"]
+    asesor_phone = assignment["advisor_phone"]
+    temporizador.cancelar(str(assignment["_id"]))
+    presencia.respuesta(asesor_phone, (now - assignment["sent_time"]).total_seconds(), now)
+    # Guardar en bitácora la respuesta del asesor
+    guardar_bitacora({
+        "event": "advisor_availability_response",
+        "client_id": cliente_id,
+        "advisor_phone": asesor_phone,
+        "advisor_name": assignment["advisor_name"],
+        "response": respuesta,
+        "response_time": now,
+        "original_ask_time": assignment["sent_time"],
+        "assignment_id": str(assignment["_id"])
+    })
+    if respuesta == "yes":
+        sesion = obtener_sesion(cliente_id)
+        # Enviar información del cliente al asesor
+        advisor_jid = jid_asesor(asesor_phone)
+        client_summary = (
+            f"Cliente: {sesion['nombre']} busca {sesion['tipo_auto']} {sesion['modelo']}, "
+            f"contacto: {cliente_id}. Asesor asignado: {assignment['advisor_name']}"
+        )
+        encolar(sends_col, advisor_jid, client_summary, carril="asignacion")
+        # Guardar en bitácora el envío de información del cliente
+        guardar_bitacora({
+            "event": "client_info_sent",
+            "client_id": cliente_id,
+            "advisor_phone": asesor_phone,
+            "advisor_name": assignment["advisor_name"],
+            "sent_time": now,
+            "message": client_summary,
+            "assignment_id": str(assignment["_id"])
+        })
+        # Registrar asignación final
+        info_cliente = {
+            "nombre": sesion["nombre"],
+            "tipo_auto": sesion["tipo_auto"],
+            "modelo": sesion["modelo"],
+            "contacto": cliente_id,
+            "ejecutivo": assignment["advisor_name"],
+            "fecha": now.strftime("%Y-%m-%d"),
+            "hora": now.strftime("%H:%M:%S")
+        }
+        guardar_bitacora({
+            "event": "client_assigned",
+            "client_id": cliente_id,
+            "advisor_phone": asesor_phone,
+            "advisor_name": assignment["advisor_name"],
+            "assignment_time": now,
+            "client_info": info_cliente,
+            "assignment_id": str(assignment["_id"])
+        })
+        client_message = (
+            f"{sesion['nombre']}, tu interés en el {sesion['tipo_auto']} {sesion['modelo']} está registrado. "
+            f"El ejecutivo {assignment['advisor_name']} te contactará pronto."
+        )
+        encolar(sends_col, cliente_id, client_message, carril="asignacion")
+        sesion["modelo_confirmado"] = True
+        guardar_sesion(cliente_id, sesion)
+    else:  # Respuesta "no" u otra
+        motor_asignacion.liberar(asesor_phone)
+        logger.info(f"Asesor {asesor_phone} no disponible, intentando siguiente asesor para {cliente_id}")
+        await send_to_next_advisor(cliente_id)
+        await despachar_cola()
+
 
 # ------------------------------
 # Generación de respuesta con Ollama
@@ -581,7 +946,8 @@ def generar_respuesta_ollama(prompt, contexto_sesion=None, es_primer_mensaje=Fal
         if contexto_sesion:
             system_prompt += f"\nContexto actual: {contexto_sesion}"
         full_prompt = f"{system_prompt}\n\nMensaje del cliente: {prompt}"
-        logger.info(f"Enviando prompt a Ollama: {full_prompt}")
+        log_evento(logger, "prompt_ollama", logging.DEBUG, largo=len(full_prompt),
+                   contexto=contexto_sesion, mensaje=prompt)
         resp = ollama.generate(model="llama3", prompt=full_prompt)
         if isinstance(resp, GenerateResponse):
             respuesta = str(resp.response).strip()
@@ -596,7 +962,7 @@ def generar_respuesta_ollama(prompt, contexto_sesion=None, es_primer_mensaje=Fal
         if expected_response and respuesta != expected_response:
             logger.warning(f"Ollama response '{respuesta}' does not match expected '{expected_response}'")
             return expected_response, buttons or []
-        logger.info(f"Respuesta procesada de Ollama: {respuesta}")
+        log_evento(logger, "respuesta_ollama", logging.DEBUG, respuesta=respuesta)
         return respuesta, buttons or []
     except Exception as e:
         logger.error(f"Error al comunicarse con Ollama: {e}", exc_info=True)
@@ -618,11 +984,12 @@ async def webhook(req: Mensaje):
             sesion = {}
             guardar_sesion(cliente_id, sesion)
 
-        logger.info(f"Procesando mensaje para cliente {cliente_id}: {texto}, Sesión: {sesion}")
+        log_evento(logger, "mensaje_recibido", cliente_id=cliente_id, texto=texto, nombre=sesion.get("nombre"),
+                   modelo=sesion.get("modelo"), confirmado=bool(sesion.get("modelo_confirmado")))
 
         # Manejar mensajes post-confirmación
         if sesion.get("modelo_confirmado"):
-            logger.info(f"Sesión ya confirmada para {cliente_id}: {sesion}")
+            log_evento(logger, "sesion_confirmada", logging.DEBUG, cliente_id=cliente_id, modelo=sesion.get("modelo"))
             if any(keyword in texto.lower() for keyword in ["documentos", "requisitos", "papeles"]):
                 contexto = f"El cliente {sesion.get('nombre', 'Cliente')} ha preguntado por documentos necesarios para la compra del modelo {sesion['modelo']}."
                 expected_response = (
@@ -634,43 +1001,43 @@ async def webhook(req: Mensaje):
                     "Un ejecutivo te dará más detalles. ¿Algo más en lo que pueda ayudarte?"
                 )
                 respuesta, botones = generar_respuesta_ollama(texto, contexto, False, expected_response, [])
-                logger.info(f"Respuesta del webhook: texto={respuesta}, botones={botones}")
+                log_evento(logger, "respuesta_webhook", cliente_id=cliente_id, texto=respuesta, botones=len(botones))
                 return {"texto": respuesta, "botones": botones}
             elif any(keyword in texto.lower() for keyword in ["no me ha contactado", "nadie me ha contactado", "no me han atendido", "no me han contactado"]):
                 contexto = f"El cliente {sesion.get('nombre', 'Cliente')} expresó que no ha recibido atención después de confirmar el modelo {sesion['modelo']}."
                 expected_response = f"{sesion.get('nombre', 'Cliente')}, disculpa la demora. Nuestros ejecutivos se encuentran en llamada y en cuanto se desocupen te atenderán. Tu atención es prioritaria para nosotros. ¿Algo más en lo que pueda ayudarte?"
                 respuesta, botones = generar_respuesta_ollama(texto, contexto, False, expected_response, [])
-                logger.info(f"Respuesta del webhook: texto={respuesta}, botones={botones}")
+                log_evento(logger, "respuesta_webhook", cliente_id=cliente_id, texto=respuesta, botones=len(botones))
                 return {"texto": respuesta, "botones": botones}
             elif any(keyword in texto.lower() for keyword in ["gracias", "no, gracias", "ok", "de nada", "okey"]):
                 contexto = f"El cliente {sesion.get('nombre', 'Cliente')} dijo '{texto}' después de confirmar el modelo {sesion['modelo']}."
                 expected_response = f"De nada, {sesion.get('nombre', 'Cliente')}. Un ejecutivo te contactará pronto."
                 respuesta, botones = generar_respuesta_ollama(texto, contexto, False, expected_response, [])
-                logger.info(f"Respuesta del webhook: texto={respuesta}, botones={botones}")
+                log_evento(logger, "respuesta_webhook", cliente_id=cliente_id, texto=respuesta, botones=len(botones))
                 return {"texto": respuesta, "botones": botones}
             elif texto.lower() in ["hola", "hi", "buenas"]:
                 contexto = f"El cliente {sesion.get('nombre', 'Cliente')} envió un saludo después de confirmar el modelo {sesion['modelo']}."
                 expected_response = f"Hola {sesion.get('nombre', 'Cliente')}. Tu interés en el modelo {sesion['modelo']} está registrado. Un ejecutivo te contactará pronto. ¿Algo más en lo que pueda ayudarte?"
                 respuesta, botones = generar_respuesta_ollama(texto, contexto, False, expected_response, [])
-                logger.info(f"Respuesta del webhook: texto={respuesta}, botones={botones}")
+                log_evento(logger, "respuesta_webhook", cliente_id=cliente_id, texto=respuesta, botones=len(botones))
                 return {"texto": respuesta, "botones": botones}
             elif any(keyword in texto.lower() for keyword in ["cuál es el nombre del asesor", "cuál es el nombre del ejecutivo"]):
                 contexto = f"El cliente {sesion.get('nombre', 'Cliente')} preguntó por el nombre del asesor después de confirmar el modelo {sesion['modelo']}."
                 expected_response = f"{sesion.get('nombre', 'Cliente')}, no tengo el nombre del asesor asignado aún, ya que se determina cuando un ejecutivo esté disponible. Te informaré cuando te contacten."
                 respuesta, botones = generar_respuesta_ollama(texto, contexto, False, expected_response, [])
-                logger.info(f"Respuesta del webhook: texto={respuesta}, botones={botones}")
+                log_evento(logger, "respuesta_webhook", cliente_id=cliente_id, texto=respuesta, botones=len(botones))
                 return {"texto": respuesta, "botones": botones}
             elif any(keyword in texto.lower() for keyword in ["en qué tanto tiempo me contactarán", "en cuanto tiempo"]):
                 contexto = f"El cliente {sesion.get('nombre', 'Cliente')} preguntó por el tiempo de contacto después de confirmar el modelo {sesion['modelo']}."
                 expected_response = f"{sesion.get('nombre', 'Cliente')}, te contactarán lo antes posible, generalmente dentro de unos 5 a 10 minutos una vez que un asesor se desocupe."
                 respuesta, botones = generar_respuesta_ollama(texto, contexto, False, expected_response, [])
-                logger.info(f"Respuesta del webhook: texto={respuesta}, botones={botones}")
+                log_evento(logger, "respuesta_webhook", cliente_id=cliente_id, texto=respuesta, botones=len(botones))
                 return {"texto": respuesta, "botones": botones}
             else:
                 contexto = f"El cliente {sesion.get('nombre', 'Cliente')} ya confirmó el modelo {sesion['modelo']}. Responde amigablemente."
                 expected_response = f"Hola {sesion.get('nombre', 'Cliente')}. Tu interés en el modelo {sesion['modelo']} está registrado. Un ejecutivo te contactará pronto. ¿Algo más en lo que pueda ayudarte?"
                 respuesta, botones = generar_respuesta_ollama(texto, contexto, False, expected_response, [])
-                logger.info(f"Respuesta del webhook: texto={respuesta}, botones={botones}")
+                log_evento(logger, "respuesta_webhook", cliente_id=cliente_id, texto=respuesta, botones=len(botones))
                 return {"texto": respuesta, "botones": botones}
 
         # Manejar solicitud de hablar con un ejecutivo
@@ -679,7 +1046,7 @@ async def webhook(req: Mensaje):
                 contexto = "El cliente pidió hablar con un ejecutivo pero no ha proporcionado un nombre. Pide el nombre de forma amigable."
                 expected_response = f"¡Bienvenido(a) a {AGENCIA}! 😊 ¿Me puedes proporcionar tu nombre, por favor?"
                 respuesta, botones = generar_respuesta_ollama(texto, contexto, True, expected_response, [])
-                logger.info(f"Respuesta del webhook: texto={respuesta}, botones={botones}")
+                log_evento(logger, "respuesta_webhook", cliente_id=cliente_id, texto=respuesta, botones=len(botones))
                 return {"texto": respuesta, "botones": botones}
             else:
                 await send_to_next_advisor(cliente_id)
@@ -688,7 +1055,7 @@ async def webhook(req: Mensaje):
                 contexto = f"El cliente {sesion['nombre']} pidió hablar con un ejecutivo."
                 expected_response = f"{sesion['nombre']}, un ejecutivo te contactará pronto. ¿Algo más en lo que pueda ayudarte?"
                 respuesta, botones = generar_respuesta_ollama(texto, contexto, False, expected_response, [])
-                logger.info(f"Respuesta del webhook: texto={respuesta}, botones={botones}")
+                log_evento(logger, "respuesta_webhook", cliente_id=cliente_id, texto=respuesta, botones=len(botones))
                 return {"texto": respuesta, "botones": botones}
 
         # Manejar frustración del cliente
@@ -697,26 +1064,26 @@ async def webhook(req: Mensaje):
                 contexto = f"El cliente {sesion['nombre']} expresó frustración porque no ha sido contactado después de confirmar el modelo {sesion['modelo']}."
                 expected_response = f"{sesion['nombre']}, disculpa la demora. Nuestros ejecutivos se encuentran en llamada y en cuanto se desocupen te atenderán. Tu atención es prioritaria para nosotros. ¿Algo más en lo que pueda ayudarte?"
                 respuesta, botones = generar_respuesta_ollama(texto, contexto, False, expected_response, [])
-                logger.info(f"Respuesta del webhook: texto={respuesta}, botones={botones}")
+                log_evento(logger, "respuesta_webhook", cliente_id=cliente_id, texto=respuesta, botones=len(botones))
                 return {"texto": respuesta, "botones": botones}
             elif "nombre" in sesion and "tipo_auto" in sesion:
                 modelos = sesion.get("modelos", obtener_autos_nuevos() if sesion["tipo_auto"] == "nuevo" else obtener_autos_usados())
                 contexto = f"El cliente {sesion['nombre']} expresó frustración y ya seleccionó tipo_auto {sesion['tipo_auto']}. Muestra los modelos disponibles."
                 expected_response = f"{sesion['nombre']}, disculpa la demora. Nuestros ejecutivos se encuentran en llamada y en cuanto se desocupen te atenderán. Tu atención es prioritaria para nosotros. Estos son los modelos disponibles: {', '.join(modelos)}. ¿Cuál te interesa?"
                 respuesta, botones = generar_respuesta_ollama(texto, contexto, False, expected_response, modelos[:5])
-                logger.info(f"Respuesta del webhook: texto={respuesta}, botones={botones}")
+                log_evento(logger, "respuesta_webhook", cliente_id=cliente_id, texto=respuesta, botones=len(botones))
                 return {"texto": respuesta, "botones": botones}
             elif "nombre" in sesion:
                 contexto = f"El cliente {sesion['nombre']} expresó frustración y ya proporcionó su nombre. Pregunta por el tipo de auto."
                 expected_response = f"{sesion['nombre']}, disculpa la demora. Nuestros ejecutivos se encuentran en llamada y en cuanto se desocupen te atenderán. Tu atención es prioritaria para nosotros. ¿Buscas un auto nuevo o usado?"
                 respuesta, botones = generar_respuesta_ollama(texto, contexto, False, expected_response, ["Nuevo", "Usado"])
-                logger.info(f"Respuesta del webhook: texto={respuesta}, botones={botones}")
+                log_evento(logger, "respuesta_webhook", cliente_id=cliente_id, texto=respuesta, botones=len(botones))
                 return {"texto": respuesta, "botones": botones}
             else:
                 contexto = "El cliente expresó frustración, pero no ha proporcionado su nombre. Pide el nombre de forma amigable."
                 expected_response = f"Disculpa la demora. Nuestros ejecutivos se encuentran en llamada y en cuanto se desocupen te atenderán. Tu atención es prioritaria para nosotros. ¿Me puedes proporcionar tu nombre, por favor?"
                 respuesta, botones = generar_respuesta_ollama(texto, contexto, True, expected_response, [])
-                logger.info(f"Respuesta del webhook: texto={respuesta}, botones={botones}")
+                log_evento(logger, "respuesta_webhook", cliente_id=cliente_id, texto=respuesta, botones=len(botones))
                 return {"texto": respuesta, "botones": botones}
 
         # Manejar saludos iniciales
@@ -725,26 +1092,26 @@ async def webhook(req: Mensaje):
                 contexto = "El cliente ha iniciado la conversación con un saludo. Pide su nombre de forma amigable."
                 expected_response = f"¡Bienvenido(a) a {AGENCIA}! 😊 ¿Me puedes proporcionar tu nombre, por favor?"
                 respuesta, botones = generar_respuesta_ollama(texto, contexto, True, expected_response, [])
-                logger.info(f"Respuesta del webhook: texto={respuesta}, botones={botones}")
+                log_evento(logger, "respuesta_webhook", cliente_id=cliente_id, texto=respuesta, botones=len(botones))
                 return {"texto": respuesta, "botones": botones}
             elif "tipo_auto" not in sesion:
                 contexto = f"El cliente {sesion['nombre']} ha enviado un saludo, pero no ha seleccionado tipo_auto. Pregunta por el tipo de auto."
                 expected_response = f"{sesion['nombre']}, ¿buscas un auto nuevo o usado?"
                 respuesta, botones = generar_respuesta_ollama(texto, contexto, False, expected_response, ["Nuevo", "Usado"])
-                logger.info(f"Respuesta del webhook: texto={respuesta}, botones={botones}")
+                log_evento(logger, "respuesta_webhook", cliente_id=cliente_id, texto=respuesta, botones=len(botones))
                 return {"texto": respuesta, "botones": botones}
             elif "modelo" not in sesion:
                 modelos = sesion.get("modelos", obtener_autos_nuevos() if sesion["tipo_auto"] == "nuevo" else obtener_autos_usados())
                 contexto = f"El cliente {sesion['nombre']} ha enviado un saludo, pero ya seleccionó tipo_auto {sesion['tipo_auto']}. Muestra los modelos disponibles."
                 expected_response = f"{sesion['nombre']}, estos son los modelos disponibles: {', '.join(modelos)}. ¿Cuál te interesa?"
                 respuesta, botones = generar_respuesta_ollama(texto, contexto, False, expected_response, modelos[:5])
-                logger.info(f"Respuesta del webhook: texto={respuesta}, botones={botones}")
+                log_evento(logger, "respuesta_webhook", cliente_id=cliente_id, texto=respuesta, botones=len(botones))
                 return {"texto": respuesta, "botones": botones}
             else:
                 contexto = f"El cliente {sesion['nombre']} ha enviado un saludo, pero ya seleccionó el modelo {sesion['modelo']}. Pide confirmación."
                 expected_response = f"{sesion['nombre']}, ¿confirmas que quieres el modelo {sesion['modelo']}? Si prefieres otro, dime cuál."
                 respuesta, botones = generar_respuesta_ollama(texto, contexto, False, expected_response, ["Sí", "Cambiar modelo"])
-                logger.info(f"Respuesta del webhook: texto={respuesta}, botones={botones}")
+                log_evento(logger, "respuesta_webhook", cliente_id=cliente_id, texto=respuesta, botones=len(botones))
                 return {"texto": respuesta, "botones": botones}
 
         # Manejar nombre
@@ -780,7 +1147,7 @@ async def webhook(req: Mensaje):
                 contexto = f"El cliente ha proporcionado su nombre: {sesion['nombre']}. Pregunta por el tipo de auto."
                 expected_response = f"{sesion['nombre']}, ¿buscas un auto nuevo o usado?"
                 respuesta, botones = generar_respuesta_ollama(texto, contexto, False, expected_response, ["Nuevo", "Usado"])
-                logger.info(f"Respuesta del webhook: texto={respuesta}, botones={botones}")
+                log_evento(logger, "respuesta_webhook", cliente_id=cliente_id, texto=respuesta, botones=len(botones))
                 return {"texto": respuesta, "botones": botones}
             else:
                 # Después de un intento fallido, pasar a preguntar por el interés de compra
@@ -790,12 +1157,12 @@ async def webhook(req: Mensaje):
                     contexto = "El cliente no proporcionó un nombre válido después de varios intentos. Pregunta por el interés de compra."
                     expected_response = "No has proporcionado un nombre válido. ¿Buscas un auto nuevo o usado? Nota que necesitarás dar tu nombre para que un asesor pueda comunicarse contigo."
                     respuesta, botones = generar_respuesta_ollama(texto, contexto, False, expected_response, ["Nuevo", "Usado"])
-                    logger.info(f"Respuesta del webhook: texto={respuesta}, botones={botones}")
+                    log_evento(logger, "respuesta_webhook", cliente_id=cliente_id, texto=respuesta, botones=len(botones))
                     return {"texto": respuesta, "botones": botones}
                 contexto = "El cliente no ha proporcionado un nombre válido. Pide el nombre de forma amigable."
                 expected_response = f"Disculpa, no entendí tu nombre. ¿Me dices cómo te llamas?"
                 respuesta, botones = generar_respuesta_ollama(texto, contexto, True, expected_response, [])
-                logger.info(f"Respuesta del webhook: texto={respuesta}, botones={botones}")
+                log_evento(logger, "respuesta_webhook", cliente_id=cliente_id, texto=respuesta, botones=len(botones))
                 return {"texto": respuesta, "botones": botones}
 
         # Manejar tipo de auto
@@ -808,20 +1175,20 @@ async def webhook(req: Mensaje):
                     contexto = f"No se pudieron obtener modelos de autos {sesion['tipo_auto']}. Informa al cliente y sugiere reintentar."
                     expected_response = f"{sesion.get('nombre', 'Cliente')}, lo siento, no tenemos la lista de modelos disponible ahora. ¿Quieres intentar de nuevo?"
                     respuesta, botones = generar_respuesta_ollama(texto, contexto, False, expected_response, ["Reintentar"])
-                    logger.info(f"Respuesta del webhook: texto={respuesta}, botones={botones}")
+                    log_evento(logger, "respuesta_webhook", cliente_id=cliente_id, texto=respuesta, botones=len(botones))
                     return {"texto": respuesta, "botones": botones}
                 sesion["modelos"] = modelos
                 guardar_sesion(cliente_id, sesion)
                 contexto = f"El cliente {sesion.get('nombre', 'Cliente')} ha seleccionado tipo_auto {texto}. Muestra los modelos disponibles."
                 expected_response = f"{sesion.get('nombre', 'Cliente')}, estos son los modelos disponibles: {', '.join(modelos)}. ¿Cuál te interesa?"
                 respuesta, botones = generar_respuesta_ollama(texto, contexto, False, expected_response, modelos[:5])
-                logger.info(f"Respuesta del webhook: texto={respuesta}, botones={botones}")
+                log_evento(logger, "respuesta_webhook", cliente_id=cliente_id, texto=respuesta, botones=len(botones))
                 return {"texto": respuesta, "botones": botones}
             else:
                 contexto = f"El cliente {sesion.get('nombre', 'Cliente')} no ha especificado si quiere un auto nuevo o usado. Pregunta de forma clara."
                 expected_response = f"{sesion.get('nombre', 'Cliente')}, ¿buscas un auto nuevo o usado?"
                 respuesta, botones = generar_respuesta_ollama(texto, contexto, False, expected_response, ["Nuevo", "Usado"])
-                logger.info(f"Respuesta del webhook: texto={respuesta}, botones={botones}")
+                log_evento(logger, "respuesta_webhook", cliente_id=cliente_id, texto=respuesta, botones=len(botones))
                 return {"texto": respuesta, "botones": botones}
 
         # Manejar selección de modelo
@@ -831,7 +1198,7 @@ async def webhook(req: Mensaje):
             contexto = f"No se pudieron obtener modelos de autos {tipo}. Informa al cliente y sugiere reintentar o contactar a un ejecutivo."
             expected_response = f"{sesion.get('nombre', 'Cliente')}, lo siento, no tenemos la lista de modelos disponible ahora. ¿Quieres intentar de nuevo o prefieres hablar con un ejecutivo?"
             respuesta, botones = generar_respuesta_ollama(texto, contexto, False, expected_response, ["Reintentar", "Hablar con ejecutivo"])
-            logger.info(f"Respuesta del webhook: texto={respuesta}, botones={botones}")
+            log_evento(logger, "respuesta_webhook", cliente_id=cliente_id, texto=respuesta, botones=len(botones))
             return {"texto": respuesta, "botones": botones}
 
         # Confirmación de modelo
@@ -846,7 +1213,7 @@ async def webhook(req: Mensaje):
                     contexto = "El cliente confirmó un modelo pero no proporcionó un nombre. Explica la necesidad del nombre."
                     expected_response = "Has confirmado un modelo, pero no has proporcionado tu nombre. Es necesario dar tu nombre para que un asesor pueda comunicarse contigo. ¿Me dices cómo te llamas?"
                     respuesta, botones = generar_respuesta_ollama(texto, contexto, False, expected_response, [])
-                    logger.info(f"Respuesta del webhook: texto={respuesta}, botones={botones}")
+                    log_evento(logger, "respuesta_webhook", cliente_id=cliente_id, texto=respuesta, botones=len(botones))
                     return {"texto": respuesta, "botones": botones}
                 await send_to_next_advisor(cliente_id)
                 sesion["modelo_confirmado"] = True
@@ -854,7 +1221,7 @@ async def webhook(req: Mensaje):
                 contexto = f"El cliente {sesion['nombre']} ha confirmado el modelo {sesion['modelo']}."
                 expected_response = f"{sesion['nombre']}, tu interés en el modelo {sesion['modelo']} está registrado. Un ejecutivo te contactará pronto."
                 respuesta, botones = generar_respuesta_ollama(texto, contexto, False, expected_response, [])
-                logger.info(f"Respuesta del webhook: texto={respuesta}, botones={botones}")
+                log_evento(logger, "respuesta_webhook", cliente_id=cliente_id, texto=respuesta, botones=len(botones))
                 return {"texto": respuesta, "botones": botones}
             elif texto_lower in ["no", "cambiar modelo", "cambiar", "otras opciones"]:
                 sesion.pop("modelo", None)
@@ -865,19 +1232,19 @@ async def webhook(req: Mensaje):
                 contexto = f"El cliente {sesion.get('nombre', 'Cliente')} no confirmó el modelo y quiere elegir otro."
                 expected_response = f"{sesion.get('nombre', 'Cliente')}, ¿cuál modelo prefieres? Estos son los disponibles: {', '.join(modelos)}."
                 respuesta, botones = generar_respuesta_ollama(texto, contexto, False, expected_response, modelos[:5])
-                logger.info(f"Respuesta del webhook: texto={respuesta}, botones={botones}")
+                log_evento(logger, "respuesta_webhook", cliente_id=cliente_id, texto=respuesta, botones=len(botones))
                 return {"texto": respuesta, "botones": botones}
             elif any(keyword in texto_lower for keyword in ["gracias", "no, gracias", "ok", "de nada"]):
                 contexto = f"El cliente {sesion.get('nombre', 'Cliente')} dijo '{texto}' antes de confirmar el modelo {sesion['modelo']}."
                 expected_response = f"{sesion.get('nombre', 'Cliente')}, ¿confirmas que quieres el modelo {sesion['modelo']}? Si prefieres otro, dime cuál."
                 respuesta, botones = generar_respuesta_ollama(texto, contexto, False, expected_response, ["Sí", "Cambiar modelo"])
-                logger.info(f"Respuesta del webhook: texto={respuesta}, botones={botones}")
+                log_evento(logger, "respuesta_webhook", cliente_id=cliente_id, texto=respuesta, botones=len(botones))
                 return {"texto": respuesta, "botones": botones}
             else:
                 contexto = f"El cliente {sesion.get('nombre', 'Cliente')} no ha confirmado el modelo {sesion['modelo']}."
                 expected_response = f"{sesion.get('nombre', 'Cliente')}, ¿confirmas que quieres el modelo {sesion['modelo']}? Si prefieres otro, dime cuál."
                 respuesta, botones = generar_respuesta_ollama(texto, contexto, False, expected_response, ["Sí", "Cambiar modelo"])
-                logger.info(f"Respuesta del webhook: texto={respuesta}, botones={botones}")
+                log_evento(logger, "respuesta_webhook", cliente_id=cliente_id, texto=respuesta, botones=len(botones))
                 return {"texto": respuesta, "botones": botones}
 
         # Selección de modelo
@@ -899,20 +1266,20 @@ async def webhook(req: Mensaje):
             contexto = f"El cliente {sesion.get('nombre', 'Cliente')} ha seleccionado el modelo {modelo_seleccionado}."
             expected_response = f"{sesion.get('nombre', 'Cliente')}, ¿confirmas que quieres el modelo {modelo_seleccionado}? Si prefieres otro, dime cuál."
             respuesta, botones = generar_respuesta_ollama(texto, contexto, False, expected_response, ["Sí", "Cambiar modelo"])
-            logger.info(f"Respuesta del webhook: texto={respuesta}, botones={botones}")
+            log_evento(logger, "respuesta_webhook", cliente_id=cliente_id, texto=respuesta, botones=len(botones))
             return {"texto": respuesta, "botones": botones}
         else:
             contexto = f"El cliente {sesion.get('nombre', 'Cliente')} no ha seleccionado un modelo válido."
             expected_response = f"{sesion.get('nombre', 'Cliente')}, lo siento, ese modelo no está disponible. Estos son los modelos disponibles: {', '.join(modelos)}. ¿Cuál te interesa?"
             respuesta, botones = generar_respuesta_ollama(texto, contexto, False, expected_response, modelos[:5])
-            logger.info(f"Respuesta del webhook: texto={respuesta}, botones={botones}")
+            log_evento(logger, "respuesta_webhook", cliente_id=cliente_id, texto=respuesta, botones=len(botones))
             return {"texto": respuesta, "botones": botones}
 
     except Exception as e:
         logger.error(f"Error en el endpoint /webhook: {e}", exc_info=True)
         expected_response = f"{sesion.get('nombre', 'Cliente')}, disculpa, algo salió mal. Por favor, intenta de nuevo."
         respuesta, botones = generar_respuesta_ollama(texto, "Error en el procesamiento del mensaje.", False, expected_response, [])
-        logger.info(f"Respuesta del webhook: texto={respuesta}, botones={botones}")
+        log_evento(logger, "respuesta_webhook", cliente_id=cliente_id, texto=respuesta, botones=len(botones))
         return {"texto": respuesta, "botones": botones}
 
 
@@ -921,24 +1288,55 @@ async def webhook(req: Mensaje):
 # ----------------------
 @app.on_event("startup")
 async def startup_event():
+    lider.iniciar()
     scheduler.start()
-    logger.info("Scheduler inicializado con MongoDBJobStore")
+    logger.info(f"Scheduler inicializado ({'líder' if lider.es_lider else 'seguidor'} {lider.identidad})")
+    if lider.es_lider:
+        # Los trabajos ya no viven en scheduler_jobs: se quitan solo los que creaban versiones
+        # anteriores de este servidor (la colección puede ser compartida con otros schedulers)
+        db["scheduler_jobs"].delete_many({"$or": [{"_id": {"$in": TRABAJOS_LEGADOS}},
+                                                  {"_id": {"$regex": "^timeout_"}}]})
+    temporizador.iniciar()
+    # Solo el líder rearma los vencimientos pendientes; si cambia de líder, lo que quede
+    # sin temporizador lo recoge barrer_asignaciones_vencidas
+    if lider.es_lider:
+        temporizador.recuperar(
+            assignments_col, {"status": "pending_availability"}, check_timeout,
+            lambda doc: (doc["client_id"], doc["advisor_phone"], str(doc["_id"])),
+            vencimiento_por_defecto=lambda doc: doc["sent_time"] + timedelta(seconds=TIEMPO_RESPUESTA_EJECUTIVO)
+        )
+    padron.recargar()
+    padron.escuchar_cambios()
+    turnos.cargar()
+    # Recoge calendarios guardados por otros workers (entrar o salir de turno no requiere recargar)
+    scheduler.add_job(turnos.cargar, "interval", minutes=5, id="reload_shifts", replace_existing=True)
+    presencia.sincronizar()
+    # Cada worker guarda lo que observó y recoge lo de los demás
+    scheduler.add_job(presencia.sincronizar, "interval", seconds=30, id="sync_presence", replace_existing=True)
+    resincronizar_cargas()
+    scheduler.add_job(resincronizar_cargas, "interval", minutes=5, id="resync_advisor_load", replace_existing=True)
+    # Trabajos únicos: cada worker los programa pero solo el líder los ejecuta
+    scheduler.add_job(lider.solo_lider(despacho_periodico), "interval", minutes=1, id="dispatch_lead_queue",
+                      replace_existing=True)
+    scheduler.add_job(lider.solo_lider(barrer_asignaciones_vencidas), "interval", minutes=1,
+                      id="sweep_stale_assignments", replace_existing=True)
     # Programar refresco de cache cada 3 horas
-    scheduler.add_job(
-        lambda: (obtener_autos_nuevos(force_refresh=True), obtener_autos_usados(force_refresh=True)),
-        "interval",
-        hours=3,
-        id="refresh_car_cache",
-        replace_existing=True
-    )
-    # Refrescar cache al iniciar
-    obtener_autos_nuevos(force_refresh=True)
-    obtener_autos_usados(force_refresh=True)
+    scheduler.add_job(lider.solo_lider(refrescar_cache_autos), "interval", hours=3, id="refresh_car_cache",
+                      replace_existing=True)
+    # Refrescar cache al iniciar (la caché está en MongoDB: basta con que la refresque el líder)
+    if lider.es_lider:
+        refrescar_cache_autos()
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    temporizador.detener()
     scheduler.shutdown()
+    lider.renunciar()
+    presencia.sincronizar()
     logger.info("Scheduler detenido correctamente")
+    bitacora.cerrar()
+    logger.info(f"Bitácora vaciada: {bitacora.escritos} eventos escritos, {bitacora.descartados} descartados, "
+                f"{bitacora.rechazados} rechazados")
 
 if __name__ == "__main__":
     import uvicorn
@@ -11,6 +11,12 @@ import uvicorn
 import random
 import logging
 
+from historial import ultimos_mensajes, asegurar_indices_historial, MENSAJES_PROMPT
+from reasignacion import Reasignador
+from liderazgo import Liderazgo
+from padron_asesores import PadronAsesores, normalizar_telefono
+from asignacion import MotorAsignacion
+
 # Configurar logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s', filename='chatbot.log')
 logger = logging.getLogger(__name__)
@@ -33,6 +39,7 @@ asignaciones = db["asignaciones"]
 asesores_col = db["asesores"]
 sends = db["sends"]
 memoria_col = db["memoria_clientes"]
+asegurar_indices_historial(historial_col)
 
 # Inicializar colección de asesores
 def inicializar_asesores():
@@ -61,16 +68,18 @@ except Exception as e:
     logger.error(f"Error al iniciar scheduler: {str(e)}")
     raise
 
-def reasignar_pendientes():
-    try:
-        limite = datetime.now() - timedelta(minutes=5)
-        pendientes = asignaciones.find({"respuesta": None, "fecha": {"$lt": limite}})
-        for p in pendientes:
-            asignar_asesor_humano(p["cliente_id"])
-    except Exception as e:
-        logger.error(f"Error al reasignar pendientes: {str(e)}")
+# Asesores activos en memoria y motor de asignación (ASIGNACION_ESTRATEGIA).
+# Este servidor no cierra los leads aceptados, así que el cupo por asesor no se limita
+padron = PadronAsesores(asesores_col)
+padron.escuchar_cambios()
+motor_asignacion = MotorAsignacion(padron, capacidad=0)
 
-scheduler.add_job(reasignar_pendientes, 'interval', minutes=1)
+# Reasignación de pendientes vencidas, una sola vez por asignación (ver reasignacion.py)
+# Un solo proceso (el líder) reasigna aunque uvicorn corra con varios workers
+lider = Liderazgo(db)
+reasignador = Reasignador(asignaciones, lambda cliente_id: asignar_asesor_humano(cliente_id), lider=lider,
+                          liberar=motor_asignacion.liberar)
+lider.al_ganar(reasignador.notificar)
 
 # Modelos
 class Mensaje(BaseModel):
@@ -362,12 +371,16 @@ def asignar_asesor_humano(cliente_id: str):
             logger.warning(f"Datos incompletos para asignar asesor a {cliente_id}: {estado}")
             return
 
-        asesores = list(asesores_col.find({"activo": True}, {"telefono": 1, "_id": 0}))
-        if not asesores:
+        # Los que ya se consultaron (rechazaron o no respondieron) no se vuelven a preguntar
+        # Ronda completa sin respuesta: se vuelve a empezar en lugar de quedarse sin asesor
+        elegido, consultados = motor_asignacion.elegir_en_ronda(estado.get("asesores_consultados", []),
+                                                               tipo_auto=estado.get("tipo_auto"))
+        if not elegido:
             logger.warning("No hay asesores disponibles")
             return
 
-        asesor = asesores[0]["telefono"]
+        asesor = elegido["telefono"]
+        actualizar_estado(cliente_id, {"asesores_consultados": consultados})
         mensaje_asesor = (
             f"Hola 👋 {asesor},\n"
             f"Tienes un nuevo cliente potencial: {estado['nombre']}. "
@@ -387,12 +400,7 @@ def asignar_asesor_humano(cliente_id: str):
             "sent": False
         })
 
-        asignaciones.insert_one({
-            "cliente_id": cliente_id,
-            "asesor_phone": asesor,
-            "respuesta": None,
-            "fecha": datetime.now()
-        })
+        reasignador.registrar(cliente_id, asesor)
 
         mensaje_cliente = (
             f"Hola {estado['nombre']} 👋, "
@@ -468,7 +476,7 @@ async def webhook(mensaje: Mensaje):
             estado["confirmado"] = True
             logger.debug(f"Confirmado establecido para {cliente_id}: True")
 
-        historial = list(historial_col.find({"cliente_id": cliente_id}))
+        historial = ultimos_mensajes(historial_col, cliente_id, MENSAJES_PROMPT)
         historial_texto = [{"role": h["role"], "mensaje": h["mensaje"]} for h in historial]
 
         result = generar_respuesta_premium(texto, historial_texto, {**estado, "cliente_id": cliente_id})
@@ -499,10 +507,15 @@ async def advisor_response(response: AdvisorResponse):
         cliente_id = response.cliente_id
         respuesta = response.respuesta.lower()
         asesor_phone = response.asesor_phone
-        asignaciones.update_one(
-            {"cliente_id": cliente_id, "asesor_phone": asesor_phone},
-            {"$set": {"respuesta": respuesta, "fecha_respuesta": datetime.now()}}
+        # Solo la pendiente más reciente: una ya vencida la reasignó el Reasignador
+        asignacion = asignaciones.find_one_and_update(
+            {"cliente_id": cliente_id, "asesor_phone": normalizar_telefono(asesor_phone), "respuesta": None},
+            {"$set": {"respuesta": respuesta, "fecha_respuesta": datetime.now()}},
+            sort=[("fecha", -1)]
         )
+        if not asignacion:
+            logger.warning(f"Sin asignación pendiente de {asesor_phone} para {cliente_id}")
+            return {"status": "ignored"}
         estado = obtener_estado(cliente_id)
         if respuesta == "yes":
             mensaje = (
@@ -520,6 +533,7 @@ async def advisor_response(response: AdvisorResponse):
                 "sent": False
             })
         elif respuesta == "no":
+            motor_asignacion.liberar(normalizar_telefono(asesor_phone))
             asignar_asesor_humano(cliente_id)
         logger.info(f"Respuesta de asesor procesada para {cliente_id}: {respuesta}")
         return {"status": "success"}
@@ -538,6 +552,12 @@ def get_asesores():
         logger.error(f"Error en /get_asesores: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error del servidor: {str(e)}")
 
+# El hilo arranca cuando el módulo ya definió asignar_asesor_humano
+@app.on_event("startup")
+def iniciar_reasignador():
+    lider.iniciar()
+    reasignador.iniciar()
+
 # Ejecutar servidor
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=5000)
\ No newline at end of file
@@ -12,8 +12,15 @@ import uvicorn
 import random
 import logging
 
+from log_estructurado import configurar_logging
+from historial import ultimos_mensajes, asegurar_indices_historial, MENSAJES_PROMPT
+from reasignacion import Reasignador
+from liderazgo import Liderazgo
+from padron_asesores import PadronAsesores, normalizar_telefono
+from asignacion import MotorAsignacion
+
 # Configurar logging
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s', filename='chatbot.log')
+configurar_logging(archivo="chatbot.log")
 logger = logging.getLogger(__name__)
 
 app = FastAPI()
@@ -52,6 +59,7 @@ asignaciones = db["asignaciones"]
 asesores_col = db["asesores"]
 sends = db["sends"]
 memoria_col = db["memoria_clientes"]
+asegurar_indices_historial(historial_col)
 
 # Inicializar colección de asesores
 def inicializar_asesores():
@@ -82,16 +90,18 @@ except Exception as e:
     logger.error(f"Error al iniciar scheduler: {str(e)}")
     raise
 
-def reasignar_pendientes():
-    try:
-        limite = datetime.now() - timedelta(minutes=5)
-        pendientes = asignaciones.find({"respuesta": None, "fecha": {"$lt": limite}})
-        for p in pendientes:
-            asignar_asesor_humano(p["cliente_id"])
-    except Exception as e:
-        logger.error(f"Error al reasignar pendientes: {str(e)}")
+# Asesores activos en memoria y motor de asignación (ASIGNACION_ESTRATEGIA).
+# Este servidor no cierra los leads aceptados, así que el cupo por asesor no se limita
+padron = PadronAsesores(asesores_col)
+padron.escuchar_cambios()
+motor_asignacion = MotorAsignacion(padron, capacidad=0)
 
-scheduler.add_job(reasignar_pendientes, 'interval', minutes=1)
+# Reasignación de pendientes vencidas, una sola vez por asignación (ver reasignacion.py)
+# Un solo proceso (el líder) reasigna aunque uvicorn corra con varios workers
+lider = Liderazgo(db)
+reasignador = Reasignador(asignaciones, lambda cliente_id: asignar_asesor_humano(cliente_id), lider=lider,
+                          liberar=motor_asignacion.liberar)
+lider.al_ganar(reasignador.notificar)
 
 # Modelos
 class Mensaje(BaseModel):
@@ -419,12 +429,16 @@ def asignar_asesor_humano(cliente_id: str):
             logger.warning(f"Datos incompletos para asignar asesor a {cliente_id}: {estado}")
             return
 
-        asesores = list(asesores_col.find({"activo": True}, {"telefono": 1, "_id": 0}))
-        if not asesores:
+        # Los que ya se consultaron (rechazaron o no respondieron) no se vuelven a preguntar
+        # Ronda completa sin respuesta: se vuelve a empezar en lugar de quedarse sin asesor
+        elegido, consultados = motor_asignacion.elegir_en_ronda(estado.get("asesores_consultados", []),
+                                                               tipo_auto=estado.get("tipo_auto"))
+        if not elegido:
             logger.warning("No hay asesores disponibles")
             return
 
-        asesor = asesores[0]["telefono"]
+        asesor = elegido["telefono"]
+        actualizar_estado(cliente_id, {"asesores_consultados": consultados})
         mensaje_asesor = (
             f"Hola 👋 {asesor},\n"
             f"Tienes un nuevo cliente potencial: {estado['nombre']}. "
@@ -476,7 +490,7 @@ async def webhook(mensaje: Mensaje):
             return {"respuesta": "Error: Identificador de cliente inválido. 😔 Por favor, intenta de nuevo."}
 
         estado = obtener_estado(cliente_id)
-        historial = list(historial_col.find({"cliente_id": cliente_id}))
+        historial = ultimos_mensajes(historial_col, cliente_id, MENSAJES_PROMPT)
 
         # Evitar resetear si hay una conversación reciente confirmada
         if texto == "hola" and not estado.get("confirmado"):
@@ -556,11 +570,15 @@ async def advisor_response(response: AdvisorResponse):
         cliente_id = response.cliente_id
         respuesta = response.respuesta.lower()
         asesor_phone = response.asesor_phone
-        result = asignaciones.update_one(
-            {"cliente_id": cliente_id, "asesor_phone": asesor_phone},
-            {"$set": {"respuesta": respuesta, "fecha_respuesta": datetime.now()}}
+        # Solo la pendiente más reciente: una ya vencida la reasignó el Reasignador
+        asignacion = asignaciones.find_one_and_update(
+            {"cliente_id": cliente_id, "asesor_phone": normalizar_telefono(asesor_phone), "respuesta": None},
+            {"$set": {"respuesta": respuesta, "fecha_respuesta": datetime.now()}},
+            sort=[("fecha", -1)]
         )
-        logger.debug(f"Respuesta de asesor actualizada para {cliente_id}: {respuesta}, Resultado: matched={result.matched_count}, modified={result.modified_count}")
+        if not asignacion:
+            logger.warning(f"Sin asignación pendiente de {asesor_phone} para {cliente_id}")
+            return {"status": "ignored"}
         estado = obtener_estado(cliente_id)
         if respuesta == "yes":
             mensaje = (
@@ -580,6 +598,7 @@ async def advisor_response(response: AdvisorResponse):
             })
             logger.debug(f"Mensaje a cliente guardado para {cliente_id}: ID={result.inserted_id}")
         elif respuesta == "no":
+            motor_asignacion.liberar(normalizar_telefono(asesor_phone))
             asignar_asesor_humano(cliente_id)
         logger.info(f"Respuesta de asesor procesada para {cliente_id}: {respuesta}")
         return {"status": "success"}
@@ -598,6 +617,12 @@ def get_asesores():
         logger.error(f"Error en /get_asesores: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error del servidor: {str(e)}")
 
+# El hilo arranca cuando el módulo ya definió asignar_asesor_humano
+@app.on_event("startup")
+def iniciar_reasignador():
+    lider.iniciar()
+    reasignador.iniciar()
+
 # Ejecutar servidor
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=5000)
\ No newline at end of file
@@ -1,7 +1,8 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query
 from pydantic import BaseModel
 from pymongo import MongoClient
 from pymongo.errors import ServerSelectionTimeoutError, WriteError
+from bson import ObjectId
 from apscheduler.schedulers.background import BackgroundScheduler
 import ollama
 import re
@@ -17,8 +18,21 @@ import whisper
 from rapidfuzz import process, fuzz
 from unidecode import unidecode
 
+from conversacion import Conversacion, cargar_conversacion, guardar_conversacion
+from almacen_sesiones import crear_almacen
+from archivador import cargar_conversacion_archivada
+from busqueda import asegurar_indices_busqueda, buscar, indexar_mensaje, indice_de, metricas as metricas_busqueda, RESULTADOS_POR_PAGINA, RESULTADOS_MAXIMOS
+from log_estructurado import configurar_logging, log_evento
+from outbox import encolar
+from padron_asesores import PadronAsesores, normalizar_telefono
+from asignacion import MotorAsignacion
+from reasignacion import Reasignador
+from liderazgo import Liderazgo
+from botones import botones_disponibilidad, cargar_secreto, leer_boton
+from historial import asegurar_indices_historial, guardar_mensaje_historial, pagina_historial, PAGINA_DASHBOARD, PAGINA_MAXIMA
+
 # ------------------ CONFIG LOGGING ------------------
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s', filename='chatbot.log')
+configurar_logging(archivo="chatbot.log")
 logger = logging.getLogger(__name__)
 
 app = FastAPI()
@@ -30,7 +44,7 @@ try:
     logger.info("Conexión a MongoDB exitosa")
     db = client["chatbotdb"]
     collections = db.list_collection_names()
-    required_collections = ["test", "estado_conversacion", "historial", "memoria_clientes", "asignaciones", "asesores", "sends"]
+    required_collections = ["test", "conversaciones", "historial", "asignaciones", "asesores", "sends"]
     for coll in required_collections:
         if coll not in collections:
             db.create_collection(coll)
@@ -43,11 +57,16 @@ except Exception as e:
 
 db = client["chatbotdb"]
 historial_col = db["historial"]
-estado_conversacion = db["estado_conversacion"]
+conversaciones_col = db["conversaciones"]
 asignaciones = db["asignaciones"]
 asesores_col = db["asesores"]
 sends = db["sends"]
-memoria_col = db["memoria_clientes"]
+asegurar_indices_historial(historial_col)
+indice_busqueda = indice_de(historial_col)
+asegurar_indices_busqueda(indice_busqueda)
+
+# Backend de sesiones según CHATBOT_SESSION_BACKEND (mongo por defecto)
+almacen_sesiones = crear_almacen(coleccion=conversaciones_col)
 
 # ------------------ INICIALIZAR ASESORES ------------------
 def inicializar_asesores():
@@ -62,20 +81,25 @@ def inicializar_asesores():
 
 inicializar_asesores()
 
+# Asesores activos en memoria y motor de asignación (ASIGNACION_ESTRATEGIA).
+# Este servidor no cierra los leads aceptados, así que el cupo por asesor no se limita
+padron = PadronAsesores(asesores_col)
+padron.escuchar_cambios()
+motor_asignacion = MotorAsignacion(padron, capacidad=0)
+
 # ------------------ SCHEDULER ------------------
 scheduler = BackgroundScheduler()
 scheduler.start()
 
-def reasignar_pendientes():
-    try:
-        limite = datetime.now() - timedelta(minutes=5)
-        pendientes = asignaciones.find({"respuesta": None, "fecha": {"$lt": limite}})
-        for p in pendientes:
-            asignar_asesor_humano(p["cliente_id"])
-    except Exception as e:
-        logger.error(f"Error reasignando pendientes: {str(e)}")
+# Reasignación de pendientes vencidas, una sola vez por asignación (ver reasignacion.py)
+# Un solo proceso (el líder) reasigna aunque uvicorn corra con varios workers
+lider = Liderazgo(db)
+reasignador = Reasignador(asignaciones, lambda cliente_id: asignar_asesor_humano(cliente_id), lider=lider,
+                          liberar=motor_asignacion.liberar)
+lider.al_ganar(reasignador.notificar)
 
-scheduler.add_job(reasignar_pendientes, 'interval', minutes=1)
+# Botones de disponibilidad con el id de la asignación firmado (ver botones.py)
+secreto_botones = cargar_secreto(db)
 
 # ------------------ MODELOS ------------------
 class Mensaje(BaseModel):
@@ -88,30 +112,30 @@ class AdvisorResponse(BaseModel):
     respuesta: str
     asesor_phone: str
 
+class GatewayCallback(BaseModel):
+    button_id: str
+    jid: str | None = None  # remitente, si el gateway lo reporta
+
 # ------------------ AUXILIARES ------------------
 def actualizar_estado(cliente_id: str, nuevo_estado: dict):
     try:
-        estado_conversacion.update_one({"_id": cliente_id}, {"$set": nuevo_estado}, upsert=True)
+        almacen_sesiones.actualizar_estado(cliente_id, nuevo_estado)
     except Exception as e:
         logger.error(f"Error actualizar estado: {str(e)}")
 
 def obtener_estado(cliente_id: str) -> dict:
     try:
-        estado = estado_conversacion.find_one({"_id": cliente_id})
-        return estado if estado else {}
+        return almacen_sesiones.obtener_estado(cliente_id)
     except Exception as e:
         logger.error(f"Error obtener estado: {str(e)}")
         return {}
 
 def guardar_mensaje(cliente_id: str, mensaje: str, role: str):
     try:
-        result = historial_col.insert_one({
-            "cliente_id": cliente_id,
-            "mensaje": mensaje,
-            "role": role,
-            "fecha": datetime.now()
-        })
-        logger.debug(f"Mensaje guardado para {cliente_id}: {mensaje} ({role}), ID insertado: {result.inserted_id}")
+        fecha = datetime.now()
+        mensaje_id = guardar_mensaje_historial(historial_col, cliente_id, mensaje, role, fecha)
+        indexar_mensaje(indice_busqueda, mensaje_id, cliente_id, mensaje, role, fecha)
+        log_evento(logger, "mensaje_guardado", logging.DEBUG, cliente_id=cliente_id, role=role, mensaje=mensaje)
     except WriteError as e:
         logger.error(f"Error de escritura al guardar mensaje para {cliente_id}: {str(e)}")
     except Exception as e:
@@ -140,7 +164,7 @@ def obtener_modelos_oficiales():
                         modelos.add(model.title())
         modelos_list = list(modelos) if modelos else predefined_models
         modelos_list = list(dict.fromkeys(modelos_list))  # Eliminar duplicados
-        logger.debug(f"Modelos recuperados: {modelos_list}")
+        log_evento(logger, "modelos_recuperados", logging.DEBUG, total=len(modelos_list), modelos=modelos_list)
         return modelos_list
     except Exception as e:
         logger.error(f"Error al obtener modelos oficiales: {str(e)}")
@@ -159,37 +183,12 @@ def obtener_detalles_modelo(modelo: str):
                 info['descripcion'] = text.title()
                 break
         result = info if info else {"descripcion": f"Información de {modelo} no disponible en línea."}
-        logger.debug(f"Detalles recuperados para {modelo}: {result}")
+        log_evento(logger, "detalles_modelo", logging.DEBUG, modelo=modelo, detalles=result)
         return result
     except Exception as e:
         logger.error(f"Error al obtener detalles del modelo {modelo}: {str(e)}")
         return {"descripcion": f"Error al consultar el modelo {modelo}"}
 
-# Memoria avanzada
-def actualizar_memoria_avanzada(cliente_id: str, nuevo_dato: dict):
-    try:
-        result = memoria_col.update_one(
-            {"_id": cliente_id},
-            {"$set": nuevo_dato},
-            upsert=True
-        )
-        logger.debug(f"Memoria actualizada para {cliente_id}: {nuevo_dato}, Resultado: matched={result.matched_count}, modified={result.modified_count}, upserted={result.upserted_id}")
-    except WriteError as e:
-        logger.error(f"Error de escritura al actualizar memoria para {cliente_id}: {str(e)}")
-    except Exception as e:
-        logger.error(f"Error inesperado al actualizar memoria para {cliente_id}: {str(e)}")
-
-def obtener_memoria_avanzada(cliente_id: str) -> dict:
-    try:
-        memoria = memoria_col.find_one({"_id": cliente_id})
-        if not memoria:
-            memoria = {"modelos_favoritos": [], "tipo_auto_preferido": None, "emociones": [], "ultima_pregunta": "", "tipo_vehiculo": None}
-        logger.debug(f"Memoria recuperada para {cliente_id}: {memoria}")
-        return memoria
-    except Exception as e:
-        logger.error(f"Error al recuperar memoria para {cliente_id}: {str(e)}")
-        return {"modelos_favoritos": [], "tipo_auto_preferido": None, "emociones": [], "ultima_pregunta": "", "tipo_vehiculo": None}
-
 def detectar_emocion(texto: str) -> str:
     texto = texto.lower()
     if any(p in texto for p in ["emocionado", "genial", "excelente", "perfecto", "okey", "claro", "si esta bien"]):
@@ -201,25 +200,6 @@ def detectar_emocion(texto: str) -> str:
     else:
         return "neutral"
 
-def resumir_historial_emociones(historial, estado, memoria, max_msgs=5):
-    try:
-        resumen = []
-        for h in historial[-max_msgs:]:
-            role = "Usuario" if h["role"] == "user" else "Asistente"
-            mensaje = h["mensaje"]
-            resumen.append(f"{role}: {mensaje}")
-        estado_str = ", ".join([f"{k}: {v}" for k, v in estado.items() if k in ["nombre", "tipo_auto", "tipo_vehiculo", "modelo", "confirmado"]])
-        resumen.append(f"[Resumen de estado: {estado_str}]")
-        memoria_str = ", ".join([f"{k}: {v}" for k, v in memoria.items() if k != "emociones"])
-        emociones_str = ", ".join(memoria.get("emociones", []))
-        resumen.append(f"[Memoria del cliente: {memoria_str}]")
-        resumen.append(f"[Emociones detectadas: {emociones_str}]")
-        logger.debug(f"Resumen historial para {estado.get('cliente_id','')}: {resumen}")
-        return "\n".join(resumen)
-    except Exception as e:
-        logger.error(f"Error al resumir historial: {str(e)}")
-        return ""
-
 def es_contacto_valido(telefono: str) -> bool:
     return bool(re.match(r'^\d{10,}$', telefono))
 
@@ -263,15 +243,15 @@ def parsear_entrada(texto: str) -> tuple:
     return nombre, tipo_auto, tipo_vehiculo
 
 # Generar respuesta premium
-def generar_respuesta_premium(mensaje: str, historial: list, estado: dict) -> dict:
+def generar_respuesta_premium(mensaje: str, historial: list, estado: dict, conversacion: Conversacion) -> dict:
     try:
         cliente_id = estado.get("cliente_id", "")
-        logger.debug(f"Generando respuesta para cliente_id={cliente_id}, mensaje={mensaje}")
-        memoria = obtener_memoria_avanzada(cliente_id)
+        log_evento(logger, "generando_respuesta", logging.DEBUG, cliente_id=cliente_id, mensaje=mensaje)
+        memoria = conversacion.memoria
         emocion_actual = detectar_emocion(mensaje)
+        conversacion.registrar_emocion(emocion_actual)
         if emocion_actual not in memoria["emociones"]:
-            memoria["emociones"].append(emocion_actual)
-            actualizar_memoria_avanzada(cliente_id, {"emociones": memoria["emociones"]})
+            conversacion.actualizar_memoria({"emociones": memoria["emociones"] + [emocion_actual]})
 
         saludos = {
             "positivo": [
@@ -314,26 +294,26 @@ def generar_respuesta_premium(mensaje: str, historial: list, estado: dict) -> di
             saludo = random.choice(saludos.get(emocion_actual, saludos["neutral"])).format(nombre=estado.get("nombre", ""))
             respuesta = f"{saludo} Ya tenemos registrado tu interés en un {estado.get('tipo_auto', '')} {estado.get('modelo', '')} ({estado.get('tipo_vehiculo', '')}). ¿Quieres continuar con eso o prefieres explorar otras opciones?"
             logger.debug(f"Respuesta generada para {cliente_id} (conversación previa): {respuesta}")
-            actualizar_memoria_avanzada(cliente_id, {"ultima_pregunta": mensaje})
+            conversacion.actualizar_memoria({"ultima_pregunta": mensaje})
             return {"respuesta": respuesta, "enviar_a_asesor": False}
 
         # Flujo estándar
         if not estado.get("nombre"):
             respuesta = random.choice(saludos_nuevo)
             logger.debug(f"Respuesta generada para {cliente_id} (sin nombre): {respuesta}")
-            actualizar_memoria_avanzada(cliente_id, {"ultima_pregunta": mensaje})
+            conversacion.actualizar_memoria({"ultima_pregunta": mensaje})
             return {"respuesta": respuesta, "enviar_a_asesor": False}
         elif "nombre" in estado and not estado.get("tipo_auto"):
             transicion = random.choice(transiciones.get(emocion_actual, transiciones["neutral"]))
             respuesta = f"{transicion} ¿Buscas un auto nuevo o usado?"
             logger.debug(f"Respuesta generada para {cliente_id} (sin tipo_auto): {respuesta}")
-            actualizar_memoria_avanzada(cliente_id, {"ultima_pregunta": mensaje})
+            conversacion.actualizar_memoria({"ultima_pregunta": mensaje})
             return {"respuesta": respuesta, "enviar_a_asesor": False}
         elif "nombre" in estado and "tipo_auto" in estado and not estado.get("tipo_vehiculo"):
             transicion = random.choice(transiciones.get(emocion_actual, transiciones["neutral"]))
             respuesta = f"{transicion} ¡Estupendo! ¿Qué tipo de vehículo prefieres? Por ejemplo: SUV, sedán o compacto."
             logger.debug(f"Respuesta generada para {cliente_id} (sin tipo_vehiculo): {respuesta}")
-            actualizar_memoria_avanzada(cliente_id, {"ultima_pregunta": mensaje})
+            conversacion.actualizar_memoria({"ultima_pregunta": mensaje})
             return {"respuesta": respuesta, "enviar_a_asesor": False}
         elif "nombre" in estado and "tipo_auto" in estado and "tipo_vehiculo" in estado and not estado.get("modelo"):
             transicion = random.choice(transiciones.get(emocion_actual, transiciones["neutral"]))
@@ -346,24 +326,24 @@ def generar_respuesta_premium(mensaje: str, historial: list, estado: dict) -> di
             modelos = modelos_por_tipo.get(estado["tipo_vehiculo"], modelos_web)
             respuesta = f"{transicion} Ahora, ¿qué modelo te interesa? Tenemos: {', '.join(modelos)}."
             logger.debug(f"Respuesta generada para {cliente_id} (sin modelo): {respuesta}")
-            actualizar_memoria_avanzada(cliente_id, {"ultima_pregunta": mensaje})
+            conversacion.actualizar_memoria({"ultima_pregunta": mensaje})
             return {"respuesta": respuesta, "enviar_a_asesor": False}
         elif all(k in estado for k in ["nombre", "tipo_auto", "tipo_vehiculo", "modelo"]) and not estado.get("confirmado"):
             transicion = random.choice(transiciones.get(emocion_actual, transiciones["neutral"]))
             detalles = obtener_detalles_modelo(estado["modelo"])
             respuesta = f"{transicion} Confirmemos tus datos: {estado['tipo_auto']} {estado['modelo']} ({estado['tipo_vehiculo']}). {detalles.get('descripcion','')} ¿Es correcto? Responde 'Sí' o 'No'."
             logger.debug(f"Respuesta generada para {cliente_id} (sin confirmado): {respuesta}")
-            actualizar_memoria_avanzada(cliente_id, {"ultima_pregunta": mensaje})
+            conversacion.actualizar_memoria({"ultima_pregunta": mensaje})
             return {"respuesta": respuesta, "enviar_a_asesor": False}
         elif all(k in estado for k in ["nombre", "tipo_auto", "tipo_vehiculo", "modelo", "confirmado"]):
             transicion = random.choice(transiciones.get(emocion_actual, transiciones["neutral"]))
             respuesta = f"{transicion} Hola {estado.get('nombre','')}, un asesor te contactará pronto para seguir con tu {estado.get('tipo_auto','')} {estado.get('modelo','')}."
             logger.debug(f"Respuesta generada para {cliente_id} (confirmado): {respuesta}")
-            actualizar_memoria_avanzada(cliente_id, {"ultima_pregunta": mensaje})
+            conversacion.actualizar_memoria({"ultima_pregunta": mensaje})
             return {"respuesta": respuesta, "enviar_a_asesor": True}
 
         # Respuesta fallback con Ollama
-        historial_resumido = resumir_historial_emociones(historial, estado, memoria)
+        historial_resumido = conversacion.texto_resumen()
         prompt_base = (
             f"Eres Alex, asistente de ventas de Volkswagen Eurocity Culiacán. "
             f"Tu estilo es humano, cercano, profesional y amable. Usa emojis moderadamente para sonar natural. 😊 "
@@ -384,15 +364,14 @@ def generar_respuesta_premium(mensaje: str, historial: list, estado: dict) -> di
         if "modelo" in estado:
             modelos_prev = memoria.get("modelos_favoritos", [])
             if estado["modelo"] not in modelos_prev:
-                modelos_prev.append(estado["modelo"])
-                actualizar_memoria_avanzada(cliente_id, {"modelos_favoritos": modelos_prev})
+                conversacion.actualizar_memoria({"modelos_favoritos": modelos_prev + [estado["modelo"]]})
         if "tipo_auto" in estado:
-            actualizar_memoria_avanzada(cliente_id, {"tipo_auto_preferido": estado["tipo_auto"]})
+            conversacion.actualizar_memoria({"tipo_auto_preferido": estado["tipo_auto"]})
         if "tipo_vehiculo" in estado:
-            actualizar_memoria_avanzada(cliente_id, {"tipo_vehiculo": estado["tipo_vehiculo"]})
-        actualizar_memoria_avanzada(cliente_id, {"ultima_pregunta": mensaje})
+            conversacion.actualizar_memoria({"tipo_vehiculo": estado["tipo_vehiculo"]})
+        conversacion.actualizar_memoria({"ultima_pregunta": mensaje})
 
-        logger.debug(f"Respuesta ollama generada para {cliente_id}: {texto_respuesta}")
+        log_evento(logger, "respuesta_ollama", logging.DEBUG, cliente_id=cliente_id, respuesta=texto_respuesta)
         return {"respuesta": texto_respuesta, "enviar_a_asesor": False}
 
     except Exception as e:
@@ -407,12 +386,15 @@ def asignar_asesor_humano(cliente_id: str):
             logger.warning(f"Datos incompletos para asignar asesor a {cliente_id}: {estado}")
             return
 
-        asesores = list(asesores_col.find({"activo": True}, {"telefono": 1, "_id": 0}))
-        if not asesores:
+        # Ronda completa sin respuesta: se vuelve a empezar en lugar de quedarse sin asesor
+        elegido, consultados = motor_asignacion.elegir_en_ronda(estado.get("asesores_consultados", []),
+                                                               tipo_auto=estado.get("tipo_auto"))
+        if not elegido:
             logger.warning("No hay asesores disponibles")
             return
 
-        asesor = asesores[0]["telefono"]
+        asesor = elegido["telefono"]
+        actualizar_estado(cliente_id, {"asesores_consultados": consultados})
         mensaje_asesor = (
             f"Hola 👋 {asesor},\n"
             f"Tienes un nuevo cliente potencial: {estado['nombre']}. "
@@ -420,29 +402,22 @@ def asignar_asesor_humano(cliente_id: str):
             f"¿Estás disponible para contactarlo ahora? Por favor responde 'Sí' o 'No'."
         )
 
-        result = sends.insert_one({
-            "jid": f"{asesor}@s.whatsapp.net",
-            "message": {
-                "text": mensaje_asesor,
-                "buttons": [
-                    {"buttonId": f"yes_{cliente_id}", "buttonText": {"displayText": "✅ Sí"}, "type": 1},
-                    {"buttonId": f"no_{cliente_id}", "buttonText": {"displayText": "❌ No"}, "type": 1}
-                ]
-            },
-            "sent": False
-        })
+        # El id de la asignación va firmado en los botones: la respuesta la ubica por _id
+        asignacion_id = ObjectId()
+        result = encolar(sends, f"{asesor}@s.whatsapp.net", {
+            "text": mensaje_asesor,
+            "buttons": botones_disponibilidad(secreto_botones, asignacion_id, si="✅ Sí", no="❌ No")
+        }, carril="disponibilidad")
         logger.debug(f"Mensaje a asesor guardado para {cliente_id}: ID={result.inserted_id}")
+        # Pendiente de respuesta: si vence, Reasignador la pasa al siguiente asesor una sola vez
+        reasignador.registrar(cliente_id, asesor, _id=asignacion_id)
 
         mensaje_cliente = (
             f"Hola {estado['nombre']} 👋, "
             f"hemos confirmado tus datos: {estado['tipo_auto']} {estado['modelo']} ({estado['tipo_vehiculo']}). "
             f"Un asesor se pondrá en contacto contigo muy pronto para ayudarte."
         )
-        result = sends.insert_one({
-            "jid": cliente_id,
-            "message": {"text": mensaje_cliente},
-            "sent": False
-        })
+        result = encolar(sends, cliente_id, {"text": mensaje_cliente}, carril="asignacion")
         logger.debug(f"Mensaje a cliente guardado para {cliente_id}: ID={result.inserted_id}")
 
         logger.info(f"Asignado asesor {asesor} a {cliente_id} con mensaje humano.")
@@ -471,25 +446,25 @@ async def webhook(mensaje: Mensaje):
         if mensaje.audio_path:
             texto = transcribir_audio(mensaje.audio_path).lower()
 
-        logger.debug(f"Webhook recibido: cliente_id={cliente_id}, texto={texto}")
+        log_evento(logger, "webhook_recibido", logging.DEBUG, cliente_id=cliente_id, texto=texto)
 
         # Validar cliente_id
         if not cliente_id or "@s.whatsapp.net" not in cliente_id:
             logger.error(f"cliente_id inválido: {cliente_id}")
             return {"respuesta": "Error: Identificador de cliente inválido. 😔 Por favor, intenta de nuevo."}
 
-        estado = obtener_estado(cliente_id)
-        historial = list(historial_col.find({"cliente_id": cliente_id}))
+        conversacion = cargar_conversacion(almacen_sesiones, cliente_id)
+        estado = conversacion.estado
+        historial = list(conversacion.recientes)
 
         # Evitar resetear si hay una conversación reciente confirmada
         if texto == "hola" and not estado.get("confirmado"):
             try:
-                estado_conversacion.delete_one({"_id": cliente_id})
-                memoria_col.delete_one({"_id": cliente_id})
+                conversacion.reiniciar()
                 asignaciones.delete_one({"_id": cliente_id})
                 sends.delete_many({"jid": cliente_id})
                 logger.info(f"Estado reseteado forzosamente para {cliente_id} por 'hola' (sin confirmación previa)")
-                estado = {}
+                estado = conversacion.estado
             except Exception as e:
                 logger.error(f"Error al resetear estado para {cliente_id}: {str(e)}")
 
@@ -498,42 +473,41 @@ async def webhook(mensaje: Mensaje):
         if "telefono" not in estado and "@s.whatsapp.net" in cliente_id:
             phone = cliente_id.split("@")[0]
             if es_contacto_valido(phone):
-                actualizar_estado(cliente_id, {"telefono": phone})
-                estado["telefono"] = phone
+                conversacion.actualizar_estado({"telefono": phone})
 
         nombre, tipo_auto, tipo_vehiculo = parsear_entrada(texto)
 
         if "nombre" not in estado and nombre:
-            actualizar_estado(cliente_id, {"nombre": nombre})
-            estado["nombre"] = nombre
+            conversacion.actualizar_estado({"nombre": nombre})
         if "nombre" in estado and "tipo_auto" not in estado and tipo_auto:
-            actualizar_estado(cliente_id, {"tipo_auto": tipo_auto})
-            estado["tipo_auto"] = tipo_auto
+            conversacion.actualizar_estado({"tipo_auto": tipo_auto})
         if "nombre" in estado and "tipo_auto" in estado and "tipo_vehiculo" not in estado and tipo_vehiculo:
-            actualizar_estado(cliente_id, {"tipo_vehiculo": tipo_vehiculo})
-            estado["tipo_vehiculo"] = tipo_vehiculo
+            conversacion.actualizar_estado({"tipo_vehiculo": tipo_vehiculo})
 
         # Detectar modelo y confirmación
         texto_norm = texto.lower()
         if "nombre" in estado and "tipo_auto" in estado and "tipo_vehiculo" in estado and "modelo" not in estado:
             for model in ['jetta', 'tiguan', 'virtus', 'taos', 'teramont', 't-cross', 'polo']:
                 if model in texto_norm:
-                    actualizar_estado(cliente_id, {"modelo": model.title()})
-                    estado["modelo"] = model.title()
+                    conversacion.actualizar_estado({"modelo": model.title()})
                     break
         elif all(k in estado for k in ["nombre", "tipo_auto", "tipo_vehiculo", "modelo"]) and texto_norm in ["sí", "si"]:
-            actualizar_estado(cliente_id, {"confirmado": True})
-            estado["confirmado"] = True
+            conversacion.actualizar_estado({"confirmado": True})
 
         historial_texto = [{"role": h["role"], "mensaje": h["mensaje"]} for h in historial]
-        result = generar_respuesta_premium(texto, historial_texto, {**estado, "cliente_id": cliente_id})
+        result = generar_respuesta_premium(texto, historial_texto, {**estado, "cliente_id": cliente_id}, conversacion)
         respuesta = result["respuesta"]
         enviar_a_asesor = result["enviar_a_asesor"]
 
         guardar_mensaje(cliente_id, respuesta, "assistant")
-        sends.insert_one({"jid": cliente_id, "message": {"text": respuesta}, "sent": False})
-        logger.debug(f"Respuesta guardada para enviar a {cliente_id}: {respuesta}, ID={result.inserted_id}")
+        # El resumen incorpora el turno completo después de generar la respuesta
+        conversacion.agregar_mensaje("user", texto)
+        conversacion.agregar_mensaje("assistant", respuesta)
+        # Una sola escritura con estado, memoria y turnos del mensaje
+        guardar_conversacion(almacen_sesiones, conversacion)
 
+        envio = encolar(sends, cliente_id, {"text": respuesta}, carril="conversacion")
+        log_evento(logger, "respuesta_encolada", logging.DEBUG, cliente_id=cliente_id, respuesta=respuesta, envio_id=envio.inserted_id)
 
         if enviar_a_asesor:
             asignar_asesor_humano(cliente_id)
@@ -551,48 +525,119 @@ async def advisor_response(response: AdvisorResponse):
         cliente_id = response.cliente_id
         respuesta = response.respuesta.lower()
         asesor_phone = response.asesor_phone
-        result = asignaciones.update_one(
-            {"cliente_id": cliente_id, "asesor_phone": asesor_phone},
-            {"$set": {"respuesta": respuesta, "fecha_respuesta": datetime.now()}}
+        # Solo la pendiente más reciente: una ya vencida la reasignó el Reasignador
+        asignacion = asignaciones.find_one_and_update(
+            {"cliente_id": cliente_id, "asesor_phone": normalizar_telefono(asesor_phone), "respuesta": None},
+            {"$set": {"respuesta": respuesta, "fecha_respuesta": datetime.now()}},
+            sort=[("fecha", -1)]
         )
-        logger.debug(f"Respuesta de asesor actualizada para {cliente_id}: {respuesta}, Resultado: matched={result.matched_count}, modified={result.modified_count}")
-        estado = obtener_estado(cliente_id)
-        if respuesta == "yes":
-            mensaje = (
-                f"Contacta a {estado['nombre']} interesado en adquirir un auto ({estado['tipo_auto']}) "
-                f"{estado['modelo']} ({estado['tipo_vehiculo']}) al número {estado['telefono']}"
-            )
-            result = sends.insert_one({
-                "jid": f"{asesor_phone}@s.whatsapp.net",
-                "message": {"text": mensaje},
-                "sent": False
-            })
-            logger.debug(f"Mensaje a asesor guardado para {cliente_id}: ID={result.inserted_id}")
-            result = sends.insert_one({
-                "jid": cliente_id,
-                "message": {"text": f"Hola, {estado['nombre']}. Un asesor te contactará pronto."},
-                "sent": False
-            })
-            logger.debug(f"Mensaje a cliente guardado para {cliente_id}: ID={result.inserted_id}")
-        elif respuesta == "no":
-            asignar_asesor_humano(cliente_id)
-        logger.info(f"Respuesta de asesor procesada para {cliente_id}: {respuesta}")
+        if not asignacion:
+            logger.warning(f"Sin asignación pendiente de {asesor_phone} para {cliente_id}")
+            return {"status": "ignored"}
+        procesar_respuesta_asesor(cliente_id, asesor_phone, respuesta)
         return {"status": "success"}
     except Exception as e:
         logger.error(f"Error en advisor_response: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error del servidor: {str(e)}")
 
+# Botón pulsado por el asesor, con el buttonId tal como lo reporta el gateway
+@app.post("/gateway_callback")
+async def gateway_callback(callback: GatewayCallback):
+    leido = leer_boton(secreto_botones, callback.button_id)
+    if leido is None:
+        raise HTTPException(status_code=400, detail="Botón no reconocido")
+    respuesta, asignacion_id = leido
+    try:
+        filtro = {"_id": asignacion_id, "respuesta": None}
+        if callback.jid:
+            filtro["asesor_phone"] = normalizar_telefono(callback.jid.split("@")[0])
+        # Un solo paso por _id: si ya respondió o el Reasignador la reclamó, no cambia nada
+        asignacion = asignaciones.find_one_and_update(
+            filtro, {"$set": {"respuesta": respuesta, "fecha_respuesta": datetime.now()}}
+        )
+        if not asignacion:
+            logger.warning(f"Asignación {asignacion_id} ya respondida, vencida o de otro asesor")
+            return {"status": "ignored"}
+        procesar_respuesta_asesor(asignacion["cliente_id"], asignacion["asesor_phone"], respuesta)
+        return {"status": "success"}
+    except Exception as e:
+        logger.error(f"Error en gateway_callback: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error del servidor: {str(e)}")
+
+def procesar_respuesta_asesor(cliente_id: str, asesor_phone: str, respuesta: str):
+    """Mensajes y reasignación una vez registrada la respuesta en `asignaciones`."""
+    estado = obtener_estado(cliente_id)
+    if respuesta == "yes":
+        mensaje = (
+            f"Contacta a {estado['nombre']} interesado en adquirir un auto ({estado['tipo_auto']}) "
+            f"{estado['modelo']} ({estado['tipo_vehiculo']}) al número {estado['telefono']}"
+        )
+        result = encolar(sends, f"{asesor_phone}@s.whatsapp.net", {"text": mensaje}, carril="asignacion")
+        logger.debug(f"Mensaje a asesor guardado para {cliente_id}: ID={result.inserted_id}")
+        result = encolar(sends, cliente_id, {"text": f"Hola, {estado['nombre']}. Un asesor te contactará pronto."},
+                         carril="asignacion")
+        logger.debug(f"Mensaje a cliente guardado para {cliente_id}: ID={result.inserted_id}")
+    elif respuesta == "no":
+        motor_asignacion.liberar(normalizar_telefono(asesor_phone))
+        asignar_asesor_humano(cliente_id)
+    logger.info(f"Respuesta de asesor procesada para {cliente_id}: {respuesta}")
+
 # Obtener asesores
 @app.get("/get_asesores")
 def get_asesores():
     try:
-        asesores = list(asesores_col.find({"activo": True}, {"telefono": 1, "_id": 0}))
-        logger.debug(f"Asesores recuperados: {[a['telefono'] for a in asesores if 'telefono' in a]}")
-        return [a["telefono"] for a in asesores if "telefono" in a]
+        asesores = padron.instantanea()
+        log_evento(logger, "asesores_recuperados", logging.DEBUG, total=len(asesores))
+        return [a["telefono"] for a in asesores]
     except Exception as e:
         logger.error(f"Error en /get_asesores: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error del servidor: {str(e)}")
 
+# Historial paginado para el dashboard
+@app.get("/historial/{cliente_id}")
+def historial_cliente(cliente_id: str, cursor: str | None = None,
+                      limite: int = Query(PAGINA_DASHBOARD, ge=1, le=PAGINA_MAXIMA)):
+    try:
+        mensajes, siguiente = pagina_historial(historial_col, cliente_id, cursor, limite)
+        return {"mensajes": mensajes, "siguiente": siguiente}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error en /historial: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error del servidor: {str(e)}")
+
+# Búsqueda de texto sobre conversaciones para asesores
+@app.get("/buscar")
+def buscar_conversaciones(q: str, cursor: str | None = None,
+                          por_pagina: int = Query(RESULTADOS_POR_PAGINA, ge=1, le=RESULTADOS_MAXIMOS),
+                          cliente_id: str | None = None):
+    try:
+        return buscar(indice_busqueda, q, cursor, por_pagina, cliente_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error en /buscar: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error del servidor: {str(e)}")
+
+@app.get("/buscar/metricas")
+def metricas_de_busqueda():
+    return metricas_busqueda.resumen()
+
+# Conversación archivada en frío (ver archivador.py), bajo demanda para asesores
+@app.get("/historial/{cliente_id}/archivo")
+def historial_archivado(cliente_id: str, desde: datetime | None = None, hasta: datetime | None = None):
+    try:
+        return {"mensajes": cargar_conversacion_archivada(cliente_id, desde, hasta)}
+    except Exception as e:
+        logger.error(f"Error en /historial/archivo: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error del servidor: {str(e)}")
+
+# El hilo arranca cuando el módulo ya definió asignar_asesor_humano
+@app.on_event("startup")
+def iniciar_reasignador():
+    lider.iniciar()
+    reasignador.iniciar()
+
 # Ejecutar servidor
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=5000)
@@ -12,9 +12,14 @@ import whisper
 import ollama
 from rapidfuzz import process, fuzz
 
+from log_estructurado import configurar_logging
+from reasignacion import Reasignador
+from liderazgo import Liderazgo
+from padron_asesores import PadronAsesores
+from asignacion import MotorAsignacion
+
 # ---------------- LOGGING ----------------
-logging.basicConfig(level=logging.DEBUG, filename="chatbot.log",
-                    format="%(asctime)s - %(levelname)s - %(message)s")
+configurar_logging(archivo="chatbot.log")
 logger = logging.getLogger(__name__)
 
 app = FastAPI()
@@ -115,22 +120,29 @@ def crear_boton_whatsapp(texto, opciones):
 scheduler = BackgroundScheduler()
 scheduler.start()
 
-def reasignar_pendientes():
-    limite = datetime.now() - timedelta(minutes=5)
-    pendientes = asignaciones.find({"respuesta": None, "fecha": {"$lt": limite}})
-    for p in pendientes:
-        asignar_asesor_humano(p["cliente_id"])
+# Asesores activos en memoria y motor de asignación (ASIGNACION_ESTRATEGIA).
+# Este servidor no cierra los leads aceptados, así que el cupo por asesor no se limita
+padron = PadronAsesores(asesores_col)
+padron.escuchar_cambios()
+motor_asignacion = MotorAsignacion(padron, capacidad=0)
 
-scheduler.add_job(reasignar_pendientes, 'interval', minutes=1)
+# Reasignación de pendientes vencidas, una sola vez por asignación (ver reasignacion.py)
+# Un solo proceso (el líder) reasigna aunque uvicorn corra con varios workers
+lider = Liderazgo(db)
+reasignador = Reasignador(asignaciones, lambda cliente_id: asignar_asesor_humano(cliente_id), lider=lider,
+                          liberar=motor_asignacion.liberar)
+lider.al_ganar(reasignador.notificar)
 
 def asignar_asesor_humano(cliente_id: str):
     estado = obtener_estado(cliente_id)
     if not all(k in estado for k in ["telefono", "nombre", "tipo_auto", "tipo_vehiculo", "modelo", "confirmado"]):
         return
-    asesores = list(asesores_col.find({"activo": True}, {"telefono": 1, "_id": 0}))
-    if not asesores:
+    # Ronda completa sin respuesta: se vuelve a empezar en lugar de quedarse sin asesor
+    elegido, consultados = motor_asignacion.elegir_en_ronda(estado.get("asesores_consultados", []),
+                                                           tipo_auto=estado.get("tipo_auto"))
+    if not elegido:
         return
-    asesor = asesores[0]["telefono"]
+    actualizar_estado(cliente_id, {"asesores_consultados": consultados})
     mensaje_cliente = f"Hola {estado['nombre']} 👋, confirmamos tus datos: {estado['tipo_auto']} {estado['modelo']} ({estado['tipo_vehiculo']}). Un asesor te contactará pronto."
     sends.insert_one({"jid": cliente_id, "message": {"text": mensaje_cliente}, "sent": False})
 
@@ -205,6 +217,12 @@ async def webhook(mensaje: Mensaje):
     sends.insert_one({"jid": cliente_id, "message": {"text": respuesta}, "sent": False})
     return {"respuesta": respuesta}
 
+# El hilo arranca cuando el módulo ya definió asignar_asesor_humano
+@app.on_event("startup")
+def iniciar_reasignador():
+    lider.iniciar()
+    reasignador.iniciar()
+
 # ---------------- RUN ----------------
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=5000)
@@ -0,0 +1,131 @@
+"""Temporizador de vencimientos en memoria para los timeouts de asignación.
+
+Sustituye los trabajos `date` de APScheduler en MongoDBJobStore (un documento
+serializado por asignación, reprogramaciones y lecturas de `scheduler_jobs`) por
+un montículo en memoria dentro del event loop:
+
+- `programar` es un heappush (microsegundos) y `cancelar` borra la clave del
+  diccionario; la entrada del montículo se descarta al salir (cancelación perezosa).
+- La fuente de verdad es el campo `deadline` de cada documento: al arrancar,
+  `recuperar` vuelve a programar los pendientes con una consulta indexada por
+  (status, deadline); los ya vencidos disparan de inmediato.
+- Si dos procesos recuperan la misma asignación, el callback debe cerrar el
+  documento de forma atómica (find_one_and_update con el estado esperado).
+"""
+from datetime import datetime
+from pymongo import ASCENDING
+import asyncio
+import heapq
+import inspect
+import itertools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Temporizador:
+    def __init__(self):
+        self._heap = []                      # (vence en reloj monotónico, secuencia, clave)
+        self._pendientes = {}                # clave -> (secuencia, función, args)
+        self._secuencia = itertools.count()
+        self._cambio = None
+        self._tarea = None
+        self.disparados = 0
+        self.cancelados = 0
+
+    def programar(self, clave: str, vence: datetime, funcion, *args):
+        """Programa (o reprograma) `funcion(*args)` para la fecha UTC `vence`."""
+        secuencia = next(self._secuencia)
+        instante = time.monotonic() + (vence - datetime.utcnow()).total_seconds()
+        self._pendientes[clave] = (secuencia, funcion, args)
+        heapq.heappush(self._heap, (instante, secuencia, clave))
+        # Solo hace falta despertar al ciclo si este vence antes que el que esperaba
+        if self._cambio is not None and self._heap[0][1] == secuencia:
+            self._cambio.set()
+
+    def cancelar(self, clave: str) -> bool:
+        if self._pendientes.pop(clave, None) is None:
+            return False
+        self.cancelados += 1
+        # Compacta si las entradas canceladas dominan el montículo
+        if len(self._heap) > 2 * len(self._pendientes) + 1024:
+            self._heap = [e for e in self._heap if self._vigente(e)]
+            heapq.heapify(self._heap)
+        return True
+
+    def pendientes(self) -> int:
+        return len(self._pendientes)
+
+    def _vigente(self, entrada) -> bool:
+        actual = self._pendientes.get(entrada[2])
+        return actual is not None and actual[0] == entrada[1]
+
+    def vencidos(self, ahora: float | None = None) -> list:
+        """Saca del montículo lo vencido a `ahora`; devuelve [(clave, función, args)]."""
+        ahora = time.monotonic() if ahora is None else ahora
+        listos = []
+        while self._heap and self._heap[0][0] <= ahora:
+            entrada = heapq.heappop(self._heap)
+            if self._vigente(entrada):
+                _, funcion, args = self._pendientes.pop(entrada[2])
+                listos.append((entrada[2], funcion, args))
+        return listos
+
+    def _espera(self) -> float | None:
+        while self._heap and not self._vigente(self._heap[0]):
+            heapq.heappop(self._heap)
+        return max(0.0, self._heap[0][0] - time.monotonic()) if self._heap else None
+
+    async def _ejecutar(self, clave: str, funcion, args):
+        try:
+            resultado = funcion(*args)
+            if inspect.isawaitable(resultado):
+                await resultado
+        except Exception as e:
+            logger.error(f"Error en el vencimiento {clave}: {str(e)}", exc_info=True)
+
+    async def _ciclo(self):
+        while True:
+            self._cambio.clear()
+            try:
+                await asyncio.wait_for(self._cambio.wait(), timeout=self._espera())
+            except asyncio.TimeoutError:
+                pass
+            for clave, funcion, args in self.vencidos():
+                self.disparados += 1
+                asyncio.create_task(self._ejecutar(clave, funcion, args))
+
+    def iniciar(self):
+        """Arranca el ciclo en el event loop actual (llamar desde el startup de FastAPI)."""
+        if self._tarea is None or self._tarea.done():
+            self._cambio = asyncio.Event()
+            self._tarea = asyncio.get_running_loop().create_task(self._ciclo())
+
+    def detener(self):
+        if self._tarea is not None:
+            self._tarea.cancel()
+            self._tarea = None
+
+    def recuperar(self, col, filtro: dict, funcion, argumentos, campo: str = "deadline",
+                  vencimiento_por_defecto=None) -> int:
+        """Programa los documentos pendientes de `col`; `argumentos(doc)` da los args del callback.
+
+        `vencimiento_por_defecto(doc)` cubre documentos anteriores al campo `deadline`.
+        """
+        total = 0
+        for doc in col.find(filtro).sort(campo, ASCENDING):
+            vence = doc.get(campo) or (vencimiento_por_defecto(doc) if vencimiento_por_defecto else None)
+            if vence is None:
+                continue
+            self.programar(str(doc["_id"]), vence, funcion, *argumentos(doc))
+            total += 1
+        logger.info(f"Vencimientos recuperados: {total}")
+        return total
+
+
+def asegurar_indice_vencimiento(col, campo_estado: str = "status", campo: str = "deadline"):
+    try:
+        col.create_index([(campo_estado, ASCENDING), (campo, ASCENDING)], name=f"{campo_estado}_{campo}")
+    except Exception as e:
+        logger.error(f"Error al crear índice de vencimientos: {str(e)}")
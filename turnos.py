@@ -0,0 +1,252 @@
+"""Calendario de turnos de asesores con índice de intervalos.
+
+`activo` se cambiaba a mano en el panel, así que los asesores fuera de turno seguían
+recibiendo preguntas de disponibilidad y quemando timeouts. Cada asesor puede tener
+un documento en `turnos_asesores`:
+
+    {"_id": teléfono normalizado,
+     "semanal": [{"dias": [0, 1, 2, 3, 4], "inicio": "09:00", "fin": "18:00"}, ...],   # 0 = lunes, hora local
+     "excepciones": [{"inicio": datetime UTC, "fin": datetime UTC, "disponible": false}, ...]}
+
+Un turno con `fin` <= `inicio` cruza la medianoche. Las excepciones con
+`disponible: false` (vacaciones, permisos) restan y las `true` (guardias) suman.
+Quien no tiene documento no está sujeto a turnos y siempre cuenta como disponible.
+
+`cargar` convierte todo en intervalos semiabiertos y los barre una vez: bordes
+ordenados y, para cada segmento entre dos bordes, el conjunto congelado de quién
+está dentro, por área y en total. "¿Quién está de turno ahora en Ventas?" es un
+bisect sobre los bordes (O(log n)) más las excepciones vigentes.
+
+Uso: python turnos.py --telefono TEL --semanal "0-4 09:00-18:00" [--semanal "5 10:00-14:00"]
+                      [--ausencia 2026-12-24T00:00/2026-12-26T00:00] [--mongo URI] [--db chatbot_db]
+     python turnos.py --quien [--area Ventas]
+"""
+from bisect import bisect_right
+from collections import Counter
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+from pymongo import MongoClient
+import argparse
+import logging
+import os
+import re
+
+from asignacion import AREA_POR_DEFECTO
+from padron_asesores import normalizar_telefono
+
+logger = logging.getLogger(__name__)
+
+# ------------------ CONFIG ------------------
+COLECCION_TURNOS = "turnos_asesores"
+ZONA = os.getenv("TURNOS_ZONA", "America/Mazatlan")     # hora de la agencia (Culiacán)
+MINUTOS_DIA = 24 * 60
+MINUTOS_SEMANA = 7 * MINUTOS_DIA
+HORA = re.compile(r"^([01]?\d|2[0-3]):([0-5]\d)$")
+
+
+def _minutos(hora: str) -> int:
+    coincide = HORA.match(hora)
+    if not coincide:
+        raise ValueError(f"Hora inválida: {hora}")
+    return int(coincide.group(1)) * 60 + int(coincide.group(2))
+
+
+def intervalos_semanales(semanal: list) -> list:
+    """[(inicio, fin)] en minutos desde el lunes 00:00, partidos en el cierre de la semana."""
+    intervalos = []
+    for turno in semanal:
+        inicio, fin = _minutos(turno["inicio"]), _minutos(turno["fin"])
+        if fin <= inicio:
+            fin += MINUTOS_DIA
+        for dia in turno["dias"]:
+            if not isinstance(dia, int) or not 0 <= dia <= 6:
+                raise ValueError(f"Día inválido: {dia} (0 = lunes ... 6 = domingo)")
+            a, b = dia * MINUTOS_DIA + inicio, dia * MINUTOS_DIA + fin
+            if b <= MINUTOS_SEMANA:
+                intervalos.append((a, b))
+            else:
+                # Domingo en la noche -> lunes en la madrugada
+                intervalos.extend([(a, MINUTOS_SEMANA), (0, b - MINUTOS_SEMANA)])
+    return intervalos
+
+
+class IndiceIntervalos:
+    """Intervalos [inicio, fin) con clave; `en(punto)` devuelve las claves que lo contienen."""
+
+    def __init__(self, intervalos: list):
+        eventos = sorted([(i, 1, c) for i, f, c in intervalos if i < f] + [(f, -1, c) for i, f, c in intervalos if i < f],
+                         key=lambda e: (e[0], e[1]))
+        self._bordes = []
+        self._segmentos = []
+        dentro = Counter()
+        for punto, delta, clave in eventos:
+            dentro[clave] += delta
+            if not dentro[clave]:
+                del dentro[clave]
+            # Varios eventos en el mismo punto comparten segmento: el último conjunto gana
+            if self._bordes and self._bordes[-1] == punto:
+                self._segmentos[-1] = frozenset(dentro)
+            else:
+                self._bordes.append(punto)
+                self._segmentos.append(frozenset(dentro))
+
+    def __len__(self) -> int:
+        return len(self._bordes)
+
+    def en(self, punto) -> frozenset:
+        i = bisect_right(self._bordes, punto) - 1
+        return self._segmentos[i] if i >= 0 else frozenset()
+
+
+VACIO = IndiceIntervalos([])
+
+
+def _utc_ingenua(momento) -> datetime:
+    """Fecha de una excepción como datetime UTC sin zona (como `datetime.utcnow()`)."""
+    if not isinstance(momento, datetime):
+        raise ValueError(f"Fecha inválida: {momento!r}")
+    if momento.tzinfo is not None:
+        momento = momento.astimezone(timezone.utc).replace(tzinfo=None)
+    return momento
+
+
+def validar_excepcion(excepcion: dict) -> dict:
+    """{"inicio", "fin", "disponible"} con fechas UTC ingenuas e inicio < fin."""
+    inicio, fin = _utc_ingenua(excepcion["inicio"]), _utc_ingenua(excepcion["fin"])
+    if inicio >= fin:
+        raise ValueError(f"Excepción con inicio {inicio} posterior o igual a fin {fin}")
+    return {"inicio": inicio, "fin": fin, "disponible": bool(excepcion.get("disponible", False))}
+
+
+def _por_area(intervalos: list, areas: dict) -> dict:
+    """{None: índice con todos, área: índice solo con los de esa área}."""
+    grupos = {None: intervalos}
+    for intervalo in intervalos:
+        grupos.setdefault(areas.get(intervalo[2], AREA_POR_DEFECTO), []).append(intervalo)
+    return {area: IndiceIntervalos(lista) for area, lista in grupos.items()}
+
+
+class Turnos:
+    def __init__(self, db, zona: str = ZONA):
+        self.col = db[COLECCION_TURNOS]
+        self.asesores_col = db["asesores"]
+        self.zona = ZoneInfo(zona)
+        self._indices = ({}, {}, VACIO, frozenset())     # semanal, guardias, ausencias, programados
+        self.recargas = 0
+
+    @property
+    def programados(self) -> frozenset:
+        return self._indices[3]
+
+    def cargar(self, ahora: datetime | None = None):
+        ahora = ahora or datetime.utcnow()
+        semanal, guardias, ausencias = [], [], []
+        programados = set()
+        for doc in self.col.find({}):
+            telefono = doc["_id"]
+            programados.add(telefono)
+            # Un documento mal formado (escrito a mano o antes de validar) no tumba todo el calendario
+            try:
+                semanal.extend((i, f, telefono) for i, f in intervalos_semanales(doc.get("semanal", [])))
+            except (KeyError, TypeError, ValueError) as e:
+                logger.warning(f"Turno semanal inválido para {telefono}, se ignora: {e}")
+            for excepcion in doc.get("excepciones", []):
+                try:
+                    excepcion = validar_excepcion(excepcion)
+                except (KeyError, TypeError, ValueError) as e:
+                    logger.warning(f"Excepción de turno inválida para {telefono}, se ignora: {e}")
+                    continue
+                if excepcion["fin"] <= ahora:
+                    continue        # ya pasó
+                destino = guardias if excepcion.get("disponible") else ausencias
+                destino.append((excepcion["inicio"], excepcion["fin"], telefono))
+        areas = {a["telefono"]: a.get("area", AREA_POR_DEFECTO)
+                 for a in self.asesores_col.find({"telefono": {"$in": list(programados)}}, {"telefono": 1, "area": 1})}
+        # Se publica en una sola asignación: las consultas ven los índices viejos o los nuevos, nunca mezclados
+        self._indices = (_por_area(semanal, areas), _por_area(guardias, areas), IndiceIntervalos(ausencias),
+                         frozenset(programados))
+        self.recargas += 1
+        logger.info(f"Turnos cargados: {len(programados)} asesores, {len(semanal)} intervalos semanales, "
+                    f"{len(guardias) + len(ausencias)} excepciones vigentes")
+
+    def en_turno(self, area: str | None = None, ahora: datetime | None = None) -> frozenset:
+        """Teléfonos con turno en `ahora` (UTC), de un área o de todas; solo asesores con calendario."""
+        ahora = ahora or datetime.utcnow()
+        local = ahora.replace(tzinfo=timezone.utc).astimezone(self.zona)
+        minuto = local.weekday() * MINUTOS_DIA + local.hour * 60 + local.minute
+        semanal, guardias, ausencias, _ = self._indices
+        dentro = semanal.get(area, VACIO).en(minuto)
+        guardia = guardias.get(area, VACIO).en(ahora)
+        if guardia:
+            dentro = dentro | guardia
+        ausentes = ausencias.en(ahora)
+        return dentro - ausentes if ausentes else dentro
+
+    def filtro_fuera_de_turno(self, ahora: datetime | None = None):
+        """Predicado teléfono -> fuera de turno; None si nadie tiene calendario."""
+        programados = self._indices[3]
+        if not programados:
+            return None
+        dentro = self.en_turno(ahora=ahora)
+        return lambda telefono: telefono in programados and telefono not in dentro
+
+
+def guardar_turnos(col, telefono, semanal: list, excepciones: list | None = None) -> str:
+    """Reemplaza el calendario de un asesor (valida horas, días y excepciones antes de escribir)."""
+    intervalos_semanales(semanal)
+    telefono = normalizar_telefono(telefono)
+    cambios = {"semanal": semanal, "actualizado": datetime.utcnow()}
+    if excepciones is not None:
+        cambios["excepciones"] = [validar_excepcion(e) for e in excepciones]
+    col.update_one({"_id": telefono}, {"$set": cambios}, upsert=True)
+    return telefono
+
+
+def agregar_excepcion(col, telefono, inicio: datetime, fin: datetime, disponible: bool = False) -> str:
+    excepcion = validar_excepcion({"inicio": inicio, "fin": fin, "disponible": disponible})
+    telefono = normalizar_telefono(telefono)
+    col.update_one({"_id": telefono},
+                   {"$push": {"excepciones": excepcion},
+                    "$set": {"actualizado": datetime.utcnow()}}, upsert=True)
+    return telefono
+
+
+def _turno_cli(texto: str) -> dict:
+    """Convierte "0-4 09:00-18:00" o "5,6 10:00-14:00" en {"dias", "inicio", "fin"}."""
+    dias_texto, horas = texto.split()
+    dias = []
+    for parte in dias_texto.split(","):
+        a, _, b = parte.partition("-")
+        dias.extend(range(int(a), int(b or a) + 1))
+    inicio, fin = horas.split("-")
+    return {"dias": dias, "inicio": inicio, "fin": fin}
+
+
+def _utc_cli(texto: str, zona: ZoneInfo) -> datetime:
+    return datetime.fromisoformat(texto).replace(tzinfo=zona).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo", default="mongodb://localhost:27017/")
+    parser.add_argument("--db", default="chatbot_db")
+    parser.add_argument("--telefono")
+    parser.add_argument("--semanal", action="append", default=[])
+    parser.add_argument("--ausencia", action="append", default=[], help="INICIO/FIN en hora local, ISO 8601")
+    parser.add_argument("--quien", action="store_true")
+    parser.add_argument("--area")
+    args = parser.parse_args()
+
+    db = MongoClient(args.mongo, serverSelectionTimeoutMS=5000)[args.db]
+    zona = ZoneInfo(ZONA)
+    if args.telefono and args.semanal:
+        logger.info(f"Turnos guardados: {guardar_turnos(db[COLECCION_TURNOS], args.telefono, [_turno_cli(t) for t in args.semanal])}")
+    for ausencia in args.ausencia if args.telefono else []:
+        inicio, fin = ausencia.split("/")
+        agregar_excepcion(db[COLECCION_TURNOS], args.telefono, _utc_cli(inicio, zona), _utc_cli(fin, zona))
+        logger.info(f"Ausencia registrada para {args.telefono}: {inicio} a {fin}")
+    if args.quien:
+        turnos = Turnos(db)
+        turnos.cargar()
+        print(sorted(turnos.en_turno(area=args.area)))